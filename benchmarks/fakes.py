@@ -0,0 +1,123 @@
+import asyncio
+# Internal modules
+import cogs.modules.cluster as cluster
+
+
+"""
+Channel which takes the messages the bot sends instead of Discord. Sending takes latency seconds.
+"""
+class FakeChannel:
+    def __init__(self, channel_id, latency=0):
+        self.id = channel_id
+        self.latency = latency
+        self.messages = 0
+        self.files = 0
+
+    async def send(self, content=None, embed=None, file=None):
+        await asyncio.sleep(self.latency)
+        self.messages += 1
+        if file is not None:
+            # Read it like discord.py would when uploading.
+            file.fp.read()
+            file.close()
+            self.files += 1
+
+
+"""
+The parts of a discord.py bot the cogs use. The bot never becomes ready, so the cogs' own loops never run and the
+benchmark polls the feeds itself.
+"""
+class FakeBot:
+    def __init__(self, loop, send_latency=0):
+        self.loop = loop
+        self.send_latency = send_latency
+        self.channels = {}
+        self.cogs = {}
+        self.cluster = cluster.Cluster()
+        self._ready = asyncio.Event()
+
+    def get_channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(channel_id, self.send_latency)
+        return channel
+
+    async def fetch_channel(self, channel_id):
+        return self.get_channel(channel_id)
+
+    async def wait_until_ready(self):
+        await self._ready.wait()
+
+    @property
+    def messages(self):
+        return sum(channel.messages for channel in self.channels.values())
+
+
+"""
+In-memory stand-in for psql.PSQL holding the subscriptions of the benchmark. Every statement counts as a round trip
+and takes latency seconds. Writes are counted but not applied: the cogs keep the state they write in memory anyway.
+"""
+class MemoryDatabase:
+    def __init__(self, rows, latency=0):
+        self.rows = rows
+        self.latency = latency
+        self.users = 0
+        # Operation -> number of statements.
+        self.round_trips = {}
+
+    async def _round_trip(self, operation):
+        self.round_trips[operation] = self.round_trips.get(operation, 0) + 1
+        await asyncio.sleep(self.latency)
+
+    async def select(self, columns, table, condition=None, args=()):
+        await self._round_trip('select')
+        if 'ANY' in (condition or ''):
+            # The seen entries of new subscriptions (see feeds.load_subscriptions).
+            return [
+                {'id': row['subscription_id'], 'seen': row['seen']} for row in self.rows
+                if row['subscription_id'] in args[0]
+            ]
+        if table.startswith('subscriptions'):
+            return [row for row in self.rows if row['kind'] == args[0]]
+        return []
+
+    async def insert(self, table, columns, values):
+        await self._round_trip('insert')
+
+    async def update(self, table, values, condition=None, args=()):
+        await self._round_trip('update')
+
+    async def execute(self, statement, *args):
+        await self._round_trip('execute')
+        return 'UPDATE 0'
+
+    async def fetch(self, statement, *args):
+        await self._round_trip('fetch')
+        if 'lease_owner' in statement:
+            # Cluster.claim, this process gets every feed.
+            return [{'id': feed_id} for feed_id in args[2]]
+        return []
+
+    def acquire(self):
+        self.users += 1
+        return self
+
+    async def release(self):
+        self.users = max(self.users - 1, 0)
+
+    @property
+    def total_round_trips(self):
+        return sum(self.round_trips.values())
+
+
+"""
+Returns a subscription row as feeds.load_subscriptions reads it from the database, for a feed never polled before.
+"""
+def subscription_row(kind, subscription_id, feed_id, url, channel_id, name):
+    return {
+        'kind': kind, 'subscription_id': subscription_id, 'user_id': subscription_id, 'channel_id': channel_id,
+        'name': name, 'latest': None, 'seen': None, 'feed_id': feed_id, 'url': url, 'etag': None,
+        'last_modified': None, 'next_poll_at': None, 'poll_interval': None, 'update_gap': None,
+        'last_changed_at': None, 'consecutive_failures': 0, 'last_success_at': None, 'last_error': None,
+        'disabled_at': None
+    }
@@ -0,0 +1,283 @@
+"""
+Benchmarks the polling of the RSS and MangaDex cogs against local stand-ins for the feeds, MangaDex, Discord and the
+database, so changes to the fetching, parsing, caching and sending code can be measured the same way every time.
+
+Run from the root of the repository:
+    python3 -m benchmarks.run --feeds 500 --cycles 5
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import aiohttp
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+# Internal modules
+from benchmarks.fakes import FakeBot, MemoryDatabase, subscription_row
+import benchmarks.servers as servers
+import cogs.modules.feeds as feeds
+import cogs.modules.http_client as http_client
+import cogs.modules.metrics as metrics
+import cogs.modules.settings as settings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the polling of the RSS and MangaDex cogs.")
+    parser.add_argument('--kinds', default='rss,mangadex', help="cogs to benchmark, comma separated")
+    parser.add_argument('--feeds', type=int, default=500, help="number of RSS feeds")
+    parser.add_argument('--hosts', type=int, default=50, help="number of hosts the RSS feeds are spread over")
+    parser.add_argument('--subscribers', type=int, default=1, help="subscriptions per RSS feed")
+    parser.add_argument('--users', type=int, default=100, help="number of MangaDex users")
+    parser.add_argument('--mangas', type=int, default=200, help="number of mangas the MangaDex users follow")
+    parser.add_argument('--follows', type=int, default=20, help="mangas followed per MangaDex user")
+    parser.add_argument('--entries', type=int, default=50, help="entries per feed")
+    parser.add_argument('--entry-size', type=int, default=500, help="bytes of text per entry")
+    parser.add_argument('--format', choices=('rss', 'atom', 'mixed'), default='rss', help="format of the RSS feeds")
+    parser.add_argument('--cover-size', default='512x728', help="size of the MangaDex covers in pixels")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds every HTTP response takes")
+    parser.add_argument('--error-rate', type=float, default=0, help="chance of an HTTP request failing with 503")
+    parser.add_argument('--change-rate', type=float, default=0.1, help="chance of a feed getting a new entry per cycle")
+    parser.add_argument('--send-latency', type=float, default=0.05, help="seconds sending a Discord message takes")
+    parser.add_argument('--db-latency', type=float, default=0.001, help="seconds a database round trip takes")
+    parser.add_argument('--workers', type=int, help="parsing.workers, the setting is used if not given")
+    parser.add_argument('--cycles', type=int, default=5, help="measured polling cycles")
+    parser.add_argument('--warmup', type=int, default=1, help="cycles run before measuring")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the synthetic data")
+    parser.add_argument('--settings', help="settings file (see settings_sample) to benchmark, defaults otherwise")
+    parser.add_argument('--json', help="also write the results to this file as JSON")
+    return parser.parse_args(argv)
+
+
+"""
+Returns the settings the bot runs with in the benchmark: the given settings file (or the defaults), with retries sped
+up so failed requests do not stall a cycle, and covers cached in the benchmark's own folder.
+"""
+def benchmark_settings(args):
+    user_settings = {}
+    if args.settings is not None:
+        with open(args.settings, 'r') as settings_file:
+            user_settings = json.load(settings_file)
+
+    overrides = {
+        'retry': {'base_delay': 0.1, 'max_delay': 1, 'max_elapsed': 10},
+        'covers': {'path': 'covers'}
+    }
+    if args.workers is not None:
+        overrides['parsing'] = {'workers': args.workers}
+    for section, values in overrides.items():
+        user_settings.setdefault(section, {}).update(values)
+    return user_settings
+
+
+"""
+Returns the value below which percent % of the values are (nearest rank).
+"""
+def percentile(values, percent):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def peak_memory():
+    if resource is None:
+        return None
+    # Kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def timed(coroutine):
+    start = time.perf_counter()
+    await coroutine
+    return time.perf_counter() - start
+
+
+"""
+Creates the subscriptions of a kind as rows of the in-memory database.
+"""
+def make_rows(kind, args):
+    rows = []
+    if kind == feeds.RSS:
+        for feed in range(args.feeds):
+            for _ in range(args.subscribers):
+                subscription_id = len(rows) + 1
+                rows.append(subscription_row(
+                    kind, subscription_id, feed + 1, servers.feed_url(feed, args.hosts), subscription_id,
+                    f"Feed {feed}"
+                ))
+    else:
+        for user in range(args.users):
+            rows.append(subscription_row(kind, user + 1, user + 1, servers.mangadex_url(user), user + 1, 'MangaDex'))
+    return rows
+
+
+"""
+Runs the polling cycles of one cog and returns what was measured.
+
+A cycle is what the cog does every reload interval in production, but with every feed due at once: save the changes
+of the last cycle and reload the subscriptions, then poll every feed. The messages queued while polling are sent
+afterwards and timed separately, as Discord's rate limits rather than the bot decide how long that takes.
+"""
+async def run_kind(kind, args, port, control):
+    # Imported once the event loop is set, see main.
+    from cogs.mangadex import Mangadex
+    from cogs.rss import RSS
+
+    bot = FakeBot(asyncio.get_event_loop(), send_latency=args.send_latency)
+    database = bot.database = MemoryDatabase(make_rows(kind, args), latency=args.db_latency)
+    http_settings = settings.load()['http']
+    bot.http_client = http_client.HTTPClient(
+        limit = http_settings['limit'],
+        limit_per_host = http_settings['limit_per_host'],
+        dns_cache_ttl = http_settings['dns_cache_ttl'],
+        keepalive_timeout = http_settings['keepalive_timeout'],
+        timeout = http_settings['timeout'],
+        connect_timeout = http_settings['connect_timeout'],
+        resolver = servers.LocalResolver(port)
+    )
+
+    if kind == feeds.RSS:
+        cog = RSS(bot)
+        reload_loop = cog.look_for_updates_rss
+    else:
+        cog = Mangadex(bot)
+        reload_loop = cog.look_for_updates_manga
+
+    url = f"http://127.0.0.1:{port}"
+    cycles = []
+    try:
+        for cycle in range(args.warmup + args.cycles):
+            async with control.post(f"{url}/_cycle?n={cycle}"):
+                pass
+            async with control.get(f"{url}/_stats") as resp:
+                requests_before = (await resp.json())['requests']
+            round_trips_before = database.total_round_trips
+            bytes_before = metrics.DOWNLOADED_BYTES.total()
+            messages_before = bot.messages
+
+            start = time.perf_counter()
+            reload_seconds = await timed(reload_loop(bot))
+            polls = await asyncio.gather(*(timed(cog.poll_feed(feed_id)) for feed_id in list(cog.subscriptions)))
+            cycle_seconds = time.perf_counter() - start
+            drain_seconds = await timed(asyncio.gather(*(
+                queue.join() for queue in list(cog.dispatcher.queues.values())
+            )))
+
+            async with control.get(f"{url}/_stats") as resp:
+                requests = (await resp.json())['requests'] - requests_before
+            if cycle >= args.warmup:
+                cycles.append({
+                    'seconds': cycle_seconds,
+                    'reload_seconds': reload_seconds,
+                    'drain_seconds': drain_seconds,
+                    'polls': polls,
+                    'requests': requests,
+                    'downloaded_bytes': metrics.DOWNLOADED_BYTES.total() - bytes_before,
+                    'round_trips': database.total_round_trips - round_trips_before,
+                    'messages': bot.messages - messages_before
+                })
+    finally:
+        reload_loop.cancel()
+        cog.poll_due_feeds.cancel()
+        await cog.close()
+
+    polls = [seconds for cycle in cycles for seconds in cycle['polls']]
+    cycle_seconds = [cycle['seconds'] for cycle in cycles]
+    return {
+        'kind': kind,
+        'feeds': len(cycles[0]['polls']) if cycles else 0,
+        'cycles': len(cycles),
+        'feeds_per_second': len(polls) / sum(cycle_seconds) if cycle_seconds else 0,
+        'cycle_p50': percentile(cycle_seconds, 50),
+        'cycle_p99': percentile(cycle_seconds, 99),
+        'poll_p50': percentile(polls, 50),
+        'poll_p99': percentile(polls, 99),
+        'reload_p50': percentile([cycle['reload_seconds'] for cycle in cycles], 50),
+        'drain_p50': percentile([cycle['drain_seconds'] for cycle in cycles], 50),
+        'requests_per_cycle': sum(cycle['requests'] for cycle in cycles) / max(len(cycles), 1),
+        'downloaded_per_cycle': sum(cycle['downloaded_bytes'] for cycle in cycles) / max(len(cycles), 1),
+        'round_trips_per_cycle': sum(cycle['round_trips'] for cycle in cycles) / max(len(cycles), 1),
+        'messages_per_cycle': sum(cycle['messages'] for cycle in cycles) / max(len(cycles), 1),
+        'peak_memory_mb': peak_memory()
+    }
+
+
+def print_results(result, args):
+    print(f"{result['kind']}: {result['feeds']} feeds, {result['cycles']} cycles (after {args.warmup} warmup)")
+    print(f"  feeds/sec             {result['feeds_per_second']:.1f}")
+    print(f"  cycle p50 / p99       {result['cycle_p50']:.3f} s / {result['cycle_p99']:.3f} s")
+    print(f"  poll p50 / p99        {result['poll_p50'] * 1000:.1f} ms / {result['poll_p99'] * 1000:.1f} ms")
+    print(f"  reload p50            {result['reload_p50'] * 1000:.1f} ms")
+    print(f"  send queue drain p50  {result['drain_p50']:.3f} s")
+    print(f"  messages per cycle    {result['messages_per_cycle']:.1f}")
+    print(f"  requests per cycle    {result['requests_per_cycle']:.1f}")
+    print(f"  downloaded per cycle  {result['downloaded_per_cycle'] / 1024:.1f} KB")
+    print(f"  DB round trips/cycle  {result['round_trips_per_cycle']:.1f}")
+    if result['peak_memory_mb'] is not None:
+        print(f"  peak RSS so far       {result['peak_memory_mb']:.1f} MB")
+
+
+async def benchmark(args, port):
+    results = []
+    async with aiohttp.ClientSession() as control:
+        for kind in args.kinds.split(','):
+            result = await run_kind(kind.strip(), args, port, control)
+            print_results(result, args)
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    width, height = (int(size) for size in args.cover_size.lower().split('x'))
+
+    # The feeds are served by another process so serving them does not take time from the bot.
+    port = servers.free_port()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target = servers.serve,
+        args = (port, ready),
+        kwargs = {
+            'entries': args.entries, 'entry_size': args.entry_size, 'latency': args.latency,
+            'error_rate': args.error_rate, 'change_rate': args.change_rate, 'feed_format': args.format,
+            'mangas': args.mangas, 'follows': args.follows, 'cover_size': (width, height), 'seed': args.seed
+        },
+        daemon = True
+    )
+    server.start()
+
+    # The bot reads its settings (and keeps its cache) in the working directory.
+    repository = os.getcwd()
+    sys.path.insert(0, repository)
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'settings'), 'w') as settings_file:
+            json.dump(benchmark_settings(args), settings_file)
+        os.chdir(directory)
+
+        # discord.py 1.x binds its loops to the event loop current when the cogs are imported.
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            if not ready.wait(timeout=30):
+                raise RuntimeError("The benchmark server did not start.")
+            results = loop.run_until_complete(benchmark(args, port))
+        finally:
+            loop.close()
+            os.chdir(repository)
+            server.terminate()
+
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump({'arguments': vars(args), 'results': results}, json_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+from io import BytesIO
+import asyncio
+import json
+import random
+import socket
+from PIL import Image
+
+# Every host of the benchmarks ends with this and is served by the local server.
+DOMAIN = '.test'
+# Host of the MangaDex feeds, API and covers. Must be as long as mangadex.org, the cog cuts the API link out of the
+# manga link by position.
+MANGADEX_HOST = 'mangadex.test'
+
+
+"""
+Resolves every benchmark host to the local server, so the bot reaches it with the URLs it would see in production.
+"""
+class LocalResolver(AbstractResolver):
+    def __init__(self, port):
+        self.port = port
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        if not host.endswith(DOMAIN):
+            raise OSError(f"{host} is not a benchmark host")
+        return [{
+            'hostname': host, 'host': '127.0.0.1', 'port': self.port,
+            'family': socket.AF_INET, 'proto': 0, 'flags': socket.AI_NUMERICHOST
+        }]
+
+    async def close(self):
+        pass
+
+
+"""
+Returns the URL of an RSS feed. Feeds are spread over hosts hosts, like real feeds are spread over many sites.
+"""
+def feed_url(feed, hosts):
+    return f"http://feeds{feed % hosts}{DOMAIN}/feeds/{feed}"
+
+
+def mangadex_url(user):
+    return f"http://{MANGADEX_HOST}/rss/follows/{user}"
+
+
+"""
+Serves synthetic RSS/Atom feeds and a stand-in for MangaDex (follow feeds, API and covers).
+
+Every feed has entries entries, newest first, of about entry_size bytes each. The content only changes when the
+benchmark starts a new cycle (POST /_cycle): every feed then gets a new entry with a chance of change_rate, decided by
+seed so every run serves exactly the same data. Responses have an ETag and conditional requests of unchanged feeds get
+304. Every request waits latency seconds and fails with 503 with a chance of error_rate.
+"""
+class FakeServices:
+    def __init__(self, entries=50, entry_size=500, latency=0.05, error_rate=0, change_rate=0.1, feed_format='rss',
+                 mangas=200, follows=20, cover_size=(512, 728), seed=1):
+        self.entries = entries
+        self.entry_size = entry_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.change_rate = change_rate
+        self.feed_format = feed_format
+        self.mangas = mangas
+        self.follows = follows
+        self.cover_size = cover_size
+        self.seed = seed
+        self.cycle = 0
+        self.requests = 0
+        self.sent_bytes = 0
+        self.random = random.Random(seed)
+        # Feed key -> (cycle, version) of the last version computed, versions only ever grow with the cycle.
+        self.versions = {}
+        self.covers = {}
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/_cycle', self.handle_cycle)
+        app.router.add_get('/_stats', self.handle_stats)
+        app.router.add_get('/feeds/{feed}', self.handle_feed)
+        app.router.add_get('/rss/follows/{user}', self.handle_follows)
+        app.router.add_get('/api/v2/title/{manga}', self.handle_manga)
+        app.router.add_get('/covers/{manga}.jpg', self.handle_cover)
+        return app
+
+    """
+    Number of entries a feed has gained up to the current cycle.
+    """
+    def version(self, key):
+        cycle, version = self.versions.get(key, (0, 0))
+        for next_cycle in range(cycle + 1, self.cycle + 1):
+            if random.Random(f"{self.seed}-{key}-{next_cycle}").random() < self.change_rate:
+                version += 1
+        self.versions[key] = (self.cycle, version)
+        return version
+
+    async def respond(self, request, body, content_type, etag=None):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.random.random() < self.error_rate:
+            return web.Response(status=503)
+        if etag is not None and request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+
+        body = body()
+        self.sent_bytes += len(body)
+        headers = {'ETag': etag} if etag is not None else {}
+        return web.Response(body=body, content_type=content_type, headers=headers)
+
+    def padding(self, number):
+        text = f"Entry {number} of a synthetic feed. "
+        return (text * (self.entry_size // len(text) + 1))[:self.entry_size]
+
+    def rss(self, title, items):
+        body = ''.join(
+            f"<item><title>{item['title']}</title><link>{item['link']}</link><guid>{item['link']}</guid>"
+            f"{item.get('extra', '')}<description>&lt;p&gt;{item['description']}&lt;/p&gt;</description></item>"
+            for item in items
+        )
+        return (
+            f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>{title}</title>'
+            f'<link>http://example{DOMAIN}/</link><description>{title}</description>{body}</channel></rss>'
+        ).encode()
+
+    def atom(self, title, items):
+        body = ''.join(
+            f"<entry><title>{item['title']}</title><link href=\"{item['link']}\"/><id>{item['link']}</id>"
+            f"<updated>2020-01-01T00:00:00Z</updated><summary>{item['description']}</summary></entry>"
+            for item in items
+        )
+        return (
+            f'<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom"><title>{title}</title>'
+            f'<link href="http://example{DOMAIN}/"/><id>http://example{DOMAIN}/</id>'
+            f'<updated>2020-01-01T00:00:00Z</updated>{body}</feed>'
+        ).encode()
+
+    async def handle_cycle(self, request):
+        self.cycle = int(request.query['n'])
+        return web.json_response({'cycle': self.cycle})
+
+    async def handle_stats(self, request):
+        return web.json_response({'requests': self.requests, 'sent_bytes': self.sent_bytes})
+
+    async def handle_feed(self, request):
+        feed = int(request.match_info['feed'])
+        version = self.version(f"feed-{feed}")
+
+        def body():
+            items = [{
+                'title': f"Feed {feed} entry {number}",
+                'link': f"http://example{DOMAIN}/{feed}/{number}",
+                'description': self.padding(number)
+            } for number in range(version + self.entries, version, -1)]
+            atom = self.feed_format == 'atom' or (self.feed_format == 'mixed' and feed % 2)
+            return self.atom(f"Feed {feed}", items) if atom else self.rss(f"Feed {feed}", items)
+
+        content_type = 'application/atom+xml' if self.feed_format == 'atom' else 'application/rss+xml'
+        return await self.respond(request, body, content_type, etag=f'"{feed}-{version}"')
+
+    async def handle_follows(self, request):
+        user = int(request.match_info['user'])
+        version = self.version(f"user-{user}")
+        followed = random.Random(f"{self.seed}-follows-{user}").sample(range(self.mangas), min(self.follows, self.mangas))
+
+        def body():
+            items = []
+            for number in range(version + self.entries, version, -1):
+                manga = followed[number % len(followed)]
+                items.append({
+                    'title': f"Manga {manga} - Chapter {number}",
+                    'link': f"http://{MANGADEX_HOST}/chapter/{user}-{number}",
+                    'extra': f"<mangaLink>http://{MANGADEX_HOST}/title/{manga}</mangaLink>",
+                    'description': self.padding(number)
+                })
+            return self.rss(f"MangaDex follows of {user}", items)
+
+        return await self.respond(request, body, 'application/rss+xml', etag=f'"{user}-{version}"')
+
+    async def handle_manga(self, request):
+        manga = int(request.match_info['manga'])
+
+        def body():
+            return json.dumps({'data': {
+                'title': f"Manga {manga}", 'mainCover': f"http://{MANGADEX_HOST}/covers/{manga}.jpg"
+            }}).encode()
+
+        return await self.respond(request, body, 'application/json')
+
+    async def handle_cover(self, request):
+        manga = int(request.match_info['manga'])
+
+        def body():
+            if manga not in self.covers:
+                cover_random = random.Random(f"{self.seed}-cover-{manga}")
+                colour = tuple(cover_random.randrange(256) for _ in range(3))
+                image = Image.effect_noise(self.cover_size, 64).convert('RGB')
+                image.paste(colour, (0, 0, self.cover_size[0] // 2, self.cover_size[1] // 2))
+                data = BytesIO()
+                image.save(data, 'JPEG', quality=90)
+                self.covers[manga] = data.getvalue()
+            return self.covers[manga]
+
+        return await self.respond(request, body, 'image/jpeg')
+
+
+"""
+Runs the services on 127.0.0.1:port until the process is stopped. Meant to run in its own process so serving the
+feeds does not take time from the bot being measured. ready is an event set once the server accepts connections.
+"""
+def serve(port, ready, **options):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runner = web.AppRunner(FakeServices(**options).app(), access_log=None)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    ready.set()
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(runner.cleanup())
+
+
+"""
+Returns a free local port for the server.
+"""
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
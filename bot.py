@@ -1,11 +1,26 @@
+import argparse
 import os
 from discord.ext import commands
+# Internal modules
+import cogs.modules.cluster as cluster
 
 with open('token', 'r') as token_file:
     token = token_file.read()
 
-
-bot = commands.Bot(command_prefix = '!')
+# Every process of the bot is started with its own index (see README).
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument('--process-index', type=int, help="index (from 0) of this process")
+arg_parser.add_argument('--process-count', type=int, help="number of processes the bot runs as")
+args, _ = arg_parser.parse_known_args()
+bot_cluster = cluster.from_settings(process_index=args.process_index, process_count=args.process_count)
+
+if bot_cluster.sharded:
+    bot = commands.AutoShardedBot(
+        command_prefix = '!', shard_count = bot_cluster.shard_count, shard_ids = bot_cluster.shard_ids
+    )
+else:
+    bot = commands.Bot(command_prefix = '!')
+bot.cluster = bot_cluster
 
 @bot.event
 async def on_ready():
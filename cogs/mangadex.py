@@ -1,30 +1,135 @@
-import json
-from io import BytesIO
+import time
 from discord.ext import commands, tasks
 import discord
-import feedparser
 # Internal modules
+import cogs.modules.cluster as cluster
+import cogs.modules.dispatch as dispatch
+import cogs.modules.feeds as feeds
+import cogs.modules.health as health
+import cogs.modules.http_client as http_client
+import cogs.modules.manga_cache as manga_cache
+import cogs.modules.metrics as metrics
+import cogs.modules.parsing as parsing
+import cogs.modules.poller as poller
 import cogs.modules.psql as psql
 import cogs.modules.rss_parser as rss_parser
 import cogs.modules.images as images
+import cogs.modules.scheduler as scheduler
+import cogs.modules.settings as settings
+import cogs.modules.snapshot as snapshot
 
 class Mangadex(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-        # Import database settings from file and set up connection.
-        with open('psql', 'r') as db_file:
-            db_settings = json.load(db_file)
-            self.psql = psql.PSQL(
-                db_settings["host"],
-                db_settings["username"],
-                db_settings["password"],
-                db_settings["database"],
-                db_settings["port"]
-            )
-
-        # Start looking for updates as soon as the bot is ready every 15 minutes.
+        # Shared database connection pool owned by the bot.
+        self.psql = psql.get_database(self.bot).acquire()
+        # Changes found while polling, written all at once every time the subscriptions are reloaded.
+        self.chapter_updates = feeds.latest_buffer(self.psql)
+        self.validator_updates = feeds.validator_buffer(self.psql)
+        self.fetch_stats = feeds.stats_buffer(self.psql)
+        self.schedule_updates = feeds.schedule_buffer(self.psql)
+        self.health_updates = feeds.health_buffer(self.psql)
+
+        # Which feeds this process polls, owned by the bot.
+        self.cluster = cluster.get_cluster(self.bot)
+        # The buffers by name, saved to a snapshot when the cog is unloaded.
+        self.buffers = {
+            'latest': self.chapter_updates,
+            'validators': self.validator_updates,
+            'stats': self.fetch_stats,
+            'schedule': self.schedule_updates,
+            'health': self.health_updates
+        }
+        # Changes which could not be saved to the database when the bot last stopped are saved by the first reload.
+        self.snapshot_path = snapshot.get_path(feeds.MANGADEX, self.cluster.process_index)
+        snapshot.restore(self.snapshot_path, self.buffers, max_age=self.cluster.lease_seconds)
+        # Shared HTTP session owned by the bot.
+        self.http_client = http_client.get_client(self.bot).acquire()
+        # Shared pool of processes parsing the feeds, owned by the bot.
+        self.parser = parsing.get_parser(self.bot).acquire()
+        # Sends the updates in the background, shared by every cog.
+        self.dispatcher = dispatch.get_dispatcher(self.bot).acquire()
+        # Cover images and manga data already downloaded, owned by the bot.
+        self.covers = images.get_cover_cache(self.bot)
+        self.manga_cache = manga_cache.get_manga_cache(self.bot)
+        # How the strip of cover images sent with the updates is built.
+        self.compositor = settings.load()['compositor']
+        # Strips already built, users following the same mangas often get the same strip.
+        self.strips = images.StripCache(size=self.compositor['strip_cache_size'])
+
+        # Limits how many feeds are checked at the same time.
+        poller_settings = settings.load()['poller']
+        self.poller = poller.Poller(
+            concurrency = poller_settings['concurrency'],
+            per_host = poller_settings['per_host']
+        )
+
+        # Decides when each feed is polled, every 15 minutes until it has learned how often the feed changes.
+        scheduler_settings = settings.load()['scheduler']
+        self.scheduler = scheduler.Scheduler(
+            default_interval = scheduler_settings['mangadex_interval'],
+            min_interval = scheduler_settings['min_interval'],
+            max_interval = scheduler_settings['max_interval']
+        )
+        # Feed ID -> subscriptions (users) of the feed.
+        self.subscriptions = {}
+        self.polls = set()
+        # Backs off failing feeds and disables dead ones.
+        self.health = health.get_health()
+        # Feed ID -> seconds until the host of the feed is tried again, for feeds not polled because it is down.
+        self.host_down = {}
+        # Users of the feeds disabled since the last reload, they are told at the next reload.
+        self.disabled = []
+        # Seconds the first polls are spread over.
+        self.warmup = settings.load()['startup']['warmup']
+
+        # Start looking for updates as soon as the bot is ready.
+        self.look_for_updates_manga.change_interval(seconds=scheduler_settings['reload_interval'])
         self.look_for_updates_manga.start(self.bot)
+        self.poll_due_feeds.start()
+
+    """
+    Stops looking for updates when the cog is unloaded and closes it.
+    """
+    def cog_unload(self):
+        self.look_for_updates_manga.cancel()
+        self.poll_due_feeds.cancel()
+        for task in self.polls:
+            task.cancel()
+        # Keep the changes in case there is no time left to save them to the database.
+        snapshot.save(self.snapshot_path, self.buffers)
+        self.bot.loop.create_task(self.close())
+
+    """
+    Saves all buffered changes, gives up the feeds and lets go of the shared HTTP session, dispatcher and database
+    pool.
+    """
+    async def close(self):
+        try:
+            await self.flush()
+            if not any(buffer.pending for buffer in self.buffers.values()):
+                snapshot.discard(self.snapshot_path)
+            # Let another process take over the feeds right away.
+            await self.cluster.release(self.psql, self.subscriptions)
+        finally:
+            await self.http_client.release()
+            await self.parser.release()
+            await self.dispatcher.release()
+            await self.psql.release()
+
+    """
+    Writes the changes buffered during a polling cycle to the database.
+    """
+    async def flush(self):
+        try:
+            await self.chapter_updates.flush()
+            await self.validator_updates.flush()
+            await self.fetch_stats.flush()
+            await self.schedule_updates.flush()
+            await self.health_updates.flush()
+        except Exception as error:
+            print(f"Failed to save MangaDex updates to database: {error}")
 
 
     """
@@ -40,7 +145,7 @@ class Mangadex(commands.Cog):
         database = self.psql
 
         # Check if valid URL
-        resp = await rss_parser.get_rss_feed(rss_url)
+        resp = await rss_parser.get_rss_feed(self.http_client.session, rss_url)
         if resp['status'] != 200:
             if resp['status'] == -1:
                 if resp['error'] == 'invalid_url_error':
@@ -49,6 +154,8 @@ class Mangadex(commands.Cog):
                     await ctx.send(f'Error: Could not connect to {rss_url}.')
                 if resp['error'] == 'retry_error':
                     await ctx.send(f'Error: Could not connect to {rss_url} after 5 attempts.')
+                if resp['error'] in ('http_error', 'size_error', 'content_type_error', 'host_down_error'):
+                    await ctx.send(resp['data'])
 
                 return print(resp['error'])
             else:
@@ -57,29 +164,25 @@ class Mangadex(commands.Cog):
                 return print(resp['error'])
 
         try:
-            # Connect to the database and look up requesting user.
-            select = database.select(
-                table = "mangadex",
-                columns = "*",
-                condition = f"WHERE user_id = {ctx.author.id}"
-            )
-
-            if len(select) == 0:
+            # Look up the feed (added if new) and the requesting user's subscription. The validators are not saved, the
+            # first poll has to download the feed to save the latest chapter.
+            feed_id = await feeds.get_feed_id(database, rss_url)
+            # The feed works again, do not let a failure from before overwrite that.
+            self.health_updates.pending.pop(feed_id, None)
+            subscription = await feeds.find_subscription(database, feeds.MANGADEX, ctx.author.id, 'MangaDex')
+
+            if subscription is None:
                 # User was not found.
-                # Add URL, ID and channel ID (the request came from) to the database.
-                database.insert(
-                    table = "mangadex",
-                    columns = "rss_feed, user_id, channel_id",
-                    values = f"'{rss_url}', {ctx.author.id}, {ctx.channel.id}"
+                # Add the subscription with the channel ID (the request came from) to the database.
+                await feeds.add_subscription(
+                    database, feeds.MANGADEX, ctx.author.id, ctx.channel.id, 'MangaDex', feed_id, None
                 )
                 await ctx.send("Url has been saved. All updates will be sent to this channel.")
             else:
                 # The user was found.
                 # Update the URL and the channel ID (the request came from).
-                database.update(
-                    table = "mangadex",
-                    values = f"rss_feed='{rss_url}', channel_id={ctx.channel.id}",
-                    condition = f"WHERE user_id = {ctx.author.id}"
+                await feeds.update_subscription(
+                    database, subscription['subscription_id'], feed_id, ctx.channel.id, None
                 )
                 await ctx.send("URL has been updated. All updates will be sent to this channel.")
         except Exception as error:
@@ -88,251 +191,344 @@ class Mangadex(commands.Cog):
 
 
     """
-    Function that runs every 15 minutes, responsible for sending
-    updates to the users with new chapters to read.
+    Saves what has changed since the last run and reloads the subscriptions (every 5 minutes by default) so the
+    scheduler picks up new and removed users.
     """
-    @tasks.loop(seconds=900)
+    @tasks.loop(minutes=5)
     async def look_for_updates_manga(self, bot, *args):
-        self.bot = bot
-        database = self.psql
+        with metrics.RELOAD_SECONDS.time(kind=feeds.MANGADEX):
+            self.bot = bot
+            database = self.psql
+
+            # Save the new state of every user polled since the last run in one go.
+            await self.flush()
+            self.notify_disabled()
+
+            # Get all users from database whom we are looking up chapters for.
+            try:
+                subscriptions = await feeds.load_subscriptions(database, feeds.MANGADEX, self.subscriptions)
+                # Only keep the feeds this process polls when the bot runs as several processes.
+                self.subscriptions = await self.cluster.claim(database, subscriptions)
+            except Exception as error:
+                return print(f"Failed to connect to databse: {error}")
+
+            # Feeds due when the bot starts are not all polled at once.
+            warmup = self.warmup if not self.scheduler.entries else 0
+            feeds.schedule_subscriptions(self.scheduler, self.subscriptions, warmup)
 
-        # Get all users from database whom we are looking up chapters for.
+    """
+    Tells every user whose feed has been disabled since the last reload.
+    """
+    def notify_disabled(self):
+        disabled, self.disabled = self.disabled, []
+        for user in disabled:
+            self.dispatcher.send(user['channel_id'], health.disabled_message(
+                user['user_id'], [user], '`!setdexurl https://mangadex.org/rss/follows/...`'
+            ))
+
+    """
+    Starts polling every user's feed as soon as it is due.
+    """
+    @tasks.loop(seconds=0)
+    async def poll_due_feeds(self):
+        for feed_id in await self.scheduler.wait_due():
+            task = self.bot.loop.create_task(self.poll_feed(feed_id))
+            self.polls.add(task)
+            task.add_done_callback(self.polls.discard)
+
+    """
+    Checks a feed for new chapters for every user following it and schedules its next poll based on whether any of
+    them got something new. A feed which failed is polled again later the more often it failed in a row, and no more
+    once it has been disabled.
+    """
+    async def poll_feed(self, feed_id):
+        start = time.monotonic()
+        changed = False
+        hints = []
+        users = self.subscriptions.get(feed_id, [])
         try:
-            select = database.select(table = "mangadex", columns = "*")
+            for user in users:
+                newest = user['seen'].newest
+                async with self.poller.limit(user['url']):
+                    hints.append(await self.check_user(user))
+                changed = changed or newest != user['seen'].newest
         except Exception as error:
-            return print(f"Failed to connect to databse: {error}")
+            print(f"Failed to check for new chapters: {error!r}")
+        finally:
+            if any(user['disabled_at'] is not None for user in users):
+                self.disable_feed(feed_id, users)
+            else:
+                hints = [hint for hint in hints if hint is not None]
+                # A host that is down is not the feed's fault, it is polled again once the host is tried again.
+                retry_in = self.host_down.pop(feed_id, None)
+                if retry_in is not None:
+                    delays = [retry_in]
+                else:
+                    delays = [self.health.backoff(user) for user in users]
+                    delays = [delay for delay in delays if delay is not None]
+                if not delays:
+                    entry = self.scheduler.reschedule(feed_id, changed, max(hints) if hints else None)
+                else:
+                    entry = self.scheduler.postpone(feed_id, max(delays))
+                if entry is not None:
+                    feeds.set_schedule(self.schedule_updates, feed_id, entry)
+            metrics.POLL_SECONDS.observe(time.monotonic() - start, kind=feeds.MANGADEX)
 
-        # No data (no user has it set up yet).
-        if len(select) == 0:
-            return print("No user set up yet. (Mangadex)")
-        else:
-            # Loop all users.
-            for user in select:
-                # User's data.
-                user_id = user[0]
-                rss_url = user[1]
-                latest_chapter = user[2]
-                channel = self.bot.get_channel(user[3])
-
-                # Get rss data async
-                resp = await rss_parser.get_rss_feed(rss_url)
-                # Failed to get data
-                if resp['status'] != 200:
-                    if resp['status'] == -1:
-                        if resp['error'] == 'invalid_url_error':
-                            await channel.send(f'Error: Your URL is not valid <@{user_id}>.')
-                        if resp['error'] == 'connection_error':
-                            await channel.send(f'Error: Could not get updates for <@{user_id}>. Connection failed.')
-                        if resp['error'] == 'retry_error':
-                            await channel.send(f'Error: Could not get updates for <@{user_id}>\' after 5 attempts.')
-
-                        print(resp['error'])
-                        continue
+    """
+    Stops polling a feed which failed too many times in a row. Its users are told at the next reload.
+    """
+    def disable_feed(self, feed_id, users):
+        print(f"Disabled {users[0]['url']} after {max(user['consecutive_failures'] for user in users)} failures.")
+        self.scheduler.remove(feed_id)
+        if self.subscriptions.get(feed_id) is users:
+            del self.subscriptions[feed_id]
+        self.disabled.extend(users)
+
+    """
+    Checks a user's feed for new chapters and sends them to the user's channel. Returns how long the feed asks not to
+    be polled again, if it does (see scheduler.feed_hint). Failures to get the feed are only recorded (see
+    health.FeedHealth), the user is not told about every single one. A feed on a host that is down (see
+    health.HostBreaker) was not requested at all, that does not count as a failure.
+    """
+    async def check_user(self, user):
+        # User's data.
+        user_id = user['user_id']
+        rss_url = user['url']
+        channel_id = user['channel_id']
+
+        # Get rss data async, only if it has changed since the last time. The feed is parsed while it is downloaded and
+        # only up to the chapters already seen (or one past the 100 chapters looked at below).
+        start = time.monotonic()
+        resp = await rss_parser.get_rss_feed(
+            self.http_client.session, rss_url, etag=user['etag'], last_modified=user['last_modified'],
+            make_stream=lambda: parsing.FeedStream(is_known=lambda entry: feeds.has_seen(user, entry, 'id'), limit=101)
+        )
+        seconds = time.monotonic() - start
+        feeds.set_fetch_stats(self.fetch_stats, user['feed_id'], resp['status'], seconds)
+        metrics.record_fetch(feeds.MANGADEX, user['feed_id'], resp['status'], seconds)
+        # Nothing has changed since the last time.
+        if resp['status'] == 304:
+            self.health.success(self.health_updates, [user])
+            return resp['max_age']
+        if resp['status'] == -1 and resp['error'] == 'host_down_error':
+            self.host_down[user['feed_id']] = resp['retry_in']
+            return
+        # Failed to get data
+        if resp['status'] != 200:
+            self.health.failure(self.health_updates, [user], resp['error'] if resp['status'] == -1 else 'http_error')
+            return
+
+        # Parse data, unless it was already parsed while downloading.
+        try:
+            feed = resp['feed'] if resp['feed'] is not None else await self.parser.parse(resp['data'])
+        except Exception as error:
+            print(f"Failed to parse {rss_url}: {error!r}")
+            self.health.failure(self.health_updates, [user], 'parse_error')
+            return
+        self.health.success(self.health_updates, [user])
+
+        # Chapters the user has not seen yet.
+        new_chapters = feeds.new_entries(user, feed['entries'], 'id')
+
+        if feeds.is_new(user):
+            # First time looking up chapters.
+            # Save the chapters to database.
+            feeds.mark_seen(self.chapter_updates, user, feed['entries'], feed['entries'][0]['id'])
+            feeds.set_validators(self.validator_updates, [user], resp['etag'], resp['last_modified'])
+            self.dispatcher.send(channel_id, "Latest chapters has been saved and you will be informed of updates in the future.")
+
+        elif new_chapters:
+            # Users has updates.
+            updates = {}
+            count = 0 # In case last seen chapter is of a manga no longer tracked.
+            error_message = None
+            done = False
+            end_of_feed = False
+
+            # Loop all new chapters.
+            for chapter in new_chapters:
+                # Add chapter to list of new ones and prepare embed data.
+                count += 1
+                manga_link = chapter['mangalink']
+
+                if not manga_link in updates:
+                    # Prepare data for embed (step 1: get manga data, not just this chapter, shared by every user).
+                    api_link = f"{manga_link[:20]}/api/v2/{manga_link[21:]}"
+                    data = await self.manga_cache.get(self.http_client.session, api_link)
+                    if data['status'] != 200:
+                        if data['status'] == -1:
+                            if data['error'] == 'invalid_url_error':
+                                self.dispatcher.send(channel_id, f'Error: One of <@{user_id}> updates had an invalid url.\n{manga_link}')
+                                print(data['error'])
+                                continue
+                            if data['error'] == 'connection_error':
+                                self.dispatcher.send(channel_id, f'Error: Could not get updates for <@{user_id}>. Connection failed.')
+                            if data['error'] == 'retry_error':
+                                self.dispatcher.send(channel_id, f'Error: Could not get updates for <@{user_id}>\' after 5 attempts.')
+                            if data['error'] in ('http_error', 'size_error', 'content_type_error', 'host_down_error'):
+                                self.dispatcher.send(channel_id, f'Error: Could not get updates for <@{user_id}>. {data["data"]}')
+
+                            return print(data['error'])
+                        else:
+                            # Should not happen?
+                            self.dispatcher.send(channel_id, 'Unhandled error. Check console for error message.')
+                            return print(data['error'])
+
+                    manga_data = data['data']
+
+                    # Prepare data for embed (step 2: store data).
+                    updates[manga_link] = {
+                        'description': chapter['summary'],
+                        'thumbnail':   manga_data['mainCover'],
+                        'author_name': manga_data['title'],
+                        'author_link': manga_link
+                    }
+
+
+                if not "chapters" in updates[manga_link]:
+                    # Place holder for chapters for this manga.
+                    updates[manga_link]["chapters"] = []
+
+                if not "image" in  updates[manga_link]:
+                    # Cover image for this manga in Pillow (PIL) format, downloaded only if it is not cached.
+                    image_data = await images.get_image(
+                        self.http_client.session, updates[manga_link]['thumbnail'], self.covers
+                    )
+                    if image_data['status'] != 200:
+                        if image_data['status'] == -1:
+                            return print(f"Failed to get cover image:\n{image_data['error']}")
+                        else:
+                            # Should not happen?
+                            self.dispatcher.send(channel_id, 'Unhandled error. Check console for error message.')
+                            return print(image_data['error'])
                     else:
-                        # Should not happen?
-                        await channel.send('Unhandled error. Check console for error message.')
-                        return print(resp['error'])
-
-                # Parse data
-                try:
-                    feed = feedparser.parse(resp['data'])
-                except Exception as error:
-                    return await channel.send(f"Failed to parse the RSS:\n{error}")
-
-                if latest_chapter is None:
-                    # First time looking up chapters.
-                    # Save latest chapter's ID to database.
-                    database.update(
-                        table = "mangadex",
-                        values = f"chapter_id='{feed['entries'][0]['id']}'",
-                        condition = f"WHERE user_id = {user_id}"
+                        updates[manga_link]['image'] = image_data['data']
+
+                # Add name, link and summary of chapter.
+                # This way makes all the chapters sorted by manga.
+                updates[manga_link]["chapters"].append({
+                    'title':   chapter['title'],
+                    'url':     chapter['id'],
+                    'summary': chapter['summary']
+                })
+
+                if len(feed['entries']) == count:
+                    done = True
+                    # If we reached the end of the feed means that the latest saved chapter has been remove
+                    # or was not found for some other reason. This should act as a fail safe.
+                    end_of_feed = True
+                elif count == 100:
+                    # In case of manga no longer being tracked (and thus latest chapter is no longer in the RSS
+                    # feed), stop looking for updates after 100 iterations.
+                    # Also useful in case of mega update or new manga added with a lot of recent updates..
+                    done = True
+                elif count == len(new_chapters):
+                    # All new chapters found.
+                    done = True
+
+
+                if done is True:
+                    if end_of_feed:
+                        error_message = 'Reached end of feed without finding the latest chapter.'
+                    elif count == 100:
+                        error_message = 'Found at least 100 chapters and stopped looking.'
+
+
+                    embed = discord.Embed(
+                        title = 'New chapters to read',
+                        description = 'Here are the latests chapters from MangaDex.',
+                        url = 'https://mangadex.org/follows',
+                        colour = discord.Color(16225313)
+                    )
+                    embed.set_author(
+                        name='MangaDex',
+                        url='https://mangadex.com',
+                        icon_url='https://mangadex.org/favicon-192x192.png'
                     )
-                    await channel.send("Latest chapters has been saved and you will be informed of updates in the future.")
-
-                elif latest_chapter != feed['entries'][0]['id']:
-                    # Users has updates.
-                    updates = {}
-                    count = 0 # In case last seen chapter is of a manga no longer tracked.
-                    error_message = None
-                    done = False
-                    end_of_feed = False
-
-                    # Loop all chapters.
-                    for chapter in feed['entries']:
-                        if chapter['id'] == latest_chapter:
-                            # Current chapter is the latest. Stop looking for more.
-                            done = True
+
+                    img_list = []
+                    # URLs of the images in img_list, identify the strip in the strip cache.
+                    cover_urls = []
+
+                    # If we reached end of feed or found more that 100 updates.
+                    # Then only give the user the 10 latest updates or, if less
+                    # than 10 updates, how ever many we have.
+                    if error_message is not None:
+                        if len(updates) > 10:
+                            index_length = 10
                         else:
-                            # Add chapter to list of new ones and prepare embed data.
-                            count += 1
-                            manga_link = chapter['mangalink']
-
-                            if not manga_link in updates:
-                                # Prepare data for embed (step 1: get manga data, not just this chapter).
-                                api_link = f"{manga_link[:20]}/api/v2/{manga_link[21:]}"
-                                data = await rss_parser.get_rss_feed(api_link)
-                                if data['status'] != 200:
-                                    if data['status'] == -1:
-                                        if data['error'] == 'invalid_url_error':
-                                            await channel.send(f'Error: One of <@{user_id}> updates had an invalid url.\n{manga_link}')
-                                            print(data['error'])
-                                            continue
-                                        if data['error'] == 'connection_error':
-                                            await channel.send(f'Error: Could not get updates for <@{user_id}>. Connection failed.')
-                                        if data['error'] == 'retry_error':
-                                            await channel.send(f'Error: Could not get updates for <@{user_id}>\' after 5 attempts.')
-
-                                        return print(data['error'])
-                                    else:
-                                        # Should not happen?
-                                        await channel.send('Unhandled error. Check console for error message.')
-                                        return print(data['error'])
-
-                                manga_data = json.loads(data['data'])
-
-                                # Prepare data for embed (step 2: store data).
-                                updates[manga_link] = {
-                                    'description': chapter['summary'],
-                                    'thumbnail':   manga_data['data']['mainCover'],
-                                    'author_name': manga_data['data']['title'],
-                                    'author_link': manga_link
-                                }
-
-
-                            if not "chapters" in updates[manga_link]:
-                                # Place holder for chapters for this manga.
-                                updates[manga_link]["chapters"] = []
-
-                            if not "image" in  updates[manga_link]:
-                                # Link to image.
-                                url = f"{manga_link[:20]}/api/v2/{manga_link[21:]}"
-                                # Cover image for this manga in Pillow (PIL) format.
-                                image_data = await images.get_cover_image(url)
-                                if image_data['status'] != 200:
-                                    if image_data['status'] == -1:
-                                        return print(f"Failed to get cover image:\n{image_data['error']}")
-                                    else:
-                                        # Should not happen?
-                                        await channel.send('Unhandled error. Check console for error message.')
-                                        return print(image_data['error'])
-                                else:
-                                    updates[manga_link]['image'] = image_data['data']
-
-                            # Add name, link and summary of chapter.
-                            # This way makes all the chapters sorted by manga.
-                            updates[manga_link]["chapters"].append({
-                                'title':   chapter['title'],
-                                'url':     chapter['id'],
-                                'summary': chapter['summary']
-                            })
+                            index_length = len(updates)
 
-                            if len(feed['entries']) == count:
-                                done = True
-                                # If we reached the end of the feed means that the latest saved chapter has been remove
-                                # or was not found for some other reason. This should act as a fail safe.
-                                end_of_feed = True
-                            elif count == 100:
-                                # In case of manga no longer being tracked (and thus latest chapter is no longer in the RSS
-                                # feed), stop looking for updates after 100 iterations.
-                                # Also useful in case of mega update or new manga added with a lot of recent updates..
-                                done = True
-
-
-                        if done is True:
-                            if end_of_feed:
-                                error_message = 'Reached end of feed without finding the latest chapter.'
-                            elif count == 100:
-                                error_message = 'Found at least 100 chapters and stopped looking.'
-
-
-                            embed = discord.Embed(
-                                title = 'New chapters to read',
-                                description = 'Here are the latests chapters from MangaDex.',
-                                url = 'https://mangadex.org/follows',
-                                colour = discord.Color(16225313)
-                            )
-                            embed.set_author(
-                                name='MangaDex',
-                                url='https://mangadex.com',
-                                icon_url='https://mangadex.org/favicon-192x192.png'
-                            )
+                        embed.set_footer(text=f"Only showing {index_length} updates the because the previously saved chapter was not found.\nReason: {error_message}")
+
+                        # Replace all found chapters with only the 10 first ones.
+                        updates_temp = {}
+                        for index in range(index_length):
+                            manga_link = f"{new_chapters[index]['mangalink']}"
+
+                            if manga_link not in updates_temp:
+                                updates_temp[manga_link] = updates[manga_link]
+                                updates_temp[manga_link]["chapters"] = []
 
-                            img_list = []
-
-                            # If we reached end of feed or found more that 100 updates.
-                            # Then only give the user the 10 latest updates or, if less
-                            # than 10 updates, how ever many we have.
-                            if error_message is not None:
-                                if len(updates) > 10:
-                                    index_length = 10
-                                else:
-                                    index_length = len(updates)
-
-                                embed.set_footer(text=f"Only showing {index_length} updates the because the previously saved chapter was not found.\nReason: {error_message}")
-
-                                # Replace all found chapters with only the 10 first ones.
-                                updates_temp = {}
-                                for index in range(index_length):
-                                    manga_link = f"{feed['entries'][index]['mangalink']}"
-
-                                    if manga_link not in updates_temp:
-                                        updates_temp[manga_link] = updates[manga_link]
-                                        updates_temp[manga_link]["chapters"] = []
-
-                                    updates_temp[manga_link]["chapters"].append({
-                                        'title':   feed['entries'][index]['title'],
-                                        'url':     feed['entries'][index]['id'],
-                                        'summary': feed['entries'][index]['summary']
-                                    })
-
-                                updates = updates_temp
-
-                            newline = '\n'
-                            # Message for removed embeds and phone notification text.
-                            message = []
-                            # Loop all updates and add name and links to embed.
-                            for this_update in updates:
-                                for this_chapter in updates[this_update]['chapters']:
-                                    embed.add_field(
-                                        name=this_chapter['title'],
-                                        value=f"{this_chapter['url']}{newline}{this_chapter['summary']}",
-                                        inline=False
-                                    )
-                                    message.append(this_chapter['title'])
-
-                                    # Download cover is not already done.
-                                    if updates[this_update]['image'] not in img_list:
-                                        img_list.append(updates[this_update]['image'])
-
-                            with BytesIO() as image_binary:
-                                # Build the images from all cover images.
-                                tmp_img = await images.concatenate_images(img_list)
-                                tmp_img.save(image_binary, 'PNG')
-                                # Set image at frame 0.
-                                image_binary.seek(0)
-                                # Create discord file.
-                                cover_images = discord.File(fp=image_binary, filename='cover_images.jpg')
-                                # Add file to embed.
-                                embed.set_image(url="attachment://cover_images.jpg")
-                                # Join message into one string.
-                                message = newline.join(message)
-                                # Send.
-                                await channel.send(embed=embed, file=cover_images, content=message)
-
-
-                            # Update database with new latest chapter.
-                            database.update(
-                                table = "mangadex",
-                                values = f"chapter_id='{feed['entries'][0]['id']}'",
-                                condition = f"WHERE user_id = {user_id}"
+                            updates_temp[manga_link]["chapters"].append({
+                                'title':   new_chapters[index]['title'],
+                                'url':     new_chapters[index]['id'],
+                                'summary': new_chapters[index]['summary']
+                            })
+
+                        updates = updates_temp
+
+                    newline = '\n'
+                    # Message for removed embeds and phone notification text.
+                    message = []
+                    # Loop all updates and add name and links to embed.
+                    for this_update in updates:
+                        for this_chapter in updates[this_update]['chapters']:
+                            embed.add_field(
+                                name=this_chapter['title'],
+                                value=f"{this_chapter['url']}{newline}{this_chapter['summary']}",
+                                inline=False
                             )
+                            message.append(this_chapter['title'])
+
+                            # Add cover if not already done (compared by identity, comparing images is slow).
+                            if not any(img is updates[this_update]['image'] for img in img_list):
+                                img_list.append(updates[this_update]['image'])
+                                cover_urls.append(updates[this_update]['thumbnail'])
+
+                    # Build and encode the image from all cover images, the file closes it once it has been sent.
+                    image_binary, file_name = await images.render_cover_strip(
+                        img_list,
+                        max_height = self.compositor['max_height'],
+                        max_width = self.compositor['max_width'],
+                        image_format = self.compositor['format'],
+                        quality = self.compositor['quality'],
+                        covers = cover_urls,
+                        cache = self.strips
+                    )
+                    # Create discord file.
+                    cover_images = discord.File(fp=image_binary, filename=file_name)
+                    # Add file to embed.
+                    embed.set_image(url=f"attachment://{file_name}")
+                    # Join message into one string.
+                    message = newline.join(message)
+                    # Queue for sending.
+                    self.dispatcher.send(channel_id, embed=embed, file=cover_images, content=message)
+
+
+                    # Update database with the chapters seen, the next request only downloads the feed if it has
+                    # changed since.
+                    feeds.mark_seen(self.chapter_updates, user, feed['entries'], feed['entries'][0]['id'])
+                    feeds.set_validators(self.validator_updates, [user], resp['etag'], resp['last_modified'])
+
+                    # Stop the loop.
+                    break
+        else:
+            # No updates, only save the validators so the next request only downloads the feed if it has changed.
+            # self.dispatcher.send(channel_id, "Nothing new yet.")
+            feeds.set_validators(self.validator_updates, [user], resp['etag'], resp['last_modified'])
 
-                            # Stop the loop.
-                            break
-                else:
-                    # No updates, nothing to do.
-                    # await channel.send("Nothing new yet.")
-                    pass
+        return scheduler.feed_hint(feed, resp['max_age'])
 
     # Do not start looking before the bot has connected to Discord nad is ready.
     @look_for_updates_manga.before_loop
@@ -341,6 +537,10 @@ class Mangadex(commands.Cog):
         await self.bot.wait_until_ready()
         print("Start looking for updates.")
 
+    @poll_due_feeds.before_loop
+    async def before_polling(self):
+        await self.bot.wait_until_ready()
+
 
 def setup(bot):
     bot.add_cog(Mangadex(bot))
\ No newline at end of file
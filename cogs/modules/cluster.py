@@ -0,0 +1,113 @@
+import hashlib
+# Internal modules
+import cogs.modules.rss_parser as rss_parser
+import cogs.modules.settings as settings
+
+
+"""
+Splits the work of the bot over several processes.
+
+Each process connects to its share of the Discord shards and polls its share of the feeds, picked by a hash of the feed
+URL so every process agrees on who polls what without talking to the others. To make sure a feed is never polled by
+two processes (e.g. while the number of processes is being changed), a process also has to hold a lease on a feed in
+the database before polling it. Leases are renewed every time the subscriptions are reloaded and run out after
+lease_seconds if the process stops.
+
+The default of a single process polls every feed, does not use shards and does not take leases, so it must not be run
+alongside other processes.
+"""
+class Cluster:
+    def __init__(self, process_index=0, process_count=1, shard_count=None, lease_seconds=900):
+        if not 0 <= process_index < process_count:
+            raise ValueError(f"process index {process_index} is not within the {process_count} processes")
+        if process_count > 1 and shard_count is None:
+            raise ValueError("the number of shards has to be set when running more than one process")
+        self.process_index = process_index
+        self.process_count = process_count
+        self.shard_count = shard_count
+        self.lease_seconds = lease_seconds
+
+    """
+    Name of this process in the leases. Includes the number of processes so processes of an old and new setup never
+    take each other's leases.
+    """
+    @property
+    def owner(self):
+        return f"{self.process_index}/{self.process_count}"
+
+    """
+    Tells if the bot should connect with several shards (AutoShardedBot).
+    """
+    @property
+    def sharded(self):
+        return self.shard_count is not None
+
+    """
+    IDs of the shards this process connects to, or None if it does not use shards.
+    """
+    @property
+    def shard_ids(self):
+        if self.shard_count is None:
+            return None
+        return [shard for shard in range(self.shard_count) if shard % self.process_count == self.process_index]
+
+    """
+    Tells if a feed belongs to this process.
+    """
+    def owns(self, url):
+        if self.process_count == 1:
+            return True
+        digest = hashlib.blake2b(rss_parser.normalize_url(url).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') % self.process_count == self.process_index
+
+    """
+    Takes (or renews) the leases on the feeds of this process and returns only the groups of subscriptions (see
+    feeds.load_subscriptions) this process may poll: its own feeds which no other process holds a lease on.
+    """
+    async def claim(self, database, groups):
+        if self.process_count == 1:
+            return groups
+        feed_ids = [feed_id for feed_id, group in groups.items() if self.owns(group[0]['url'])]
+        if not feed_ids:
+            return {}
+        rows = await database.fetch(
+            "UPDATE feeds SET lease_owner = $1, lease_until = now() + $2 * interval '1 second' "
+            "WHERE id = ANY($3::bigint[]) AND (lease_owner IS NULL OR lease_owner = $1 OR lease_until < now()) "
+            "RETURNING id",
+            self.owner, self.lease_seconds, feed_ids
+        )
+        return {row['id']: groups[row['id']] for row in rows}
+
+    """
+    Gives up the leases of this process so another process can take over right away.
+    """
+    async def release(self, database, feed_ids):
+        if feed_ids and self.process_count > 1:
+            await database.execute(
+                "UPDATE feeds SET lease_owner = NULL, lease_until = NULL "
+                "WHERE id = ANY($1::bigint[]) AND lease_owner = $2",
+                list(feed_ids), self.owner
+            )
+
+
+"""
+Creates the cluster from the settings. process_index and process_count override the settings when given (e.g. from
+the command line, as every process needs its own index).
+"""
+def from_settings(process_index=None, process_count=None):
+    cluster_settings = settings.load()['cluster']
+    return Cluster(
+        process_index = cluster_settings['process_index'] if process_index is None else process_index,
+        process_count = cluster_settings['process_count'] if process_count is None else process_count,
+        shard_count = cluster_settings['shard_count'],
+        lease_seconds = cluster_settings['lease_seconds']
+    )
+
+
+"""
+Returns the cluster of the bot, creating it from the settings if the bot does not have one yet.
+"""
+def get_cluster(bot):
+    if getattr(bot, 'cluster', None) is None:
+        bot.cluster = from_settings()
+    return bot.cluster
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import os
+
+
+"""
+Files kept in a folder on disk by key (e.g. a URL), least recently used first out once they take more than size MB.
+Shared by the caches of the bot (see images.CoverCache and response_cache.ResponseCache), which keep what they read in
+memory themselves. Nothing is kept on disk with a size of 0.
+
+The folder is only looked at when first needed. Files are read and written in a thread so the event loop is not
+blocked, and written to a temporary file first so a half written file is never read.
+"""
+class DiskLRU:
+    def __init__(self, path, size):
+        self.path = path
+        self.limit = size * 2 ** 20
+        # File name -> bytes, least recently used first.
+        self._files = None
+        self._used = 0
+
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    @staticmethod
+    def _file_name(key):
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _load_files(self):
+        os.makedirs(self.path, exist_ok=True)
+        entries = [entry for entry in os.scandir(self.path) if entry.is_file() and not entry.name.endswith('.tmp')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        return OrderedDict((entry.name, entry.stat().st_size) for entry in entries)
+
+    async def _get_files(self):
+        if self._files is None:
+            files = await asyncio.get_event_loop().run_in_executor(None, self._load_files)
+            if self._files is None:
+                self._files = files
+                self._used = sum(files.values())
+        return self._files
+
+    def _read(self, name, decode):
+        file_path = os.path.join(self.path, name)
+        with open(file_path, 'rb') as cache_file:
+            data = cache_file.read()
+        # Mark as recently used.
+        os.utime(file_path)
+        return decode(data)
+
+    def _write(self, name, data, evicted):
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.path, old_name))
+            except FileNotFoundError:
+                pass
+        if data is None:
+            return
+        temporary_path = os.path.join(self.path, f"{name}.tmp")
+        with open(temporary_path, 'wb') as cache_file:
+            cache_file.write(data)
+        os.replace(temporary_path, os.path.join(self.path, name))
+
+    """
+    Returns what decode(data) returns for the file of a key, None if there is no such file or decode returns None.
+    decode is run in the thread reading the file. A file decode fails on (OSError or ValueError) is forgotten.
+    """
+    async def read(self, key, decode=bytes):
+        if not self.enabled:
+            return None
+        files = await self._get_files()
+        name = self._file_name(key)
+        if name not in files:
+            return None
+        try:
+            value = await asyncio.get_event_loop().run_in_executor(None, self._read, name, decode)
+        except (OSError, ValueError):
+            # Removed or broken, it has to be downloaded again.
+            self._used -= files.pop(name, 0)
+            return None
+        if value is not None:
+            files.move_to_end(name)
+        return value
+
+    """
+    Saves data (bytes) as the file of a key, removing the least recently used files if needed. Data larger than the
+    whole cache is not saved. Raises OSError if the file could not be written.
+    """
+    async def write(self, key, data):
+        if not self.enabled:
+            return
+        files = await self._get_files()
+        name = self._file_name(key)
+        self._used -= files.pop(name, 0)
+        evicted = []
+        if len(data) > self.limit:
+            # Only remove an older version.
+            evicted.append(name)
+            data = None
+        else:
+            files[name] = len(data)
+            self._used += len(data)
+        while self._used > self.limit:
+            old_name, old_size = files.popitem(last=False)
+            evicted.append(old_name)
+            self._used -= old_size
+
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, name, data, evicted)
+        except OSError:
+            self._used -= files.pop(name, 0)
+            raise
@@ -0,0 +1,245 @@
+import asyncio
+import time
+import aiohttp
+import discord
+# Internal modules
+import cogs.modules.cluster as cluster
+import cogs.modules.metrics as metrics
+import cogs.modules.retry as retry
+import cogs.modules.settings as settings
+
+# Max length of the text of a message.
+CONTENT_LIMIT = 2000
+# Max length of the name and value of a field of a batched message. Keeps 10 fields within the 6000 characters an
+# embed may have in total.
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 300
+
+
+"""
+Allows limit actions per period (in seconds), spread out evenly once the limit has been used up.
+"""
+class TokenBucket:
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.tokens = limit
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / self.period)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.period / self.limit)
+
+
+def _truncate(text, limit):
+    text = text or ''
+    return text if len(text) <= limit else f"{text[:limit - 1]}…"
+
+
+"""
+Combines the embeds of several updates into one embed with a field per update. Every update keeps its title, link and
+(shortened) description. The author is kept if all updates share it.
+"""
+def combine_embeds(embeds):
+    combined = discord.Embed(title=f"{len(embeds)} new updates")
+    authors = {(embed.author.name, embed.author.url, embed.author.icon_url) for embed in embeds}
+    if len(authors) == 1:
+        name, url, icon_url = authors.pop()
+        if name:
+            combined.set_author(name=name, url=url, icon_url=icon_url)
+
+    for embed in embeds:
+        value = '\n'.join(text for text in (embed.url, embed.description) if text)
+        combined.add_field(
+            name = _truncate(embed.title or '-', FIELD_NAME_LIMIT),
+            value = _truncate(value or '-', FIELD_VALUE_LIMIT),
+            inline = False
+        )
+    return combined
+
+
+"""
+Sends messages to Discord channels in the background so polling never waits on Discord.
+
+Every channel has its own queue and worker, so a slow or rate limited channel does not hold up the others. Messages
+are sent no faster than the per channel and global limits (Discord allows 5 messages per 5 seconds in a channel and
+50 requests per second in total), so discord.py rarely has to back off. Up to batch_size queued updates for the same
+channel are sent as one message. Workers stop when their channel has been idle for a while.
+
+The cogs mark updates as seen once they are queued, so a message that fails to send for a reason that may go away
+(Discord is down or rate limits, the connection failed) is tried up to attempts times, waiting retry_delay seconds
+doubled for every following attempt. A message that still fails is logged and dropped.
+"""
+class Dispatcher:
+    def __init__(self, bot, batch_size=10, channel_limit=5, channel_period=5, global_limit=50, global_period=1,
+                 idle_timeout=60, attempts=3, retry_delay=1):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.channel_limit = channel_limit
+        self.channel_period = channel_period
+        self.idle_timeout = idle_timeout
+        self.global_bucket = TokenBucket(global_limit, global_period)
+        self.users = 0
+        # Channel ID -> queue of messages, worker, bucket and channel fetched from Discord.
+        self.queues = {}
+        self.workers = {}
+        self.buckets = {}
+        self.fetched = {}
+        metrics.QUEUE_DEPTH.set_function(lambda: self.pending)
+
+    """
+    Queues a message for a channel and returns right away. Messages with an embed and no file are updates which may
+    be batched with the other updates queued for the channel.
+    """
+    def send(self, channel_id, content=None, embed=None, file=None):
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            queue = self.queues[channel_id] = asyncio.Queue()
+        queue.put_nowait({'content': content, 'embed': embed, 'file': file})
+
+        if channel_id not in self.workers:
+            self.workers[channel_id] = self.bot.loop.create_task(self._work(channel_id))
+
+    """
+    Number of messages waiting to be sent.
+    """
+    @property
+    def pending(self):
+        return sum(queue.qsize() for queue in self.queues.values())
+
+    @staticmethod
+    def _batchable(message):
+        return message['embed'] is not None and message['file'] is None
+
+    async def _work(self, channel_id):
+        queue = self.queues[channel_id]
+        bucket = self.buckets.setdefault(channel_id, TokenBucket(self.channel_limit, self.channel_period))
+        # A message taken from the queue that did not fit in the last batch.
+        held = None
+        try:
+            while True:
+                if held is None:
+                    try:
+                        held = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+                    except asyncio.TimeoutError:
+                        if queue.empty():
+                            # Idle, send will start a new worker when needed.
+                            del self.queues[channel_id]
+                            del self.buckets[channel_id]
+                            self.fetched.pop(channel_id, None)
+                            return
+                        continue
+
+                batch, held = [held], None
+                while self._batchable(batch[0]) and len(batch) < self.batch_size and not queue.empty():
+                    message = queue.get_nowait()
+                    if not self._batchable(message):
+                        held = message
+                        break
+                    batch.append(message)
+
+                try:
+                    await self._send(channel_id, bucket, batch)
+                finally:
+                    for _ in batch:
+                        queue.task_done()
+        finally:
+            self.workers.pop(channel_id, None)
+
+    @staticmethod
+    def _retryable(error):
+        if isinstance(error, discord.HTTPException):
+            return error.status in retry.RETRYABLE_STATUSES or error.status >= 500
+        return isinstance(error, (aiohttp.ClientError, OSError, asyncio.TimeoutError))
+
+    async def _send(self, channel_id, bucket, batch):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                with metrics.SEND_SECONDS.time():
+                    await self._deliver(channel_id, batch)
+                metrics.SENT_MESSAGES.inc(result='sent')
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if attempt < self.attempts and self._retryable(error):
+                    metrics.SENT_MESSAGES.inc(result='retried')
+                    await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                    continue
+                metrics.SENT_MESSAGES.inc(result='failed')
+                print(f"Failed to send {len(batch)} message(s) to channel {channel_id}: {error!r}")
+                return
+
+    async def _deliver(self, channel_id, batch):
+        channel = self.bot.get_channel(channel_id) or self.fetched.get(channel_id)
+        if channel is None:
+            # Not cached, e.g. the channel is in a guild of a shard run by another process (see cluster).
+            channel = self.fetched[channel_id] = await self.bot.fetch_channel(channel_id)
+
+        if len(batch) == 1:
+            message = batch[0]
+            await channel.send(content=message['content'], embed=message['embed'], file=message['file'])
+            return
+
+        content = '\n'.join(message['content'] for message in batch if message['content'])
+        await channel.send(
+            content = _truncate(content, CONTENT_LIMIT) or None,
+            embed = combine_embeds([message['embed'] for message in batch])
+        )
+
+    """
+    Registers a user (cog) of the dispatcher.
+    """
+    def acquire(self):
+        self.users += 1
+        return self
+
+    """
+    Unregisters a user (cog) of the dispatcher and stops it once nobody is using it anymore.
+    """
+    async def release(self):
+        self.users = max(self.users - 1, 0)
+        if self.users == 0:
+            await self.close()
+
+    """
+    Waits up to timeout seconds for the queued messages to be sent and stops the workers.
+    """
+    async def close(self, timeout=10):
+        joins = [asyncio.ensure_future(queue.join()) for queue in self.queues.values()]
+        if joins:
+            await asyncio.wait(joins, timeout=timeout)
+            for join in joins:
+                join.cancel()
+        for worker in list(self.workers.values()):
+            worker.cancel()
+
+
+"""
+Returns the dispatcher owned by the bot, creating it from the settings if the bot does not have one yet. The global
+limit is for the whole bot, so it is shared out between the processes of the cluster.
+"""
+def get_dispatcher(bot):
+    if getattr(bot, 'message_dispatcher', None) is None:
+        dispatch_settings = settings.load()['dispatch']
+        bot.message_dispatcher = Dispatcher(
+            bot,
+            batch_size = dispatch_settings['batch_size'],
+            channel_limit = dispatch_settings['channel_limit'],
+            channel_period = dispatch_settings['channel_period'],
+            global_limit = dispatch_settings['global_limit'] / cluster.get_cluster(bot).process_count,
+            global_period = dispatch_settings['global_period'],
+            attempts = dispatch_settings['attempts'],
+            retry_delay = dispatch_settings['retry_delay']
+        )
+    return bot.message_dispatcher
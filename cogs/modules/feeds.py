@@ -0,0 +1,353 @@
+from datetime import datetime, timezone
+import time
+# Internal modules
+import cogs.modules.psql as psql
+import cogs.modules.rss_parser as rss_parser
+import cogs.modules.seen as seen
+
+# Kinds of subscriptions.
+RSS = 'rss'
+MANGADEX = 'mangadex'
+
+# Columns of a subscription joined with the feed it follows.
+SUBSCRIPTION_COLUMNS = (
+    "subscriptions.id AS subscription_id, subscriptions.user_id, subscriptions.channel_id, subscriptions.name, "
+    "subscriptions.latest, feeds.id AS feed_id, feeds.url, feeds.etag, feeds.last_modified, "
+    "feeds.next_poll_at, feeds.poll_interval, feeds.update_gap, feeds.last_changed_at, feeds.consecutive_failures, "
+    "feeds.last_success_at, feeds.last_error, feeds.disabled_at"
+)
+SUBSCRIPTION_TABLE = "subscriptions JOIN feeds ON feeds.id = subscriptions.feed_id"
+
+
+# Clears the health of an existing feed (see health.FeedHealth) when it is added again, which enables it again if it
+# was disabled.
+_RESET_HEALTH = "consecutive_failures = 0, last_error = NULL, disabled_at = NULL"
+
+
+"""
+Returns the ID of the feed with the given URL, adding the feed if it does not exist yet. The validators are only saved
+for a new feed: for an existing feed they belong to the last poll and other subscribers may not have seen newer data.
+An existing feed is enabled again if it was disabled for failing too often.
+"""
+async def get_feed_id(database, url, etag=None, last_modified=None):
+    rows = await database.fetch(
+        "INSERT INTO feeds (url, etag, last_modified) VALUES ($1, $2, $3) "
+        f"ON CONFLICT (url) DO UPDATE SET url = EXCLUDED.url, {_RESET_HEALTH} RETURNING id",
+        rss_parser.normalize_url(url), etag, last_modified
+    )
+    return rows[0]['id']
+
+
+"""
+Same as get_feed_id for many feeds at once, given as (url, etag, last_modified). Returns a dict of the normalized URLs
+to the feed IDs.
+"""
+async def get_feed_ids(database, feeds):
+    # A statement may only insert or update the same row once.
+    unique = {}
+    for url, etag, last_modified in feeds:
+        unique.setdefault(rss_parser.normalize_url(url), (etag, last_modified))
+    rows = await database.fetch(
+        "INSERT INTO feeds (url, etag, last_modified) SELECT * FROM unnest($1::text[], $2::text[], $3::text[]) "
+        f"ON CONFLICT (url) DO UPDATE SET url = EXCLUDED.url, {_RESET_HEALTH} RETURNING id, url",
+        list(unique), [etag for etag, _ in unique.values()], [last_modified for _, last_modified in unique.values()]
+    )
+    return {row['url']: row['id'] for row in rows}
+
+
+"""
+Returns every subscription of a kind along with the feed it follows, grouped by feed ID, leaving out disabled feeds.
+Subscriptions are returned as dicts so the cogs can keep their state up to date between loads.
+
+previous are the groups returned by the last load. The latest update and validators kept in memory are newer than the
+ones in the database until they have been flushed, so the dicts of known subscriptions are reused (which also keeps
+polls running during the load up to date) and only get the other columns refreshed. 'seen' is a seen.SeenSet, only
+read from the database for the subscriptions which are not known yet.
+"""
+async def load_subscriptions(database, kind, previous=None):
+    rows = await database.select(
+        table = SUBSCRIPTION_TABLE,
+        columns = SUBSCRIPTION_COLUMNS,
+        condition = "WHERE subscriptions.kind = $1 AND feeds.disabled_at IS NULL",
+        args = (kind,)
+    )
+
+    known = {}
+    for group in (previous or {}).values():
+        for subscription in group:
+            known[subscription['subscription_id']] = subscription
+
+    def is_known(row):
+        subscription = known.get(row['subscription_id'])
+        return subscription is not None and subscription['feed_id'] == row['feed_id']
+
+    new_ids = [row['subscription_id'] for row in rows if not is_known(row)]
+    seen_data = {}
+    if new_ids:
+        seen_rows = await database.select(
+            table = "subscriptions",
+            columns = "id, seen",
+            condition = "WHERE id = ANY($1::bigint[])",
+            args = (new_ids,)
+        )
+        seen_data = {row['id']: row['seen'] for row in seen_rows}
+
+    groups = {}
+    for row in rows:
+        if is_known(row):
+            subscription = known[row['subscription_id']]
+            for column in ('user_id', 'channel_id', 'name'):
+                subscription[column] = row[column]
+        else:
+            subscription = dict(row)
+            subscription['seen'] = seen.SeenSet(seen_data.get(row['subscription_id']))
+        groups.setdefault(subscription['feed_id'], []).append(subscription)
+    return groups
+
+
+"""
+Returns a user's subscription with the given name or None if the user has no such subscription.
+"""
+async def find_subscription(database, kind, user_id, name):
+    rows = await database.select(
+        table = SUBSCRIPTION_TABLE,
+        columns = SUBSCRIPTION_COLUMNS,
+        condition = "WHERE subscriptions.kind = $1 AND subscriptions.user_id = $2 AND subscriptions.name = $3",
+        args = (kind, user_id, name)
+    )
+    return rows[0] if rows else None
+
+
+"""
+Adds a subscription. seen_entries are the entries of the feed the user should not be sent.
+"""
+async def add_subscription(database, kind, user_id, channel_id, name, feed_id, latest, seen_entries=()):
+    await database.insert(
+        table = "subscriptions",
+        columns = "kind, user_id, channel_id, name, feed_id, latest, seen",
+        values = (kind, user_id, channel_id, name, feed_id, latest, _seen_bytes(seen_entries))
+    )
+
+
+"""
+Points an existing subscription to another feed and channel. The latest update and seen entries are kept if the feed
+did not change.
+"""
+async def update_subscription(database, subscription_id, feed_id, channel_id, latest, seen_entries=()):
+    await database.update(
+        table = "subscriptions",
+        values = (
+            "latest = CASE WHEN feed_id = $1 THEN latest ELSE $3 END, "
+            "seen = CASE WHEN feed_id = $1 THEN seen ELSE $4 END, feed_id = $1, channel_id = $2"
+        ),
+        condition = "WHERE id = $5",
+        args = (feed_id, channel_id, latest, _seen_bytes(seen_entries), subscription_id)
+    )
+
+
+"""
+Adds or updates many subscriptions of a user in one statement, see add_subscription and update_subscription.
+subscriptions are (name, feed_id, latest, seen_entries) tuples with unique names.
+"""
+async def upsert_subscriptions(database, kind, user_id, channel_id, subscriptions):
+    await database.execute(
+        "INSERT INTO subscriptions (kind, user_id, channel_id, name, feed_id, latest, seen) "
+        "SELECT $1, $2, $3, data.name, data.feed_id, data.latest, data.seen "
+        "FROM unnest($4::text[], $5::bigint[], $6::text[], $7::bytea[]) AS data(name, feed_id, latest, seen) "
+        "ON CONFLICT (kind, user_id, name) DO UPDATE SET "
+        "latest = CASE WHEN subscriptions.feed_id = EXCLUDED.feed_id "
+        "THEN subscriptions.latest ELSE EXCLUDED.latest END, "
+        "seen = CASE WHEN subscriptions.feed_id = EXCLUDED.feed_id THEN subscriptions.seen ELSE EXCLUDED.seen END, "
+        "feed_id = EXCLUDED.feed_id, channel_id = EXCLUDED.channel_id",
+        kind, user_id, channel_id,
+        [name for name, _, _, _ in subscriptions],
+        [feed_id for _, feed_id, _, _ in subscriptions],
+        [latest for _, _, latest, _ in subscriptions],
+        [_seen_bytes(entries) for _, _, _, entries in subscriptions]
+    )
+
+
+"""
+Returns every subscription of a kind of a user, ordered by name.
+"""
+async def user_subscriptions(database, kind, user_id):
+    return await database.select(
+        table = SUBSCRIPTION_TABLE,
+        columns = SUBSCRIPTION_COLUMNS,
+        condition = "WHERE subscriptions.kind = $1 AND subscriptions.user_id = $2 ORDER BY subscriptions.name",
+        args = (kind, user_id)
+    )
+
+
+def _seen_bytes(entries):
+    if not entries:
+        return None
+    seen_set = seen.SeenSet()
+    seen_set.add(entries)
+    return seen_set.to_bytes()
+
+
+"""
+Buffer for the latest update and seen entries of each subscription, keyed by subscription ID. Use mark_seen to add to
+it.
+"""
+def latest_buffer(database):
+    return psql.WriteBuffer(database, 'subscriptions', 'id', ('latest', 'seen'), types={'seen': 'bytea'})
+
+
+"""
+Buffer for the validators of each feed, keyed by feed ID.
+"""
+def validator_buffer(database):
+    return psql.WriteBuffer(database, 'feeds', 'id', ('etag', 'last_modified'))
+
+
+"""
+Buffer for the statistics of the last fetch of each feed, keyed by feed ID. Use set_fetch_stats to add to it.
+"""
+def stats_buffer(database):
+    return psql.WriteBuffer(
+        database, 'feeds', 'id', ('last_fetched_at', 'last_status', 'last_fetch_ms'),
+        types = {'last_fetched_at': 'timestamptz', 'last_status': 'integer', 'last_fetch_ms': 'integer'}
+    )
+
+
+def set_fetch_stats(buffer, feed_id, status, seconds):
+    buffer.set(feed_id, datetime.now(timezone.utc), status, int(seconds * 1000))
+
+
+"""
+Buffer for the health of each feed, keyed by feed ID. Use health.FeedHealth to add to it.
+"""
+def health_buffer(database):
+    return psql.WriteBuffer(
+        database, 'feeds', 'id', ('consecutive_failures', 'last_success_at', 'last_error', 'disabled_at'),
+        types = {'consecutive_failures': 'integer', 'last_success_at': 'timestamptz', 'disabled_at': 'timestamptz'}
+    )
+
+
+"""
+Buffer for the scheduler state of each feed, keyed by feed ID. Use set_schedule to add to it.
+"""
+def schedule_buffer(database):
+    return psql.WriteBuffer(
+        database, 'feeds', 'id', ('next_poll_at', 'poll_interval', 'update_gap', 'last_changed_at'),
+        types = {
+            'next_poll_at': 'timestamptz',
+            'poll_interval': 'integer',
+            'update_gap': 'integer',
+            'last_changed_at': 'timestamptz'
+        }
+    )
+
+
+def _to_datetime(timestamp):
+    return None if timestamp is None else datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def _to_timestamp(date):
+    return None if date is None else date.timestamp()
+
+
+def set_schedule(buffer, feed_id, entry):
+    buffer.set(
+        feed_id,
+        _to_datetime(entry['due']),
+        int(entry['interval']),
+        None if entry['gap'] is None else int(entry['gap']),
+        _to_datetime(entry['last_changed'])
+    )
+
+
+"""
+Makes the scheduler poll exactly the feeds in groups (see load_subscriptions). New feeds continue where the saved
+schedule left off, or are due right away if they have never been polled.
+
+With a warmup (in seconds), new feeds which are due are spread evenly over the next warmup seconds instead, longest
+overdue first, so starting the bot does not poll every feed at once.
+"""
+def schedule_subscriptions(scheduler, groups, warmup=0):
+    for feed_id in list(scheduler.entries):
+        if feed_id not in groups:
+            scheduler.remove(feed_id)
+
+    staggered = {}
+    if warmup:
+        now = time.time()
+        # Never polled feeds count as the longest overdue.
+        overdue = sorted(
+            (_to_timestamp(group[0]['next_poll_at']) or 0, feed_id) for feed_id, group in groups.items()
+            if feed_id not in scheduler.entries and (_to_timestamp(group[0]['next_poll_at']) or 0) <= now
+        )
+        for index, (_, feed_id) in enumerate(overdue):
+            staggered[feed_id] = now + warmup * index / len(overdue)
+
+    for feed_id, group in groups.items():
+        feed = group[0]
+        scheduler.add(
+            feed_id,
+            due = staggered.get(feed_id, _to_timestamp(feed['next_poll_at'])),
+            interval = feed['poll_interval'],
+            gap = feed['update_gap'],
+            last_changed = _to_timestamp(feed['last_changed_at'])
+        )
+
+
+"""
+Tells if a subscription has never been polled (nothing is known about what the user has seen).
+"""
+def is_new(subscription):
+    return subscription['latest'] is None and not subscription['seen']
+
+
+"""
+Tells if a subscription has seen an entry. key is the field saved as latest ('title' or 'id'), only used for
+subscriptions saved before seen entries were tracked.
+"""
+def has_seen(subscription, entry, key):
+    if subscription['seen']:
+        return entry in subscription['seen']
+    return subscription['latest'] is not None and entry[key] == subscription['latest']
+
+
+"""
+Returns the entries of a feed a subscription has not seen, newest first. See has_seen for key.
+"""
+def new_entries(subscription, entries, key):
+    if subscription['seen'] or subscription['latest'] is None:
+        return subscription['seen'].unseen(entries)
+
+    # Saved before seen entries were tracked, everything above the latest update is new.
+    new = []
+    for entry in entries:
+        if entry[key] == subscription['latest']:
+            break
+        new.append(entry)
+    return new
+
+
+"""
+Marks the entries of a feed as seen by a subscription and sets its latest update, in memory and in the buffer. Nothing
+changes if every entry had already been seen.
+"""
+def mark_seen(buffer, subscription, entries, latest):
+    newest = subscription['seen'].newest
+    subscription['seen'].add(entries)
+    if subscription['seen'].newest == newest:
+        return
+    subscription['latest'] = latest
+    buffer.set(subscription['subscription_id'], latest, subscription['seen'].to_bytes())
+
+
+"""
+Sets the validators of the feed followed by the subscriptions, in memory and in the buffer, if they changed. Only call
+it once the response has been handled: with the validators saved, the next request gets 304 and the same data is not
+downloaded again.
+"""
+def set_validators(buffer, subscriptions, etag, last_modified):
+    if etag == subscriptions[0]['etag'] and last_modified == subscriptions[0]['last_modified']:
+        return
+    for subscription in subscriptions:
+        subscription['etag'] = etag
+        subscription['last_modified'] = last_modified
+    buffer.set(subscriptions[0]['feed_id'], etag, last_modified)
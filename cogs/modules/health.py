@@ -0,0 +1,184 @@
+from datetime import datetime, timezone
+import time
+from urllib.parse import urlsplit
+# Internal modules
+import cogs.modules.metrics as metrics
+import cogs.modules.settings as settings
+
+
+class HostDownError(Exception):
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} is down, not trying again for {int(retry_in)} seconds")
+        self.host = host
+        self.retry_in = retry_in
+
+
+"""
+Circuit breaker for the hosts the bot downloads from, so a host that is down does not cost a socket, a timeout and
+every retry for each of its feeds.
+
+The circuit of a host opens once failures requests in a row could not reach it (the connection failed or the retries
+gave up). While it is open, requests to the host fail right away with HostDownError. After cooldown seconds a single
+request is let through: the circuit closes if it reaches the host and opens again for twice as long (at most
+max_cooldown) otherwise.
+"""
+class HostBreaker:
+    def __init__(self, failures=5, cooldown=60, max_cooldown=3600):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # Host -> {'failures', 'open_until', 'cooldown'}. Hosts are only kept while they fail.
+        self.hosts = {}
+        metrics.OPEN_CIRCUITS.set_function(lambda: len(self.down()))
+
+    @staticmethod
+    def _host(url):
+        return urlsplit(url).hostname or ''
+
+    """
+    Raises HostDownError if url may not be requested right now.
+    """
+    def check(self, url):
+        host = self._host(url)
+        state = self.hosts.get(host)
+        if state is None or state['open_until'] is None:
+            return
+        remaining = state['open_until'] - time.monotonic()
+        if remaining > 0:
+            raise HostDownError(host, remaining)
+        # Half open: let this request through and keep the others out until it is done.
+        state['open_until'] = time.monotonic() + state['cooldown']
+
+    """
+    Records that a request reached the host of url, whatever the status.
+    """
+    def success(self, url):
+        self.hosts.pop(self._host(url), None)
+
+    """
+    Records that a request could not reach the host of url.
+    """
+    def failure(self, url):
+        state = self.hosts.setdefault(self._host(url), {'failures': 0, 'open_until': None, 'cooldown': 0})
+        state['failures'] += 1
+        if state['open_until'] is not None:
+            # The request let through while half open failed too.
+            state['cooldown'] = min(state['cooldown'] * 2, self.max_cooldown)
+        elif state['failures'] >= self.failures:
+            state['cooldown'] = self.cooldown
+        else:
+            return
+        state['open_until'] = time.monotonic() + state['cooldown']
+
+    """
+    Returns the hosts which are down as a dict of hosts to the seconds until they are tried again.
+    """
+    def down(self):
+        now = time.monotonic()
+        return {
+            host: max(state['open_until'] - now, 0) for host, state in self.hosts.items()
+            if state['open_until'] is not None
+        }
+
+
+"""
+Decides what happens to a feed which fails, from the health saved with its subscriptions (see feeds.health_buffer):
+'consecutive_failures', 'last_success_at', 'last_error' (the class of the last error, e.g. 'http_error') and
+'disabled_at'.
+
+A failing feed is polled again after base_delay seconds, doubled for every failure in a row (at most max_delay), no
+matter how often it changes. It is disabled once it failed disable_after times in a row (never if 0).
+"""
+class FeedHealth:
+    def __init__(self, base_delay=300, max_delay=86400, disable_after=10):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.disable_after = disable_after
+
+    """
+    Returns how many seconds to wait before polling a feed again, None if it did not fail the last time.
+    """
+    def backoff(self, feed):
+        if not feed['consecutive_failures']:
+            return None
+        return min(self.base_delay * 2 ** (feed['consecutive_failures'] - 1), self.max_delay)
+
+    """
+    Records a successful poll of the feed followed by the subscriptions, in memory and in the buffer.
+    """
+    def success(self, buffer, subscriptions):
+        now = datetime.now(timezone.utc)
+        for subscription in subscriptions:
+            subscription['consecutive_failures'] = 0
+            subscription['last_success_at'] = now
+            subscription['last_error'] = None
+            subscription['disabled_at'] = None
+        buffer.set(subscriptions[0]['feed_id'], 0, now, None, None)
+
+    """
+    Records a failed poll of the feed followed by the subscriptions, in memory and in the buffer. error is the class of
+    the error. Returns True if the feed has just been disabled.
+    """
+    def failure(self, buffer, subscriptions, error):
+        feed = subscriptions[0]
+        failures = feed['consecutive_failures'] + 1
+        disabled = 0 < self.disable_after <= failures
+        disabled_at = datetime.now(timezone.utc) if disabled else None
+        for subscription in subscriptions:
+            subscription['consecutive_failures'] = failures
+            subscription['last_error'] = error
+            subscription['disabled_at'] = disabled_at
+        buffer.set(feed['feed_id'], failures, feed['last_success_at'], error, disabled_at)
+        if disabled:
+            metrics.DISABLED_FEEDS.inc()
+        return disabled
+
+
+"""
+Returns the message telling a user which of their subscriptions have been disabled and why. command is how to add them
+back.
+"""
+def disabled_message(user_id, subscriptions, command):
+    lines = [f"<@{user_id}> these feeds failed too many times in a row and are no longer checked:"]
+    for subscription in subscriptions:
+        last_success = subscription['last_success_at']
+        since = f"last worked {last_success:%Y-%m-%d %H:%M} UTC" if last_success is not None else "never worked"
+        lines.append(f"- {subscription['name']}: {subscription['last_error']} ({since})")
+    lines.append(f"Use {command} to check them again.")
+    message = '\n'.join(lines)
+    # Discord messages are at most 2000 characters.
+    return message if len(message) <= 2000 else message[:1996] + '\n...'
+
+
+_breaker = None
+_health = None
+
+
+"""
+Returns the host circuit breaker built from the settings, shared by every request.
+"""
+def get_breaker():
+    global _breaker
+    if _breaker is None:
+        health_settings = settings.load()['health']
+        _breaker = HostBreaker(
+            failures = health_settings['host_failures'],
+            cooldown = health_settings['host_cooldown'],
+            max_cooldown = health_settings['host_max_cooldown']
+        )
+    return _breaker
+
+
+"""
+Returns the feed health policy built from the settings.
+"""
+def get_health():
+    global _health
+    if _health is None:
+        health_settings = settings.load()['health']
+        _health = FeedHealth(
+            base_delay = health_settings['feed_backoff'],
+            max_delay = health_settings['feed_max_backoff'],
+            disable_after = health_settings['disable_after']
+        )
+    return _health
@@ -0,0 +1,90 @@
+import aiohttp
+# Internal modules
+import cogs.modules.settings as settings
+
+
+"""
+One long lived aiohttp session shared by every cog.
+
+Keeps connections alive between requests, caches DNS lookups and caps the number of connections in total and per host.
+The session is created the first time it is needed and closed when the last cog using it has released it. resolver is
+an optional aiohttp resolver used instead of the default one (e.g. by the benchmarks to reach their local servers).
+"""
+class HTTPClient:
+    def __init__(self, limit=100, limit_per_host=4, dns_cache_ttl=300, keepalive_timeout=30, timeout=60,
+                 connect_timeout=10, resolver=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.resolver = resolver
+        self.users = 0
+        self._session = None
+
+    """
+    Returns the shared session, creating it if it does not exist yet. Must be called from within the event loop.
+    """
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            resolver = self.resolver
+            if resolver is None:
+                try:
+                    # Resolve using aiodns (c-ares) instead of blocking threads.
+                    resolver = aiohttp.AsyncResolver()
+                except RuntimeError:
+                    # aiodns is not installed.
+                    resolver = aiohttp.DefaultResolver()
+
+            connector = aiohttp.TCPConnector(
+                limit = self.limit,
+                limit_per_host = self.limit_per_host,
+                use_dns_cache = True,
+                ttl_dns_cache = self.dns_cache_ttl,
+                keepalive_timeout = self.keepalive_timeout,
+                resolver = resolver
+            )
+            self._session = aiohttp.ClientSession(
+                connector = connector,
+                timeout = aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout)
+            )
+        return self._session
+
+    """
+    Registers a user (cog) of the session.
+    """
+    def acquire(self):
+        self.users += 1
+        return self
+
+    """
+    Unregisters a user (cog) of the session and closes the session once nobody is using it anymore.
+    """
+    async def release(self):
+        self.users = max(self.users - 1, 0)
+        if self.users == 0:
+            await self.close()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+"""
+Returns the HTTP client owned by the bot, creating it from the settings if the bot does not have one yet.
+"""
+def get_client(bot):
+    if getattr(bot, 'http_client', None) is None:
+        http_settings = settings.load()['http']
+        bot.http_client = HTTPClient(
+            limit = http_settings['limit'],
+            limit_per_host = http_settings['limit_per_host'],
+            dns_cache_ttl = http_settings['dns_cache_ttl'],
+            keepalive_timeout = http_settings['keepalive_timeout'],
+            timeout = http_settings['timeout'],
+            connect_timeout = http_settings['connect_timeout']
+        )
+    return bot.http_client
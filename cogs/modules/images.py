@@ -1,76 +1,279 @@
-import time
+from collections import OrderedDict
 from io import BytesIO
-import json
+import asyncio
 import aiohttp
 from PIL import Image
+# Internal modules
+import cogs.modules.disk_cache as disk_cache
+import cogs.modules.health as health
+import cogs.modules.retry as retry
+import cogs.modules.rss_parser as rss_parser
+import cogs.modules.settings as settings
 
+# JPEG quality of the thumbnails cached on disk, above the quality of the strips so they lose little more.
+THUMBNAIL_QUALITY = 90
 
 """
-Gets the cover image and returns a Pillow (PIL) image.
+Two tier cache of cover images, keyed by the URL of the image.
+
+Decoded images are kept in memory, least recently used first out once they take more than memory_size MB. Files are
+kept in path on disk (see disk_cache.DiskLRU), least recently used first out once they take more than disk_size MB.
+Files are encoded and decoded in a thread so the event loop is not blocked. With max_height, images are kept as
+thumbnails of that height (see decode_image), also on disk as JPEG files, so each cover is only ever resized once.
+
+Cached images are shared, they must not be modified (copy them first).
 """
-async def get_cover_image(manga_url):
-    async with aiohttp.ClientSession() as session:
+class CoverCache:
+    def __init__(self, path='cache/covers', memory_size=64, disk_size=256, max_height=None):
+        self.max_height = max_height
+        self.memory_limit = memory_size * 2 ** 20
+        # URL -> (image, bytes), least recently used first.
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk = disk_cache.DiskLRU(path, disk_size)
+
+    def _remember(self, url, image):
+        size = image.width * image.height * len(image.getbands())
+        if url in self._memory:
+            self._memory_used -= self._memory.pop(url)[1]
+        self._memory[url] = (image, size)
+        self._memory_used += size
+        while self._memory_used > self.memory_limit and len(self._memory) > 1:
+            self._memory_used -= self._memory.popitem(last=False)[1][1]
+
+    def _decode(self, data):
+        return decode_image(data, self.max_height)
+
+    @staticmethod
+    def _encode(image):
+        data = BytesIO()
+        image.save(data, format='JPEG', quality=THUMBNAIL_QUALITY)
+        return data.getvalue()
+
+    """
+    Returns the cached image for a URL or None if it is not cached.
+    """
+    async def get(self, url):
+        cached = self._memory.get(url)
+        if cached is not None:
+            self._memory.move_to_end(url)
+            return cached[0]
+
+        image = await self._disk.read(url, self._decode)
+        if image is not None:
+            self._remember(url, image)
+        return image
+
+    """
+    Caches the decoded image and, on disk, its thumbnail (or the downloaded data without max_height).
+    """
+    async def put(self, url, data, image):
+        self._remember(url, image)
+        if not self._disk.enabled:
+            return
         try:
-            retry_count = 0
-            success = False
-            while retry_count < 5 and not success:
-                async with session.get(manga_url) as resp:
-                    if resp.status == 200:
-                        html = await resp.text()
-                        manga = json.loads(html)
-                        # Extact link to cover.
-                        cover_url = manga['data']['mainCover']
-                        success = True
-                    else:
-                        retry_count += 1
-                        time.sleep(60)
-            if retry_count == 5:
-                raise ValueError('To many failed connection attempts', retry_count)
-
-            retry_count = 0
-            while retry_count < 5 and success:
-                async with session.get(cover_url) as resp:
-                    if resp.status == 200:
-                        # Create an object from the data.
-                        data = BytesIO(await resp.read())
-                        # Create an image from the data.
-                        image = Image.open(data)
-
-                        return {'status': resp.status, 'error': None, 'data': image}
-                    else:
-                        retry_count += 1
-                        time.sleep(60)
-            if retry_count == 5:
-                raise ValueError('To many failed connection attempts', retry_count)
-
-        except aiohttp.InvalidURL as error:
-            return {'status': -1, 'data': f"{error} is not a valid URL.", 'error': 'invalid_url_error'}
-        except aiohttp.ClientConnectorError:
-            return {'status': -1, 'data': f"Could not connect to {manga_url}.", 'error': 'connection_error'}
-        except ValueError as error:
-            return {'status': -1, 'data': f"Failed to download data after {data.retry_count} attempts", 'error': 'retry_error'}
+            if self.max_height is not None:
+                data = await asyncio.get_event_loop().run_in_executor(None, self._encode, image)
+            await self._disk.write(url, data)
+        except OSError as error:
+            print(f"Failed to cache cover image: {error}")
+
+
+"""
+Returns the cover cache owned by the bot, creating it from the settings if the bot does not have one yet.
+"""
+def get_cover_cache(bot):
+    if getattr(bot, 'cover_cache', None) is None:
+        cover_settings = settings.load()['covers']
+        bot.cover_cache = CoverCache(
+            path = cover_settings['path'],
+            memory_size = cover_settings['memory_size'],
+            disk_size = cover_settings['disk_size'],
+            # Covers are only ever shown in a strip this high.
+            max_height = settings.load()['compositor']['max_height']
+        )
+    return bot.cover_cache
+
+
+"""
+Creates a Pillow (PIL) image from downloaded data and decodes it right away. With max_height, the image becomes an RGB
+thumbnail at most max_height pixels high, so it can be pasted into a strip that high without any more work. To keep
+this cheap, JPEG images are decoded at a lower scale directly and other images are reduced by a whole factor before
+being resized.
+"""
+def decode_image(data, max_height=None):
+    image = Image.open(BytesIO(data))
+    if max_height is None:
+        image.load()
+        return image
+
+    if image.height > max_height:
+        image.draft('RGB', (image.width * max_height // image.height, max_height))
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    factor = image.height // max_height
+    if factor >= 2:
+        image = image.reduce(factor)
+    if image.height > max_height:
+        width = max(round(image.width * max_height / image.height), 1)
+        image = image.resize((width, max_height), resample=Image.LANCZOS)
+    return image
+
+
+# Errors of a download returned as an error by get_image.
+DOWNLOAD_ERRORS = (
+    aiohttp.InvalidURL, aiohttp.ClientConnectorError, retry.PermanentError, retry.RetryError, rss_parser.ResponseError,
+    health.HostDownError, aiohttp.ClientError
+)
+
+
+def _error(error, url):
+    if isinstance(error, aiohttp.InvalidURL):
+        return {'status': -1, 'data': f"{error} is not a valid URL.", 'error': 'invalid_url_error'}
+    if isinstance(error, aiohttp.ClientConnectorError):
+        return {'status': -1, 'data': f"Could not connect to {url}.", 'error': 'connection_error'}
+    if isinstance(error, retry.PermanentError):
+        return {'status': -1, 'data': f"{url} returned status {error.status}.", 'error': 'http_error'}
+    if isinstance(error, rss_parser.ResponseError):
+        return {'status': -1, 'data': f"{url} {error}", 'error': error.error}
+    if isinstance(error, health.HostDownError):
+        return {'status': -1, 'data': f"{error}.", 'error': 'host_down_error', 'retry_in': error.retry_in}
+    if isinstance(error, aiohttp.ClientResponseError):
+        return {
+            'status': -1, 'data': f"{url} sent an invalid response ({type(error).__name__}).", 'error': 'http_error'
+        }
+    if isinstance(error, aiohttp.ClientError):
+        return {'status': -1, 'data': f"Could not connect to {url} ({error!r}).", 'error': 'connection_error'}
+    return {'status': -1, 'data': f"Failed to download data after {error.attempts} attempts", 'error': 'retry_error'}
+
+
+"""
+Gets an image and returns a Pillow (PIL) image. The session is the bot's shared session (see http_client). Failed
+requests are retried according to the retry policy from the settings without blocking the event loop.
+
+With a cache (see CoverCache) cached images are returned without any request and downloaded images are cached,
+decoded at the size the cache asks for.
+"""
+async def get_image(session, image_url, cache=None):
+    if cache is not None:
+        image = await cache.get(image_url)
+        if image is not None:
+            return {'status': 200, 'error': None, 'data': image}
+
+    async def read_image(resp):
+        rss_parser.check_response(resp, rss_parser.IMAGE)
+        return await rss_parser.read_body(resp, rss_parser.IMAGE)
+
+    try:
+        data = await retry.get_policy().get(session, image_url, read_image)
+    except DOWNLOAD_ERRORS as error:
+        return _error(error, image_url)
+
+    try:
+        max_height = cache.max_height if cache is not None else None
+        image = await asyncio.get_event_loop().run_in_executor(None, decode_image, data, max_height)
+    except OSError:
+        return {'status': -1, 'data': f"{image_url} is not a valid image.", 'error': 'image_error'}
+
+    if cache is not None:
+        await cache.put(image_url, data, image)
+    return {'status': 200, 'error': None, 'data': image}
 
 
 """
 Takes a list of Pillow (PIL) images and pastes them together horizontally after having resized all images to the
-height of the smallest image. Aspect ratio is maintained.
+height of the smallest image, or to max_height if that is lower. If the result would be wider than max_width, every
+image is made smaller to fit. Aspect ratio is maintained. The images themselves are left as they are (they may be
+cached).
 """
-async def concatenate_images(img_list):
+def _concatenate(img_list, max_height=None, max_width=None):
     # Get the height of the smallest image and and set it as the max allowed height.
-    max_height = min(x.height for x in img_list)
-    # Loop all images which are too high and resize.
-    for img in [i for i in img_list if i.height > max_height]:
-        img.thumbnail((img.width, max_height), resample=Image.LANCZOS)
+    height = min(x.height for x in img_list)
+    if max_height is not None:
+        height = min(height, max_height)
+    widths = [max(round(img.width * height / img.height), 1) for img in img_list]
+    if max_width is not None and sum(widths) > max_width:
+        scale = max_width / sum(widths)
+        height = max(int(height * scale), 1)
+        widths = [max(int(width * scale), 1) for width in widths]
 
-    # Calculate the width of the final image.
-    total_width = sum(x.width for x in img_list)
     # Create an empty image with black color.
-    concatenated_image = Image.new('RGB', (total_width, max_height), (0, 0, 0))
+    concatenated_image = Image.new('RGB', (sum(widths), height), (0, 0, 0))
 
     # Paste each image at X = 0, Y = current_width.
     current_width = 0
-    for img in img_list:
+    for img, width in zip(img_list, widths):
+        if img.size != (width, height):
+            # Reduces by whole factors first (fast), then resamples what is left.
+            img = img.resize((width, height), resample=Image.LANCZOS, reducing_gap=2.0)
         concatenated_image.paste(img, (current_width, 0))
-        current_width += img.width
+        current_width += width
+
+    return concatenated_image
+
+
+def _render_cover_strip(img_list, max_height, max_width, image_format, quality):
+    image = _concatenate(img_list, max_height, max_width)
+    image_binary = BytesIO()
+    if image_format == 'WEBP':
+        image.save(image_binary, 'WEBP', quality=quality, method=4)
+    else:
+        image.save(image_binary, 'JPEG', quality=quality, optimize=True)
+    # Set image at frame 0.
+    image_binary.seek(0)
+    return image_binary
+
+
+"""
+Keeps encoded cover strips in memory, least recently used first out once they take more than size MB. Keys identify
+the covers in the strip and how it was rendered, see render_cover_strip.
+"""
+class StripCache:
+    def __init__(self, size=16):
+        self.limit = size * 2 ** 20
+        # Key -> encoded strip, least recently used first.
+        self._strips = OrderedDict()
+        self._used = 0
+
+    def get(self, key):
+        data = self._strips.get(key)
+        if data is not None:
+            self._strips.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        if key in self._strips:
+            self._used -= len(self._strips.pop(key))
+        self._strips[key] = data
+        self._used += len(data)
+        while self._used > self.limit and len(self._strips) > 1:
+            self._used -= len(self._strips.popitem(last=False)[1])
+
+
+"""
+Builds a strip of cover images (see _concatenate) and encodes it as JPEG or WebP (image_format) with the given quality,
+in a thread so the event loop is not blocked. Returns the encoded image and a file name for it.
+
+covers identifies the images in img_list in the same order (e.g. their URLs). With a cache (see StripCache), a strip
+of the same covers that has been rendered before is returned without any image processing.
+"""
+async def render_cover_strip(img_list, max_height=300, max_width=2000, image_format='JPEG', quality=80, covers=None,
+                             cache=None):
+    image_format = image_format.upper()
+    file_name = 'cover_images.webp' if image_format == 'WEBP' else 'cover_images.jpg'
+
+    key = None
+    if cache is not None and covers is not None:
+        key = (tuple(covers), max_height, max_width, image_format, quality)
+        data = cache.get(key)
+        if data is not None:
+            return BytesIO(data), file_name
 
-    return concatenated_image
\ No newline at end of file
+    loop = asyncio.get_event_loop()
+    image_binary = await loop.run_in_executor(
+        None, _render_cover_strip, img_list, max_height, max_width, image_format, quality
+    )
+    if key is not None:
+        cache.put(key, image_binary.getvalue())
+    return image_binary, file_name
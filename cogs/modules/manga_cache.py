@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import asyncio
+import json
+import time
+import asyncpg
+# Internal modules
+import cogs.modules.psql as psql
+import cogs.modules.rss_parser as rss_parser
+import cogs.modules.settings as settings
+
+
+"""
+Caches the data of each manga returned by the MangaDex API (its title and cover URL) for ttl seconds, keyed by the API
+URL of the manga.
+
+The data is kept in memory (up to max_size mangas) and, when a database is given, in the manga_metadata table so it
+survives restarts. Requests for a manga which is already being downloaded wait for that download instead of making
+their own.
+"""
+class MangaCache:
+    def __init__(self, database=None, ttl=86400, max_size=10000):
+        self.database = database
+        self.ttl = ttl
+        self.max_size = max_size
+        # API URL -> (time it expires, data), oldest first.
+        self._memory = OrderedDict()
+        # API URL -> task downloading the data.
+        self._loading = {}
+
+    """
+    Returns the data of a manga as {'status': 200, 'error': None, 'data': {'title', 'mainCover'}}, or the error
+    returned by rss_parser.get_rss_feed if it could not be downloaded. Errors are not cached.
+    """
+    async def get(self, session, manga_url):
+        cached = self._memory.get(manga_url)
+        if cached is not None and cached[0] > time.time():
+            return {'status': 200, 'error': None, 'data': cached[1]}
+
+        task = self._loading.get(manga_url)
+        if task is None:
+            task = asyncio.ensure_future(self._load(session, manga_url))
+            self._loading[manga_url] = task
+            task.add_done_callback(lambda _: self._loading.pop(manga_url, None))
+        # A waiting poll being cancelled should not cancel the download for the others.
+        return await asyncio.shield(task)
+
+    def _remember(self, manga_url, data, fetched_at):
+        self._memory.pop(manga_url, None)
+        self._memory[manga_url] = (fetched_at + self.ttl, data)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    async def _load(self, session, manga_url):
+        stored = await self._select(manga_url)
+        if stored is not None:
+            return {'status': 200, 'error': None, 'data': stored}
+
+        resp = await rss_parser.get_rss_feed(session, manga_url, kind=rss_parser.API)
+        if resp['status'] != 200:
+            return resp
+        try:
+            manga = json.loads(resp['data'])['data']
+            data = {'title': manga['title'], 'mainCover': manga['mainCover']}
+        except (ValueError, KeyError, TypeError):
+            return {'status': -1, 'data': f"Error: {manga_url} returned invalid data.", 'error': 'data_error'}
+
+        self._remember(manga_url, data, time.time())
+        await self._store(manga_url, data)
+        return {'status': 200, 'error': None, 'data': data}
+
+    async def _select(self, manga_url):
+        if self.database is None:
+            return None
+        try:
+            rows = await self.database.select(
+                columns = "title, cover_url, fetched_at",
+                table = "manga_metadata",
+                condition = "WHERE url = $1",
+                args = (manga_url,)
+            )
+        except (asyncpg.PostgresError, OSError) as error:
+            print(f"Failed to read manga data from database: {error}")
+            return None
+
+        if not rows or rows[0]['fetched_at'].timestamp() + self.ttl <= time.time():
+            return None
+        data = {'title': rows[0]['title'], 'mainCover': rows[0]['cover_url']}
+        self._remember(manga_url, data, rows[0]['fetched_at'].timestamp())
+        return data
+
+    async def _store(self, manga_url, data):
+        if self.database is None:
+            return
+        try:
+            await self.database.execute(
+                "INSERT INTO manga_metadata (url, title, cover_url, fetched_at) VALUES ($1, $2, $3, $4) "
+                "ON CONFLICT (url) DO UPDATE SET title = EXCLUDED.title, cover_url = EXCLUDED.cover_url, "
+                "fetched_at = EXCLUDED.fetched_at",
+                manga_url, data['title'], data['mainCover'], datetime.now(timezone.utc)
+            )
+        except (asyncpg.PostgresError, OSError) as error:
+            print(f"Failed to save manga data to database: {error}")
+
+
+"""
+Returns the manga cache owned by the bot, creating it from the settings if the bot does not have one yet.
+"""
+def get_manga_cache(bot):
+    if getattr(bot, 'manga_cache', None) is None:
+        cache_settings = settings.load()['manga_cache']
+        bot.manga_cache = MangaCache(
+            database = psql.get_database(bot) if cache_settings['persist'] else None,
+            ttl = cache_settings['ttl'],
+            max_size = cache_settings['max_size']
+        )
+    return bot.manga_cache
@@ -0,0 +1,205 @@
+import contextlib
+import math
+import time
+
+# Every metric, in the order they were created.
+REGISTRY = []
+
+# Upper bounds of the histogram buckets in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Number of feeds FEED_FETCH_SECONDS is kept for, a series per feed would not scale to every feed.
+SLOWEST_FEEDS = 20
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+"""
+Base of all metrics. Values are kept per combination of label values, labels are given as keyword arguments.
+"""
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # Label values -> value.
+        self.values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _matches(self, key, labels):
+        return all(key[self.labels.index(name)] == str(value) for name, value in labels.items())
+
+    """
+    Returns the samples of the metric in the Prometheus text format as (name, [(label, value), ...], value).
+    """
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, list(zip(self.labels, key)), value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    """
+    Returns the sum of the values with the given labels (all values if none are given).
+    """
+    def total(self, **labels):
+        return sum(value for key, value in self.values.items() if self._matches(key, labels))
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def remove(self, **labels):
+        self.values.pop(self._key(labels), None)
+
+    """
+    Makes an unlabelled gauge return what function returns whenever it is read.
+    """
+    def set_function(self, function):
+        self._function = function
+
+    def get(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self.values.get(self._key(labels))
+
+    def samples(self):
+        if self._function is not None:
+            yield self.name, [], self._function()
+        else:
+            yield from super().samples()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        data = self.values.get(key)
+        if data is None:
+            # Count per bucket, sum and count.
+            data = self.values[key] = [[0] * len(self.buckets), 0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[0][index] += 1
+        data[1] += value
+        data[2] += 1
+
+    """
+    Observes the seconds the with block takes.
+    """
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    """
+    Returns the count and sum of the observations with the given labels (all observations if none are given).
+    """
+    def summary(self, **labels):
+        count = 0
+        total = 0
+        for key, data in self.values.items():
+            if self._matches(key, labels):
+                total += data[1]
+                count += data[2]
+        return count, total
+
+    def samples(self):
+        for key, (buckets, total, count) in self.values.items():
+            labels = list(zip(self.labels, key))
+            for bound, bucket_count in zip(self.buckets, buckets):
+                yield f"{self.name}_bucket", labels + [('le', _format_value(bound))], bucket_count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+"""
+Returns every metric in the Prometheus text format.
+"""
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+FETCHES = Counter('rssbot_fetches_total', "Feeds fetched, by kind and HTTP status (-1 if failed).", ('kind', 'status'))
+FETCH_SECONDS = Histogram('rssbot_fetch_seconds', "Seconds fetching a feed took.", ('kind',))
+FEED_FETCH_SECONDS = Gauge(
+    'rssbot_feed_fetch_seconds', "Seconds the last fetch of the slowest feeds took (see SLOWEST_FEEDS).",
+    ('kind', 'feed')
+)
+DOWNLOADED_BYTES = Counter('rssbot_downloaded_bytes_total', "Bytes downloaded: feeds, API responses and images.")
+PARSE_SECONDS = Histogram(
+    'rssbot_parse_seconds', "Seconds parsing a feed took, by mode (stream, pool or inline).", ('mode',)
+)
+DB_SECONDS = Histogram('rssbot_db_seconds', "Seconds database statements took, by operation.", ('operation',))
+SEND_SECONDS = Histogram('rssbot_discord_send_seconds', "Seconds sending a message to Discord took.")
+SENT_MESSAGES = Counter('rssbot_discord_messages_total', "Messages sent to Discord, by result.", ('result',))
+QUEUE_DEPTH = Gauge('rssbot_dispatch_queue_depth', "Messages waiting to be sent to Discord.")
+POLL_SECONDS = Histogram('rssbot_poll_seconds', "Seconds polling a feed took, including sending updates.", ('kind',))
+RELOAD_SECONDS = Histogram('rssbot_reload_seconds', "Seconds saving and reloading the subscriptions took.", ('kind',))
+RESPONSE_CACHE = Counter(
+    'rssbot_response_cache_total', "Requests answered from the response cache (hit) or not (miss).", ('result',)
+)
+OPEN_CIRCUITS = Gauge('rssbot_hosts_down', "Hosts not requested because they are down (see health.HostBreaker).")
+DISABLED_FEEDS = Counter('rssbot_disabled_feeds_total', "Feeds disabled because they failed too many times in a row.")
+LOOP_LAG_SECONDS = Histogram('rssbot_event_loop_lag_seconds', "Seconds the event loop was late to wake a task up.")
+
+
+"""
+Records a fetch of a feed. kind is 'rss' or 'mangadex' (see feeds).
+"""
+def record_fetch(kind, feed_id, status, seconds):
+    FETCHES.inc(kind=kind, status=status)
+    FETCH_SECONDS.observe(seconds, kind=kind)
+
+    # Only the slowest feeds are kept, a slower one takes the place of the fastest of them.
+    slowest = FEED_FETCH_SECONDS.values
+    if FEED_FETCH_SECONDS._key({'kind': kind, 'feed': feed_id}) not in slowest and len(slowest) >= SLOWEST_FEEDS:
+        (fastest_kind, fastest_feed), fastest = min(slowest.items(), key=lambda item: item[1])
+        if seconds <= fastest:
+            return
+        FEED_FETCH_SECONDS.remove(kind=fastest_kind, feed=fastest_feed)
+    FEED_FETCH_SECONDS.set(seconds, kind=kind, feed=feed_id)
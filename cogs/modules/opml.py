@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from xml.etree import ElementTree
+
+
+"""
+Raised for files which are not valid OPML.
+"""
+class OPMLError(Exception):
+    pass
+
+
+"""
+Returns the feeds listed in an OPML file as a list of {'name', 'url'}, in the order of the file. Feeds in categories
+(nested outlines) are included. A feed listed twice is only returned once and names are made unique, as a user can
+only have one subscription with a given name.
+"""
+def parse_opml(data):
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError as error:
+        raise OPMLError(f"Not a valid XML file ({error}).")
+    if root.tag.lower() != 'opml':
+        raise OPMLError("Not an OPML file.")
+
+    outlines = []
+    urls = set()
+    names = set()
+    for outline in root.iter('outline'):
+        # Attribute names are case sensitive, but not every exporter gets them right.
+        attributes = {name.lower(): value.strip() for name, value in outline.attrib.items()}
+        url = attributes.get('xmlurl')
+        if not url or url in urls:
+            continue
+        urls.add(url)
+
+        name = attributes.get('text') or attributes.get('title') or url
+        unique_name = name
+        number = 2
+        while unique_name in names:
+            unique_name = f"{name} ({number})"
+            number += 1
+        names.add(unique_name)
+        outlines.append({'name': unique_name, 'url': url})
+    return outlines
+
+
+"""
+Returns an OPML file (as bytes) listing feeds, given as (name, url) pairs.
+"""
+def build_opml(title, feeds):
+    root = ElementTree.Element('opml', version='2.0')
+    head = ElementTree.SubElement(root, 'head')
+    ElementTree.SubElement(head, 'title').text = title
+    ElementTree.SubElement(head, 'dateCreated').text = format_datetime(datetime.now(timezone.utc))
+    body = ElementTree.SubElement(root, 'body')
+    for name, url in feeds:
+        ElementTree.SubElement(body, 'outline', type='rss', text=name, title=name, xmlUrl=url)
+    return ElementTree.tostring(root, encoding='utf-8', xml_declaration=True)
@@ -0,0 +1,287 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urljoin
+from xml.etree import ElementTree
+from bs4 import BeautifulSoup
+import feedparser
+# Internal modules
+import cogs.modules.metrics as metrics
+import cogs.modules.seen as seen
+import cogs.modules.settings as settings
+
+# Number of entries in a row a FeedStream has to know before it stops.
+KNOWN_RUN = 3
+# The xml:base attribute, relative links are resolved against it.
+XML_BASE = '{http://www.w3.org/XML/1998/namespace}base'
+
+
+"""
+Returns the text of the first paragraph of an HTML description, or all of its text if it has no paragraph.
+"""
+def description_text(html):
+    if not html:
+        return ''
+    soup = BeautifulSoup(html, features='html.parser')
+    paragraph = soup.p
+    return paragraph.text if paragraph is not None else soup.get_text()
+
+
+"""
+Returns the descriptions (see description_text) of a list of HTML summaries.
+"""
+def description_texts(summaries):
+    return [description_text(summary) for summary in summaries]
+
+
+"""
+Parses a feed and returns only what the cogs use, as plain dicts and strings so it can be sent back from a worker
+process. The layout follows feedparser: {'feed': {...}, 'entries': [{...}, ...]}. Entries get a fingerprint as well
+(see seen.fingerprint).
+"""
+def parse_feed(data):
+    feed = feedparser.parse(data)
+    info = feed.get('feed', {})
+
+    return {
+        'feed': {
+            'title': info.get('title_detail', {}).get('value', info.get('title', '')),
+            'link': info.get('link', ''),
+            'image': info.get('image', {}).get('href', ''),
+            # Hints on how often the feed should be polled (see scheduler.feed_hint).
+            'ttl': info.get('ttl'),
+            'sy_updateperiod': info.get('sy_updateperiod'),
+            'sy_updatefrequency': info.get('sy_updatefrequency')
+        },
+        'entries': [
+            {
+                'id': entry.get('id', entry.get('link')),
+                'title': entry.get('title', ''),
+                'link': entry.get('link', ''),
+                'description': description_text(entry.get('description')),
+                'summary': entry.get('summary', ''),
+                # MangaDex only, link to the manga of a chapter.
+                'mangalink': entry.get('mangalink'),
+                'fingerprint': seen.fingerprint(entry.get('id', entry.get('link')), entry.get('title'))
+            }
+            for entry in feed.get('entries', [])
+        ]
+    }
+
+
+# Raised by FeedStream for anything that is not well-formed XML.
+StreamError = ElementTree.ParseError
+
+
+"""
+Returns the name of an XML tag without its namespace, in lower case.
+"""
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1].lower()
+
+
+"""
+Incremental parser for RSS and Atom feeds, fed with the body as it is downloaded.
+
+Returns the same layout as parse_feed, except that descriptions are None until the entries are given to
+Parser.describe: turning HTML into text is too slow to do on the event loop for every entry. Feeds list their newest entries first, so the parser stops (done is set) once
+is_known has returned True for KNOWN_RUN entries in a row (a few more than one, in case an old entry was moved to the
+top), or once it has limit entries. The rest of the feed is never downloaded or parsed. Raises StreamError if the feed
+is not well-formed XML, in which case it should be parsed with the more lenient parse_feed instead.
+
+Relative links are resolved against xml:base like feedparser does, so entries get the same fingerprint either way.
+"""
+class FeedStream:
+    def __init__(self, is_known=None, limit=None):
+        self.is_known = is_known
+        self.limit = limit
+        self.known_run = 0
+        self.done = False
+        self.info = {
+            'title': '',
+            'link': '',
+            'image': '',
+            'ttl': None,
+            'sy_updateperiod': None,
+            'sy_updatefrequency': None
+        }
+        self.entries = []
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        # Elements from the root down to the one being parsed, and the xml:base of each.
+        self._path = []
+        self._bases = []
+
+    def feed(self, data):
+        if self.done:
+            return
+        self._parser.feed(data)
+        self._read_events()
+
+    """
+    Tells the parser the whole feed has been fed.
+    """
+    def close(self):
+        if not self.done:
+            self._parser.close()
+            self._read_events()
+
+    def result(self):
+        return {'feed': self.info, 'entries': self.entries}
+
+    def _read_events(self):
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                parent_base = self._bases[-1] if self._bases else ''
+                self._path.append(element)
+                self._bases.append(urljoin(parent_base, element.get(XML_BASE, '')))
+                continue
+
+            self._path.pop()
+            base = self._bases.pop()
+            name = _local_name(element.tag)
+            parent = _local_name(self._path[-1].tag) if self._path else None
+
+            if name in ('item', 'entry'):
+                self._add_entry(element, base)
+                # Free the entry, only the extracted fields are kept.
+                self._path[-1].remove(element)
+                if self.done:
+                    return
+            elif parent in ('channel', 'feed'):
+                self._add_info(name, element, base)
+            elif name == 'url' and parent == 'image' and not self.info['image']:
+                self.info['image'] = (element.text or '').strip()
+
+    def _add_info(self, name, element, base):
+        text = (element.text or '').strip()
+        if name == 'title' and not self.info['title']:
+            self.info['title'] = text
+        elif name == 'link' and not self.info['link']:
+            # RSS has the link as text, Atom as the href of the alternate link.
+            if element.get('href') is None:
+                self.info['link'] = urljoin(base, text)
+            elif element.get('rel', 'alternate') == 'alternate':
+                self.info['link'] = urljoin(base, element.get('href'))
+        elif name in ('icon', 'logo') and not self.info['image']:
+            self.info['image'] = text
+        elif name == 'ttl':
+            self.info['ttl'] = text
+        elif name == 'updateperiod':
+            self.info['sy_updateperiod'] = text
+        elif name == 'updatefrequency':
+            self.info['sy_updatefrequency'] = text
+
+    def _add_entry(self, element, base):
+        entry = {'id': None, 'title': '', 'link': '', 'description': None, 'summary': '', 'mangalink': None}
+        for child in element:
+            name = _local_name(child.tag)
+            text = (child.text or '').strip()
+            if name == 'title':
+                entry['title'] = text
+            elif name == 'link' and not entry['link']:
+                link_base = urljoin(base, child.get(XML_BASE, ''))
+                if child.get('href') is None:
+                    entry['link'] = urljoin(link_base, text)
+                elif child.get('rel', 'alternate') == 'alternate':
+                    entry['link'] = urljoin(link_base, child.get('href'))
+            elif name in ('guid', 'id'):
+                entry['id'] = text
+            elif name in ('description', 'summary') or (name == 'content' and not entry['summary']):
+                entry['summary'] = child.text or ''
+            elif name == 'mangalink':
+                entry['mangalink'] = text
+
+        if entry['id'] is None:
+            entry['id'] = entry['link']
+        entry['fingerprint'] = seen.fingerprint(entry['id'], entry['title'])
+        self.entries.append(entry)
+
+        if self.is_known is not None and self.is_known(entry):
+            self.known_run += 1
+        else:
+            self.known_run = 0
+        if self.known_run >= KNOWN_RUN or (self.limit is not None and len(self.entries) >= self.limit):
+            self.done = True
+
+
+"""
+Parses feeds in a pool of worker processes so large feeds do not block the event loop and parsing can use every core.
+
+With 0 workers feeds are parsed on the event loop instead. The pool is started the first time it is needed and shut
+down when the last cog using it has released it.
+"""
+class Parser:
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.users = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), function, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for using too much memory), start a new pool and try once more.
+            self._executor = None
+            return await loop.run_in_executor(self._get_executor(), function, *args)
+
+    """
+    Parses a downloaded feed, see parse_feed.
+    """
+    async def parse(self, data):
+        if self.workers == 0:
+            with metrics.PARSE_SECONDS.time(mode='inline'):
+                return parse_feed(data)
+
+        with metrics.PARSE_SECONDS.time(mode='pool'):
+            return await self._run(parse_feed, data)
+
+    """
+    Sets the description of the entries which do not have one yet (parsed by a FeedStream) from their summary. Only
+    the entries which are sent need one.
+    """
+    async def describe(self, entries):
+        entries = [entry for entry in entries if entry['description'] is None]
+        if not entries:
+            return
+        summaries = [entry['summary'] for entry in entries]
+        if self.workers == 0:
+            descriptions = description_texts(summaries)
+        else:
+            descriptions = await self._run(description_texts, summaries)
+        for entry, description in zip(entries, descriptions):
+            entry['description'] = description
+
+    """
+    Registers a user (cog) of the pool.
+    """
+    def acquire(self):
+        self.users += 1
+        return self
+
+    """
+    Unregisters a user (cog) of the pool and shuts the pool down once nobody is using it anymore.
+    """
+    async def release(self):
+        self.users = max(self.users - 1, 0)
+        if self.users == 0:
+            self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+
+"""
+Returns the parser owned by the bot, creating it from the settings if the bot does not have one yet.
+"""
+def get_parser(bot):
+    if getattr(bot, 'feed_parser', None) is None:
+        bot.feed_parser = Parser(workers=settings.load()['parsing']['workers'])
+    return bot.feed_parser
@@ -0,0 +1,78 @@
+import asyncio
+import contextlib
+from urllib.parse import urlsplit
+
+
+"""
+Fetches many feeds concurrently.
+
+The number of fetches running at the same time is capped globally (concurrency) and per host (per_host) so a large
+number of feeds on the same site does not hammer that site. Every result is handed to the handler as soon as its fetch
+is done, which means one slow or dead feed only delays itself and not every feed after it.
+"""
+class Poller:
+    def __init__(self, concurrency=20, per_host=4):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self._semaphore = None
+        self._host_semaphores = {}
+
+    """
+    Returns a poller with a global limit of its own (concurrency) which shares the per host limits of this one, so both
+    together never fetch more than per_host at a time from a host.
+    """
+    def sharing_hosts(self, concurrency):
+        shared = Poller(concurrency, self.per_host)
+        shared._host_semaphores = self._host_semaphores
+        return shared
+
+    """
+    Returns the semaphore limiting the number of concurrent fetches against a host.
+    """
+    def _host_semaphore(self, url):
+        host = urlsplit(url).hostname or ''
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self._host_semaphores[host]
+
+    """
+    Waits until a fetch of url is allowed within the global and per host limits and holds the slot until the block is
+    done. The host slot is taken first so a fetch waiting for a busy host does not hold a global slot other hosts could
+    use.
+    """
+    @contextlib.asynccontextmanager
+    async def limit(self, url):
+        # Created here so it belongs to the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self._host_semaphore(url):
+            async with self._semaphore:
+                yield
+
+    """
+    Fetches a single item within the limits and passes the result on to the handler, returning what the handler
+    returns. The handler is run outside of the limits so sending to Discord does not keep other feeds from being
+    fetched. fetch(item) is awaited to download the feed at url and handle(item, result) with the result.
+    """
+    async def poll(self, url, item, fetch, handle):
+        async with self.limit(url):
+            result = await fetch(item)
+        return await handle(item, result)
+
+    """
+    Polls every (url, item) pair in jobs (see poll). Errors raised by a single job are printed and do not stop the
+    others.
+    """
+    async def run(self, jobs, fetch, handle):
+        tasks = [asyncio.ensure_future(self.poll(url, item, fetch, handle)) for url, item in jobs]
+        try:
+            for task in asyncio.as_completed(tasks):
+                try:
+                    await task
+                except Exception as error:
+                    print(f"Failed to poll feed: {error!r}")
+        finally:
+            # Do not leave fetches running if the poll itself is cancelled (e.g. the cog is unloaded).
+            for task in tasks:
+                task.cancel()
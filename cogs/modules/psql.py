@@ -1,74 +1,187 @@
-import psycopg2
+import asyncio
+import json
+import asyncpg
+# Internal modules
+import cogs.modules.metrics as metrics
+import cogs.modules.settings as settings
 
-class ConnectionError(Exception):
-    def __init__(self, message):
-        super().__init__(message)
 
+"""
+Async access to the database through a pool of connections shared by every cog.
+
+The pool is created the first time a query is made and closed when the last cog using it has released it. All values
+are passed as query arguments ($1, $2, ...) and never formatted into the statement.
+"""
 class PSQL:
-    def __init__(self, host, user, password, database, port=5432):
+    def __init__(self, host, user, password, database, port=5432, min_size=1, max_size=10):
         self.host = host
         self.user = user
         self.password = password
         self.port = port
         self.database = database
-        self.connection = None
-        self.cursor = None
-
-    def _connect(self):
-        self.connection = psycopg2.connect(
-            host = self.host,
-            user = self.user,
-            password = self.password,
-            port = self.port,
-            database = self.database
-        )
-        self.cursor = self.connection.cursor()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.users = 0
+        self.pool = None
+        self._lock = None
 
+    """
+    Returns the pool, creating it if it does not exist yet.
+    """
+    async def _get_pool(self):
+        if self.pool is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(
+                        host = self.host,
+                        user = self.user,
+                        password = self.password,
+                        port = self.port,
+                        database = self.database,
+                        min_size = self.min_size,
+                        max_size = self.max_size
+                    )
+        return self.pool
 
-    def _close(self):
-        try:
-            self.connection.close()
-            self.cursor.close()
-        except AttributeError:
-            pass
-
-    def select(self, columns, table, condition=None):
+    async def select(self, columns, table, condition=None, args=()):
         statement = f"SELECT {columns} FROM {table}"
         if condition is not None:
             statement += f" {condition}"
 
-        try:
-            self._connect()
-            self.cursor.execute(statement)
-            return self.cursor.fetchall()
-        except psycopg2.OperationalError as error:
-            raise error
-        finally:
-            self._close()
-
-    def insert(self, table, columns, values):
-        statement = f"INSERT INTO {table} ({columns}) VALUES ({values})"
+        pool = await self._get_pool()
+        with metrics.DB_SECONDS.time(operation='select'):
+            return await pool.fetch(statement, *args)
 
-        try:
-            self._connect()
-            self.cursor.execute(statement)
-            self.connection.commit()
-        except psycopg2.OperationalError as error:
-            raise error
-        finally:
-            self._close()
+    async def insert(self, table, columns, values):
+        placeholders = ', '.join(f"${index}" for index in range(1, len(values) + 1))
+        statement = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
 
+        pool = await self._get_pool()
+        with metrics.DB_SECONDS.time(operation='insert'):
+            await pool.execute(statement, *values)
 
-    def update(self, table, values, condition=None):
+    async def update(self, table, values, condition=None, args=()):
         statement = f"UPDATE {table} SET {values}"
         if condition is not None:
             statement += f" {condition}"
 
+        pool = await self._get_pool()
+        with metrics.DB_SECONDS.time(operation='update'):
+            await pool.execute(statement, *args)
+
+    """
+    Runs any other statement.
+    """
+    async def execute(self, statement, *args):
+        pool = await self._get_pool()
+        with metrics.DB_SECONDS.time(operation='execute'):
+            return await pool.execute(statement, *args)
+
+    """
+    Runs any other statement and returns the rows it returns.
+    """
+    async def fetch(self, statement, *args):
+        pool = await self._get_pool()
+        with metrics.DB_SECONDS.time(operation='fetch'):
+            return await pool.fetch(statement, *args)
+
+    """
+    Registers a user (cog) of the pool.
+    """
+    def acquire(self):
+        self.users += 1
+        return self
+
+    """
+    Unregisters a user (cog) of the pool and closes the pool once nobody is using it anymore.
+    """
+    async def release(self):
+        self.users = max(self.users - 1, 0)
+        if self.users == 0:
+            await self.close()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+        self.pool = None
+
+
+"""
+Collects updates of the same columns for many rows and writes them all in one statement.
+
+Each row is identified by key_column (a BIGINT) and columns are the columns to update. Columns are TEXT unless given
+another type in types. Only the last values set for a row are written. Used to save the state of every feed checked
+during a polling cycle in a single round trip instead of one per feed.
+"""
+class WriteBuffer:
+    def __init__(self, database, table, key_column, columns, types=None):
+        self.database = database
+        self.table = table
+        self.key_column = key_column
+        self.columns = columns
+        self.types = types or {}
+        self.pending = {}
+
+    """
+    Sets the values (in the same order as columns) to write for the row with the given key.
+    """
+    def set(self, key, *values):
+        self.pending[key] = values
+
+    """
+    Writes everything set since the last flush. Values are kept for the next flush if writing fails.
+    """
+    async def flush(self):
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        keys = list(pending)
+        # One array per column, unnest turns them back into rows.
+        arrays = [[pending[key][index] for key in keys] for index in range(len(self.columns))]
+        data_types = ', '.join(
+            f"${index}::{self.types.get(column, 'text')}[]" for index, column in enumerate(self.columns, start=2)
+        )
+        assignments = ', '.join(f"{column} = data.{column}" for column in self.columns)
+        statement = (
+            f"UPDATE {self.table} SET {assignments} "
+            f"FROM unnest($1::bigint[], {data_types}) AS data(key, {', '.join(self.columns)}) "
+            f"WHERE {self.table}.{self.key_column} = data.key"
+        )
+
         try:
-            self._connect()
-            self.cursor.execute(statement)
-            self.connection.commit()
-        except psycopg2.OperationalError as error:
-            raise error
-        finally:
-            self._close()
\ No newline at end of file
+            await self.database.execute(statement, keys, *arrays)
+        except Exception:
+            # Values set while flushing are newer and win.
+            pending.update(self.pending)
+            self.pending = pending
+            raise
+
+
+"""
+Reads the connection details from the psql file (see psql_sample).
+"""
+def load_settings(path='psql'):
+    with open(path, 'r') as db_file:
+        return json.load(db_file)
+
+
+"""
+Returns the database owned by the bot, creating it from the psql file if the bot does not have one yet.
+"""
+def get_database(bot):
+    if getattr(bot, 'database', None) is None:
+        pool_settings = settings.load()['database']
+        db_settings = load_settings()
+        bot.database = PSQL(
+            db_settings["host"],
+            db_settings["username"],
+            db_settings["password"],
+            db_settings["database"],
+            db_settings["port"],
+            min_size = pool_settings['min_size'],
+            max_size = pool_settings['max_size']
+        )
+    return bot.database
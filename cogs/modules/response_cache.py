@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+import asyncio
+import functools
+import json
+import time
+import zlib
+# Internal modules
+import cogs.modules.disk_cache as disk_cache
+import cogs.modules.metrics as metrics
+import cogs.modules.settings as settings
+
+
+"""
+Returns the directives of a Cache-Control header as a dict of lower cased names to values (None for directives
+without a value).
+"""
+def parse_cache_control(cache_control):
+    directives = {}
+    for directive in (cache_control or '').split(','):
+        name, separator, value = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"') if separator else None
+    return directives
+
+
+"""
+Returns the max-age of a Cache-Control header in seconds, or None if there is none.
+"""
+def parse_max_age(cache_control):
+    value = parse_cache_control(cache_control).get('max-age')
+    if value is None:
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return None
+
+
+"""
+Returns for how many more seconds a response may be reused without asking the server, from its Cache-Control
+max-age or else its Expires header, minus its Age. Returns None if the response may not be reused at all.
+"""
+def freshness(headers):
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in directives or 'no-cache' in directives or headers.get('Vary', '').strip() == '*':
+        return None
+
+    lifetime = parse_max_age(headers.get('Cache-Control'))
+    if lifetime is None:
+        if 'Expires' not in headers:
+            return None
+        try:
+            expires = parsedate_to_datetime(headers['Expires']).timestamp()
+            date = parsedate_to_datetime(headers['Date']).timestamp() if 'Date' in headers else time.time()
+        except (TypeError, ValueError, IndexError):
+            # An invalid date means already expired.
+            return None
+        lifetime = expires - date
+
+    try:
+        age = max(int(headers.get('Age', 0)), 0)
+    except ValueError:
+        age = 0
+    lifetime -= age
+    return lifetime if lifetime > 0 else None
+
+
+"""
+Two tier cache of downloaded responses, keyed by URL, reused for as long as the server says they stay fresh (see
+freshness). Shared by every cog so a feed fetched by a command is not fetched again by the next poll, and kept on disk
+so it survives restarts. Callers use the same URL for the same feed (see rss_parser.normalize_url).
+
+Bodies are kept compressed, in memory (least recently used first out once they take more than memory_size MB) and in
+path on disk (see disk_cache.DiskLRU, least recently used first out once they take more than disk_size MB).
+Compressing is done in a thread so the event loop is not blocked. Expired responses are kept until evicted, so they can
+be made fresh again by a 304 response (see revalidate).
+"""
+class ResponseCache:
+    def __init__(self, path='cache/responses', memory_size=16, disk_size=128):
+        self.memory_limit = memory_size * 2 ** 20
+        # URL -> entry, least recently used first. An entry is {'expires', 'etag', 'last_modified', 'body'} with the
+        # body compressed.
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        # Files are a line of JSON with the entry (and its URL) but the body, followed by the body.
+        self._disk = disk_cache.DiskLRU(path, disk_size)
+
+    @property
+    def enabled(self):
+        return self.memory_limit > 0 or self._disk.enabled
+
+    def _remember(self, url, entry):
+        if url in self._memory:
+            self._memory_used -= len(self._memory.pop(url)['body'])
+        if len(entry['body']) > self.memory_limit:
+            return
+        self._memory[url] = entry
+        self._memory_used += len(entry['body'])
+        while self._memory_used > self.memory_limit:
+            self._memory_used -= len(self._memory.popitem(last=False)[1]['body'])
+
+    @staticmethod
+    def _decode(url, data):
+        header, _, body = data.partition(b'\n')
+        entry = json.loads(header)
+        if entry.pop('url') != url:
+            # Another URL with the same hash.
+            return None
+        entry['body'] = body
+        return entry
+
+    async def _entry(self, url):
+        entry = self._memory.get(url)
+        if entry is not None:
+            self._memory.move_to_end(url)
+            return entry
+
+        entry = await self._disk.read(url, functools.partial(self._decode, url))
+        if entry is not None:
+            self._remember(url, entry)
+        return entry
+
+    async def _save(self, url, entry):
+        self._remember(url, entry)
+        header = {key: value for key, value in entry.items() if key != 'body'}
+        header['url'] = url
+        try:
+            await self._disk.write(url, json.dumps(header).encode('utf-8') + b'\n' + entry['body'])
+        except OSError as error:
+            print(f"Failed to cache response: {error}")
+
+    """
+    Returns the cached response for a URL as {'body', 'etag', 'last_modified', 'max_age'} if it is still fresh, with
+    max_age the seconds it stays fresh. Returns None otherwise.
+    """
+    async def get(self, url):
+        if not self.enabled:
+            return None
+        entry = await self._entry(url)
+        remaining = entry['expires'] - time.time() if entry is not None else 0
+        if remaining <= 0:
+            metrics.RESPONSE_CACHE.inc(result='miss')
+            return None
+
+        metrics.RESPONSE_CACHE.inc(result='hit')
+        body = await asyncio.get_event_loop().run_in_executor(None, zlib.decompress, entry['body'])
+        return {'body': body, 'etag': entry['etag'], 'last_modified': entry['last_modified'], 'max_age': int(remaining)}
+
+    """
+    Caches the body of a complete 200 response, if its headers allow it to be reused (see freshness).
+    """
+    async def put(self, url, headers, body):
+        lifetime = freshness(headers)
+        if not self.enabled or lifetime is None:
+            return
+        compressed = await asyncio.get_event_loop().run_in_executor(None, zlib.compress, body)
+        await self._save(url, {
+            'expires': time.time() + lifetime,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'body': compressed
+        })
+
+    """
+    Makes a cached response fresh again after the server answered a conditional request for it with 304.
+    """
+    async def revalidate(self, url, headers):
+        lifetime = freshness(headers)
+        if not self.enabled or lifetime is None:
+            return
+        entry = await self._entry(url)
+        etag = headers.get('ETag')
+        if entry is None or (etag is not None and etag != entry['etag']):
+            return
+        await self._save(url, dict(entry, expires=time.time() + lifetime))
+
+
+_cache = None
+
+
+"""
+Returns the response cache built from the settings.
+"""
+def get_cache():
+    global _cache
+    if _cache is None:
+        cache_settings = settings.load()['response_cache']
+        _cache = ResponseCache(
+            path = cache_settings['path'],
+            memory_size = cache_settings['memory_size'],
+            disk_size = cache_settings['disk_size']
+        )
+    return _cache
@@ -0,0 +1,139 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import aiohttp
+# Internal modules
+import cogs.modules.health as health
+import cogs.modules.settings as settings
+
+# Status codes worth trying again, everything else above 400 is treated as permanent.
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+class RetryError(Exception):
+    def __init__(self, attempts, status=None):
+        super().__init__(f"Gave up after {attempts} attempts (last status: {status})")
+        self.attempts = attempts
+        self.status = status
+
+
+class PermanentError(Exception):
+    def __init__(self, status):
+        super().__init__(f"Received status {status}")
+        self.status = status
+
+
+"""
+Reads the Retry-After header, which is either a number of seconds or an HTTP date. Returns None if missing or invalid.
+"""
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+"""
+Retries HTTP requests without blocking the event loop.
+
+Waits between attempts grow exponentially (base_delay * 2^attempt, at most max_delay) with full jitter so retries from
+many feeds do not line up. A Retry-After header from the server is used instead when present. No more than attempts
+requests are made and the policy gives up early if the next wait would take it past max_elapsed seconds in total.
+
+With a breaker (see health.HostBreaker) no request is made to a host that is down, HostDownError is raised instead,
+even between retries.
+"""
+class RetryPolicy:
+    def __init__(
+        self, attempts=5, base_delay=1, max_delay=60, max_elapsed=300, retry_statuses=RETRYABLE_STATUSES, breaker=None
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.retry_statuses = retry_statuses
+        self.breaker = breaker
+
+    """
+    Returns how many seconds to wait before the given (1 based) retry.
+    """
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    """
+    Sends a GET request and awaits handler(resp) with the response once a successful (or 304) status is received.
+    Raises PermanentError on non retryable error statuses and RetryError when giving up. Connection errors other than
+    timeouts and dropped connections are raised as is.
+    """
+    async def get(self, session, url, handler, **kwargs):
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            status = None
+            retry_after = None
+            if self.breaker is not None:
+                self.breaker.check(url)
+            try:
+                async with session.get(url, **kwargs) as resp:
+                    status = resp.status
+                    if status in self.retry_statuses:
+                        retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                    else:
+                        self._reached(url)
+                        if status >= 400:
+                            raise PermanentError(status)
+                        return await handler(resp)
+            except (asyncio.TimeoutError, aiohttp.ServerDisconnectedError, aiohttp.ClientPayloadError):
+                # Temporary network problem, try again.
+                pass
+            except aiohttp.ClientConnectorError:
+                self._unreachable(url)
+                raise
+
+            attempt += 1
+            delay = self.backoff(attempt, retry_after)
+            if attempt >= self.attempts or time.monotonic() - start + delay > self.max_elapsed:
+                self._unreachable(url)
+                raise RetryError(attempt, status)
+            await asyncio.sleep(delay)
+
+    def _reached(self, url):
+        if self.breaker is not None:
+            self.breaker.success(url)
+
+    def _unreachable(self, url):
+        if self.breaker is not None:
+            self.breaker.failure(url)
+
+
+_policy = None
+
+
+"""
+Returns the retry policy built from the settings.
+"""
+def get_policy():
+    global _policy
+    if _policy is None:
+        retry_settings = settings.load()['retry']
+        _policy = RetryPolicy(
+            attempts = retry_settings['attempts'],
+            base_delay = retry_settings['base_delay'],
+            max_delay = retry_settings['max_delay'],
+            max_elapsed = retry_settings['max_elapsed'],
+            breaker = health.get_breaker()
+        )
+    return _policy
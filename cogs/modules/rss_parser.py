@@ -1,25 +1,269 @@
+from urllib.parse import urlsplit, urlunsplit
 import time
 import aiohttp
+# Internal modules
+import cogs.modules.health as health
+import cogs.modules.metrics as metrics
+import cogs.modules.parsing as parsing
+import cogs.modules.response_cache as response_cache
+import cogs.modules.retry as retry
+import cogs.modules.settings as settings
+
+# Bytes read at a time.
+CHUNK_SIZE = 16384
+
+# Kinds of responses, each with its own size limit (see get_limits).
+FEED = 'feed'
+IMAGE = 'image'
+API = 'api'
+
+# Parts of the Content-Type accepted for each kind of response. Feeds are often served with a generic type, so any
+# XML type (e.g. text/xml, text/rss+xml) and text/plain are accepted, but not HTML pages.
+ACCEPTED_TYPES = {
+    FEED: ('xml', 'rss', 'atom', 'rdf', 'text/plain'),
+    IMAGE: ('image/', 'application/octet-stream'),
+    API: ('json', 'text/')
+}
+
+# Ports which can be left out of a URL.
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
 
 """
-Retreives the data from RSS URL and return the status codes as well as the data. Return -1 if something went wrong.
+Returns the URL in a normalized form so different ways of writing the same URL can be compared. The scheme and host
+are lower cased, default ports and fragments are removed and an empty path becomes "/".
+"""
+def normalize_url(url):
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        port = parts.port
+    except ValueError:
+        # Not a URL we can make sense of, leave it as is.
+        return url
+
+    # IPv6 addresses lose their brackets in hostname.
+    netloc = f"[{host}]" if ':' in host else host
+    if parts.username is not None:
+        credentials = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{credentials}@{netloc}"
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f"{netloc}:{port}"
+
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+"""
+Raised when a response is turned down because of its size or Content-Type. error is the name of the error returned
+for it (see get_rss_feed).
+"""
+class ResponseError(Exception):
+    def __init__(self, message, error):
+        super().__init__(message)
+        self.error = error
+
+
+_limits = None
+
+
+"""
+Returns the max size in bytes of each kind of response, from the settings.
+"""
+def get_limits():
+    global _limits
+    if _limits is None:
+        limit_settings = settings.load()['limits']
+        _limits = {
+            FEED: limit_settings['feed_size'] * 1024 * 1024,
+            IMAGE: limit_settings['image_size'] * 1024 * 1024,
+            API: limit_settings['api_size'] * 1024 * 1024
+        }
+    return _limits
+
+
+def _too_large(kind):
+    return ResponseError(f"is larger than {get_limits()[kind] / 1024 / 1024:g} MB.", 'size_error')
+
+
+"""
+Turns down a response before its body is read if its Content-Type does not fit the kind of response or it announces
+a body larger than allowed. Responses without a Content-Type or Content-Length are let through.
+"""
+def check_response(resp, kind):
+    if 'Content-Type' in resp.headers:
+        content_type = resp.content_type.lower()
+        if not any(part in content_type for part in ACCEPTED_TYPES[kind]):
+            raise ResponseError(f"has an unexpected Content-Type ({content_type}).", 'content_type_error')
+    if resp.content_length is not None and resp.content_length > get_limits()[kind]:
+        raise _too_large(kind)
+
+
+"""
+Reads the body of a response in chunks and returns it as bytes, raising ResponseError as soon as it gets larger than
+allowed for its kind. data is what has already been read of the body, if anything.
+"""
+async def read_body(resp, kind, data=None):
+    limit = get_limits()[kind]
+    data = bytearray() if data is None else data
+    read = 0
+    try:
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            data.extend(chunk)
+            read += len(chunk)
+            if len(data) > limit:
+                raise _too_large(kind)
+        return bytes(data)
+    finally:
+        metrics.DOWNLOADED_BYTES.inc(read)
+
+
+"""
+Parses a response while it is being downloaded, see get_rss_feed. Returns the fields of the result and the whole body,
+or None as body if the download was stopped early.
 """
-async def get_rss_feed(rss_url):
-    async with aiohttp.ClientSession() as session:
+async def read_stream(resp, stream, kind=FEED):
+    limit = get_limits()[kind]
+    received = bytearray()
+    parse_seconds = 0
+    try:
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            received.extend(chunk)
+            metrics.DOWNLOADED_BYTES.inc(len(chunk))
+            if len(received) > limit:
+                raise _too_large(kind)
+            start = time.perf_counter()
+            stream.feed(chunk)
+            parse_seconds += time.perf_counter() - start
+            if stream.done:
+                # Leaving the rest of the body unread closes the connection.
+                break
+        else:
+            stream.close()
+            metrics.PARSE_SECONDS.observe(parse_seconds, mode='stream')
+            return {'feed': stream.result()}, bytes(received)
+        metrics.PARSE_SECONDS.observe(parse_seconds, mode='stream')
+        return {'feed': stream.result()}, None
+    except parsing.StreamError:
+        # Not well-formed XML, leave it to the more lenient full parser.
+        data = await read_body(resp, kind, received)
+        return {'data': data}, data
+
+
+"""
+Returns the result of get_rss_feed for a response found in the response cache.
+"""
+def _cached_result(cached, etag, last_modified, make_stream):
+    result = {
+        'status': 200,
+        'data': None,
+        'feed': None,
+        'etag': cached['etag'],
+        'last_modified': cached['last_modified'],
+        'max_age': cached['max_age']
+    }
+    if (etag is not None and etag == cached['etag']) or \
+            (etag is None and last_modified is not None and last_modified == cached['last_modified']):
+        # The requester already has this version.
+        result['status'] = 304
+    elif make_stream is None:
+        result['data'] = cached['body']
+    else:
+        stream = make_stream()
         try:
-            retry_count = 0
-            while retry_count < 5:
-                async with session.get(rss_url) as resp:
-                    if resp.status == 200:
-                        return {'status': resp.status, 'data': await resp.text()}
-                    else:
-                        retry_count += 1
-                        time.sleep(60)
-            if retry_count == 5:
-                raise ValueError('To many failed connection attempts', retry_count)
-        except aiohttp.InvalidURL as error:
-            return {'status': -1, 'data': f"Error: {rss_url} is not a valid URL.", 'error': error}
-        except aiohttp.ClientConnectorError as error:
-            return {'status': -1, 'data': f"Error: Could not connect to {rss_url}.", 'error': error}
-        except ValueError as error:
-            return {'status': -1, 'data': f"Error: Could not connect to {rss_url} after {retry_count} attempts.", 'error': error}
\ No newline at end of file
+            with metrics.PARSE_SECONDS.time(mode='stream'):
+                stream.feed(cached['body'])
+                if not stream.done:
+                    stream.close()
+            result['feed'] = stream.result()
+        except parsing.StreamError:
+            result['data'] = cached['body']
+    return result
+
+
+"""
+Retreives the data from RSS URL and return the status codes as well as the data. Return -1 if something went wrong.
+The session is the bot's shared session (see http_client). Failed requests are retried according to the retry policy
+from the settings without blocking the event loop.
+
+etag and last_modified are the validators returned by the previous request for this URL. When given, the request is
+made conditional and status 304 (with no data) is returned if the feed has not changed since. The validators of the
+response are returned as well so they can be saved for the next request, along with the max-age the server allows
+the response to be cached for (see scheduler.feed_hint).
+
+Responses are cached for as long as the server allows (see response_cache) and a fresh cached response is returned
+without any request, with status 304 if it has the validators given. The cache is keyed by the normalized URL (see
+normalize_url), the URL the feed is saved and polled with.
+
+The body is returned as 'data' (bytes, the parsers decode it as the XML declaration says). It is read in chunks and
+the download is stopped as soon as it gets larger than the limit for its kind (FEED, or API for MangaDex API
+responses) or if the Content-Type does not fit the kind (see check_response), so at most the limit is ever kept in
+memory per request.
+
+make_stream is an optional function returning a new parsing.FeedStream. When given, the feed is parsed while it is
+downloaded and the download stops as soon as the stream is done; the parsed feed is returned as 'feed' and 'data' is
+None. If the feed turns out not to be well-formed XML, the whole body is returned as 'data' instead.
+"""
+async def get_rss_feed(session, rss_url, etag=None, last_modified=None, make_stream=None, kind=FEED):
+    cache = response_cache.get_cache()
+    cache_key = normalize_url(rss_url)
+    cached = await cache.get(cache_key)
+    if cached is not None:
+        return _cached_result(cached, etag, last_modified, make_stream)
+
+    headers = {}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+
+    async def read(resp):
+        result = {
+            'status': resp.status,
+            'data': None,
+            'feed': None,
+            'etag': resp.headers.get('ETag', etag),
+            'last_modified': resp.headers.get('Last-Modified', last_modified),
+            'max_age': response_cache.parse_max_age(resp.headers.get('Cache-Control'))
+        }
+
+        if resp.status == 304:
+            # Not modified, there is nothing to read.
+            await cache.revalidate(cache_key, resp.headers)
+            return result
+
+        check_response(resp, kind)
+        if make_stream is None:
+            body = result['data'] = await read_body(resp, kind)
+        else:
+            fields, body = await read_stream(resp, make_stream(), kind)
+            result.update(fields)
+        if resp.status == 200 and body is not None:
+            await cache.put(cache_key, resp.headers, body)
+        return result
+
+    try:
+        return await retry.get_policy().get(session, rss_url, read, headers=headers)
+    except aiohttp.InvalidURL:
+        return {'status': -1, 'data': f"Error: {rss_url} is not a valid URL.", 'error': 'invalid_url_error'}
+    except aiohttp.ClientConnectorError:
+        return {'status': -1, 'data': f"Error: Could not connect to {rss_url}.", 'error': 'connection_error'}
+    except retry.PermanentError as error:
+        return {'status': -1, 'data': f"Error: {rss_url} returned status {error.status}.", 'error': 'http_error'}
+    except retry.RetryError as error:
+        return {'status': -1, 'data': f"Error: Could not connect to {rss_url} after {error.attempts} attempts.", 'error': 'retry_error'}
+    except ResponseError as error:
+        return {'status': -1, 'data': f"Error: {rss_url} {error}", 'error': error.error}
+    except health.HostDownError as error:
+        return {'status': -1, 'data': f"Error: {error}.", 'error': 'host_down_error', 'retry_in': error.retry_in}
+    except aiohttp.ClientResponseError as error:
+        # E.g. too many redirects or a response that could not be read.
+        return {
+            'status': -1,
+            'data': f"Error: {rss_url} sent an invalid response ({type(error).__name__}).",
+            'error': 'http_error'
+        }
+    except aiohttp.ClientError as error:
+        return {
+            'status': -1, 'data': f"Error: Could not connect to {rss_url} ({error!r}).", 'error': 'connection_error'
+        }
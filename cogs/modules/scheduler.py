@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+# Seconds in each sy:updatePeriod of the RSS syndication module.
+UPDATE_PERIODS = {
+    'hourly': 3600,
+    'daily': 86400,
+    'weekly': 604800,
+    'monthly': 2592000,
+    'yearly': 31536000
+}
+
+
+"""
+Returns the minimum number of seconds between two polls the feed asks for, or None if it does not ask. Looks at the
+RSS <ttl> (minutes), sy:updatePeriod/sy:updateFrequency and the max-age of the response. feed is parsed by feedparser.
+"""
+def feed_hint(feed, max_age=None):
+    hints = []
+    if max_age is not None:
+        hints.append(max_age)
+
+    info = feed.get('feed', {})
+    try:
+        hints.append(int(info['ttl']) * 60)
+    except (KeyError, TypeError, ValueError):
+        pass
+    try:
+        period = UPDATE_PERIODS[info['sy_updateperiod'].strip().lower()]
+        hints.append(period / max(int(info.get('sy_updatefrequency', 1)), 1))
+    except (KeyError, AttributeError, TypeError, ValueError):
+        pass
+
+    return max(hints) if hints else None
+
+
+"""
+Decides when each feed is polled next.
+
+Feeds are kept in a min-heap ordered by the time they are due. The interval of a feed adapts to how often it changes:
+it is set to half of the average time between two changes when the feed changed and grows by half when it did not.
+The interval never goes below what the feed asks for (see feed_hint) and always stays between min_interval and
+max_interval. Keys are feed IDs, times are Unix timestamps.
+"""
+class Scheduler:
+    def __init__(self, default_interval=10800, min_interval=300, max_interval=86400):
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # Feed ID -> {'due', 'interval', 'gap', 'last_changed'}. 'due' is None while the feed is being polled.
+        self.entries = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._wakeup = None
+
+    def _clamp(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _push(self, key, entry):
+        heapq.heappush(self._heap, (entry['due'], next(self._counter), key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    """
+    Starts scheduling a feed. Without a due time the feed is due right away. interval, gap (average seconds between two
+    changes) and last_changed are the values saved from an earlier run, if any.
+    """
+    def add(self, key, due=None, interval=None, gap=None, last_changed=None):
+        if key in self.entries:
+            return
+        entry = {
+            'due': time.time() if due is None else due,
+            'interval': self._clamp(interval or self.default_interval),
+            'gap': gap,
+            'last_changed': last_changed
+        }
+        self.entries[key] = entry
+        self._push(key, entry)
+
+    """
+    Stops scheduling a feed.
+    """
+    def remove(self, key):
+        # The heap entry is dropped once it reaches the top.
+        self.entries.pop(key, None)
+
+    """
+    Schedules the next poll of a feed that has just been polled and returns its entry (None if the feed was removed in
+    the meantime). changed tells if the feed had anything new and hint is what the feed asks for (see feed_hint).
+    """
+    def reschedule(self, key, changed=False, hint=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        now = time.time()
+        if changed:
+            if entry['last_changed'] is not None:
+                gap = now - entry['last_changed']
+                # Moving average so a single burst does not change the interval too much.
+                entry['gap'] = gap if entry['gap'] is None else 0.7 * entry['gap'] + 0.3 * gap
+            entry['last_changed'] = now
+            if entry['gap'] is not None:
+                entry['interval'] = entry['gap'] / 2
+        else:
+            entry['interval'] *= 1.5
+
+        if hint is not None:
+            entry['interval'] = max(entry['interval'], hint)
+        entry['interval'] = self._clamp(entry['interval'])
+
+        entry['due'] = now + entry['interval']
+        self._push(key, entry)
+        return entry
+
+    """
+    Schedules the next poll of a feed that has just failed delay seconds from now, without changing what was learned
+    about how often it changes. Returns its entry (None if the feed was removed in the meantime).
+    """
+    def postpone(self, key, delay):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        entry['due'] = time.time() + delay
+        self._push(key, entry)
+        return entry
+
+    """
+    Waits until at least one feed is due and returns the keys of every due feed. The returned feeds are not returned
+    again until they have been rescheduled.
+    """
+    async def wait_due(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+
+        while True:
+            # Drop heap entries of removed feeds and of feeds rescheduled since they were pushed.
+            while self._heap:
+                due, _, key = self._heap[0]
+                entry = self.entries.get(key)
+                if entry is not None and entry['due'] == due:
+                    break
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    # Wake up early if a feed is added that is due sooner.
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            keys = []
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, key = heapq.heappop(self._heap)
+                entry = self.entries.get(key)
+                if entry is not None and entry['due'] == due:
+                    entry['due'] = None
+                    keys.append(key)
+            return keys
@@ -0,0 +1,83 @@
+import hashlib
+
+# Bytes in a fingerprint.
+FINGERPRINT_SIZE = 8
+# Fingerprints kept per subscription, as a multiple of the number of entries in the feed.
+RETENTION = 3
+# Min number of fingerprints kept per subscription, for feeds parsed by a FeedStream which stopped after a few entries.
+MIN_CAPACITY = 100
+
+
+"""
+Returns the fingerprint of an entry: a short hash of its ID (the guid or Atom id, or its link if it has neither), or
+of its title if it has no link either. Unlike the title, the ID stays the same when an entry is edited.
+"""
+def fingerprint(entry_id, title=None):
+    return hashlib.blake2b((entry_id or title or '').encode('utf-8'), digest_size=FINGERPRINT_SIZE).digest()
+
+
+def _key(fingerprint):
+    return int.from_bytes(fingerprint, 'big')
+
+
+"""
+The fingerprints of the most recent entries of a feed a subscription has seen, newest first.
+
+Finding the new entries of a feed only takes a lookup per entry, so entries that are reordered, duplicated or retitled
+are never sent twice. Stored in the database as the fingerprints joined into a single BYTEA, and kept in memory the
+same way along with a set of them as integers, so a subscription costs a few objects rather than two per entry.
+"""
+class SeenSet:
+    def __init__(self, data=None):
+        self._data = bytearray(data or b'')
+        self._index = self._build_index()
+
+    def _build_index(self):
+        return {
+            _key(self._data[index:index + FINGERPRINT_SIZE]) for index in range(0, len(self._data), FINGERPRINT_SIZE)
+        }
+
+    def __len__(self):
+        return len(self._data) // FINGERPRINT_SIZE
+
+    def __contains__(self, entry):
+        return _key(entry['fingerprint']) in self._index
+
+    """
+    Fingerprint of the newest entry seen or None if nothing has been seen yet.
+    """
+    @property
+    def newest(self):
+        return bytes(self._data[:FINGERPRINT_SIZE]) if self._data else None
+
+    """
+    Returns the entries that have not been seen, in the order of the feed and without duplicates.
+    """
+    def unseen(self, entries):
+        found = set()
+        new = []
+        for entry in entries:
+            key = _key(entry['fingerprint'])
+            if key not in self._index and key not in found:
+                found.add(key)
+                new.append(entry)
+        return new
+
+    """
+    Marks entries (in the order of the feed) as seen. The oldest fingerprints are dropped once there are more than
+    RETENTION times the entries in the feed (at least MIN_CAPACITY).
+    """
+    def add(self, entries):
+        new = self.unseen(entries)
+        if not new:
+            return
+        capacity = max(RETENTION * len(entries), MIN_CAPACITY)
+        self._data[:0] = b''.join(entry['fingerprint'] for entry in new)
+        if len(self._data) > capacity * FINGERPRINT_SIZE:
+            del self._data[capacity * FINGERPRINT_SIZE:]
+            self._index = self._build_index()
+        else:
+            self._index.update(_key(entry['fingerprint']) for entry in new)
+
+    def to_bytes(self):
+        return bytes(self._data)
@@ -0,0 +1,187 @@
+import copy
+import json
+import os
+
+# Used for every setting not found in the settings file.
+DEFAULTS = {
+    'poller': {
+        # Max number of feeds being fetched at the same time.
+        'concurrency': 20,
+        # Max number of feeds being fetched from the same host at the same time.
+        'per_host': 4
+    },
+    'http': {
+        # Max number of open connections in total.
+        'limit': 100,
+        # Max number of open connections to the same host.
+        'limit_per_host': 4,
+        # Seconds a DNS lookup is cached.
+        'dns_cache_ttl': 300,
+        # Seconds an idle connection is kept open for reuse.
+        'keepalive_timeout': 30,
+        # Seconds a whole request may take.
+        'timeout': 60,
+        # Seconds connecting to a host may take.
+        'connect_timeout': 10
+    },
+    'limits': {
+        # Max MB of a feed, larger feeds are not downloaded.
+        'feed_size': 10,
+        # Max MB of a cover image.
+        'image_size': 5,
+        # Max MB of a MangaDex API response.
+        'api_size': 1
+    },
+    'response_cache': {
+        # Folder responses are cached in, for as long as the server allows.
+        'path': 'cache/responses',
+        # Max MB of compressed responses kept in memory.
+        'memory_size': 16,
+        # Max MB of compressed responses kept on disk. Set both sizes to 0 to not cache responses.
+        'disk_size': 128
+    },
+    'retry': {
+        # Max number of requests made for a single URL.
+        'attempts': 5,
+        # Seconds to wait before the first retry, doubled for every following retry.
+        'base_delay': 1,
+        # Max seconds to wait between two retries.
+        'max_delay': 60,
+        # Max seconds spent on a single URL including all retries.
+        'max_elapsed': 300
+    },
+    'health': {
+        # Requests in a row which could not reach a host before it is left alone for a while.
+        'host_failures': 5,
+        # Seconds a host is left alone, doubled every time it is still down (see health.HostBreaker).
+        'host_cooldown': 60,
+        # Max seconds a host is left alone.
+        'host_max_cooldown': 3600,
+        # Seconds to wait before polling a feed again after it failed, doubled for every failure in a row.
+        'feed_backoff': 300,
+        # Max seconds to wait before polling a failing feed again.
+        'feed_max_backoff': 86400,
+        # Failures in a row after which a feed is no longer polled and its subscribers are told (never if 0).
+        'disable_after': 10
+    },
+    'scheduler': {
+        # Seconds between two polls of an RSS feed until the bot has learned how often the feed changes.
+        'rss_interval': 10800,
+        # Seconds between two polls of a MangaDex feed until the bot has learned how often the feed changes.
+        'mangadex_interval': 900,
+        # Min seconds between two polls of the same feed.
+        'min_interval': 300,
+        # Max seconds between two polls of the same feed.
+        'max_interval': 86400,
+        # Seconds between two reloads of the subscriptions, which is also how often changes are saved.
+        'reload_interval': 300
+    },
+    'opml': {
+        # Max number of feeds of an imported OPML file checked at the same time.
+        'concurrency': 10,
+        # Max MB of an imported OPML file.
+        'max_size': 1,
+        # Min seconds between two updates of the progress of an import.
+        'progress_interval': 3
+    },
+    'startup': {
+        # Seconds the first polls after a start are spread over, instead of polling every overdue feed at once.
+        'warmup': 600,
+        # Folder the changes not yet saved to the database are kept in when the bot stops, saved on the next start.
+        'snapshot_path': 'cache/state'
+    },
+    'parsing': {
+        # Number of processes parsing feeds, null for one per CPU core and 0 to parse on the event loop.
+        'workers': None
+    },
+    'dispatch': {
+        # Max number of updates sent to a channel in one message.
+        'batch_size': 10,
+        # Max number of messages sent to the same channel per channel_period seconds.
+        'channel_limit': 5,
+        'channel_period': 5,
+        # Max number of messages sent in total (by all processes) per global_period seconds.
+        'global_limit': 50,
+        'global_period': 1,
+        # Max number of times a message is tried when Discord fails or rate limits.
+        'attempts': 3,
+        # Seconds to wait before trying a message again, doubled for every following attempt.
+        'retry_delay': 1
+    },
+    'covers': {
+        # Folder the downloaded cover images are cached in.
+        'path': 'cache/covers',
+        # Max MB of decoded cover images kept in memory.
+        'memory_size': 64,
+        # Max MB of cover images kept on disk.
+        'disk_size': 256
+    },
+    'compositor': {
+        # Max height in pixels of the strip of cover images sent with MangaDex updates.
+        'max_height': 300,
+        # Max width in pixels of the strip, covers are made smaller to fit.
+        'max_width': 2000,
+        # Format of the strip, JPEG or WEBP.
+        'format': 'JPEG',
+        # Quality of the strip from 1 to 100.
+        'quality': 80,
+        # Max MB of built strips kept in memory for reuse.
+        'strip_cache_size': 16
+    },
+    'manga_cache': {
+        # Seconds the title and cover of a manga are cached.
+        'ttl': 86400,
+        # Max number of mangas cached in memory.
+        'max_size': 10000,
+        # Also cache in the database so the cache survives restarts.
+        'persist': True
+    },
+    'cluster': {
+        # Index (from 0) of this process when the bot runs as several processes. Usually given on the command line.
+        'process_index': 0,
+        # Number of processes the bot runs as.
+        'process_count': 1,
+        # Number of Discord shards, split between the processes. null to not use shards with a single process.
+        'shard_count': None,
+        # Seconds a process keeps the feeds it polls after it stopped renewing them.
+        'lease_seconds': 900
+    },
+    'metrics': {
+        # Address the metrics are served on for Prometheus.
+        'host': '127.0.0.1',
+        # Port the metrics are served on, plus the index of the process. null to not serve the metrics.
+        'port': None
+    },
+    'database': {
+        # Number of connections the pool opens when created.
+        'min_size': 1,
+        # Max number of connections the pool may open.
+        'max_size': 10
+    }
+}
+
+
+"""
+Merges the user's settings on top of the defaults. Nested sections are merged key by key so a settings file only
+needs to contain the values that should be changed.
+"""
+def _merge(defaults, overrides):
+    merged = copy.deepcopy(defaults)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+"""
+Reads the settings file (see settings_sample) and returns the settings. The file is optional, the defaults are used
+if it does not exist.
+"""
+def load(path='settings'):
+    if not os.path.isfile(path):
+        return copy.deepcopy(DEFAULTS)
+
+    with open(path, 'r') as settings_file:
+        return _merge(DEFAULTS, json.load(settings_file))
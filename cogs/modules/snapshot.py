@@ -0,0 +1,97 @@
+from datetime import datetime
+import base64
+import json
+import os
+import time
+# Internal modules
+import cogs.modules.settings as settings
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return {'bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, datetime):
+        return {'datetime': value.isoformat()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if 'bytes' in value:
+            return base64.b64decode(value['bytes'])
+        return datetime.fromisoformat(value['datetime'])
+    return value
+
+
+"""
+Returns the file the snapshot of a kind of subscriptions (see feeds) is saved in by this process.
+"""
+def get_path(kind, process_index=0):
+    return os.path.join(settings.load()['startup']['snapshot_path'], f"{kind}-{process_index}.json")
+
+
+"""
+Saves the pending values of the buffers, given as a dict of names to buffers.
+
+The cogs buffer the state of the feeds they poll (see psql.WriteBuffer) and write it every reload. When the bot shuts
+down there is often no time left to write it, so the buffers are saved right away (blocking) when a cog is unloaded
+and put back with restore when it starts again, to be written by the first reload.
+"""
+def save(path, buffers):
+    data = {
+        'saved_at': time.time(),
+        'buffers': {
+            name: [[key, [_encode(value) for value in values]] for key, values in buffer.pending.items()]
+            for name, buffer in buffers.items()
+        }
+    }
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Write to a temporary file first so a half written file is never read.
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'w') as snapshot_file:
+            json.dump(data, snapshot_file)
+        os.replace(temporary_path, path)
+    except OSError as error:
+        print(f"Failed to save snapshot: {error}")
+
+
+"""
+Puts the values saved in a snapshot back in the buffers, unless the buffers already have newer values for the same
+rows. Snapshots older than max_age seconds are ignored, another process may have polled the feeds since. Returns the
+number of rows restored.
+"""
+def restore(path, buffers, max_age):
+    try:
+        with open(path, 'r') as snapshot_file:
+            data = json.load(snapshot_file)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as error:
+        print(f"Failed to read snapshot: {error}")
+        return 0
+
+    if time.time() - data['saved_at'] > max_age:
+        return 0
+    restored = 0
+    for name, rows in data['buffers'].items():
+        buffer = buffers.get(name)
+        if buffer is None:
+            continue
+        for key, values in rows:
+            if key not in buffer.pending:
+                buffer.pending[key] = tuple(_decode(value) for value in values)
+                restored += 1
+    return restored
+
+
+"""
+Removes a snapshot once everything in it has been written to the database.
+"""
+def discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as error:
+        print(f"Failed to remove snapshot: {error}")
@@ -1,12 +1,23 @@
-import json
 from discord.ext import commands, tasks
-from bs4 import BeautifulSoup
+import asyncpg
+import io
+import time
 import discord
-import feedparser
-import psycopg2
 # Internal modules
+import cogs.modules.cluster as cluster
+import cogs.modules.dispatch as dispatch
+import cogs.modules.feeds as feeds
+import cogs.modules.health as health
+import cogs.modules.http_client as http_client
+import cogs.modules.metrics as metrics
+import cogs.modules.opml as opml
+import cogs.modules.parsing as parsing
+import cogs.modules.poller as poller
 import cogs.modules.psql as psql
 import cogs.modules.rss_parser as rss_parser
+import cogs.modules.scheduler as scheduler
+import cogs.modules.settings as settings
+import cogs.modules.snapshot as snapshot
 
 """
 Retreives the data from RSS URL and return the status codes as well as the data. Return -1 if something went wrong.
@@ -17,26 +28,139 @@ class RSS(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-        # Import database settings from file and set up connection.
-        with open('psql', 'r') as db_file:
-            db_settings = json.load(db_file)
-            self.psql = psql.PSQL(
-                db_settings["host"],
-                db_settings["username"],
-                db_settings["password"],
-                db_settings["database"],
-                db_settings["port"]
-            )
+        # Shared database connection pool owned by the bot.
+        self.psql = psql.get_database(self.bot).acquire()
+        # Changes to the feeds found while polling, written all at once every time the subscriptions are reloaded.
+        self.latest_updates = feeds.latest_buffer(self.psql)
+        self.validator_updates = feeds.validator_buffer(self.psql)
+        self.fetch_stats = feeds.stats_buffer(self.psql)
+        self.schedule_updates = feeds.schedule_buffer(self.psql)
+        self.health_updates = feeds.health_buffer(self.psql)
+
+        # Which feeds this process polls, owned by the bot.
+        self.cluster = cluster.get_cluster(self.bot)
+        # The buffers by name, saved to a snapshot when the cog is unloaded.
+        self.buffers = {
+            'latest': self.latest_updates,
+            'validators': self.validator_updates,
+            'stats': self.fetch_stats,
+            'schedule': self.schedule_updates,
+            'health': self.health_updates
+        }
+        # Changes which could not be saved to the database when the bot last stopped are saved by the first reload.
+        self.snapshot_path = snapshot.get_path(feeds.RSS, self.cluster.process_index)
+        snapshot.restore(self.snapshot_path, self.buffers, max_age=self.cluster.lease_seconds)
+        # Shared HTTP session owned by the bot.
+        self.http_client = http_client.get_client(self.bot).acquire()
+        # Shared pool of processes parsing the feeds, owned by the bot.
+        self.parser = parsing.get_parser(self.bot).acquire()
+        # Sends the updates in the background, shared by every cog.
+        self.dispatcher = dispatch.get_dispatcher(self.bot).acquire()
+
+        # Fetches the feeds concurrently within the configured limits.
+        poller_settings = settings.load()['poller']
+        self.poller = poller.Poller(
+            concurrency = poller_settings['concurrency'],
+            per_host = poller_settings['per_host']
+        )
 
-        # Start looking for updates as soon as the bot is ready every 3 hours.
+        # Decides when each feed is polled, every 3 hours until it has learned how often the feed changes.
+        scheduler_settings = settings.load()['scheduler']
+        self.scheduler = scheduler.Scheduler(
+            default_interval = scheduler_settings['rss_interval'],
+            min_interval = scheduler_settings['min_interval'],
+            max_interval = scheduler_settings['max_interval']
+        )
+        # Feed ID -> subscriptions of the feed.
+        self.subscriptions = {}
+        self.polls = set()
+        # Backs off failing feeds and disables dead ones.
+        self.health = health.get_health()
+        # Feed ID -> seconds until the host of the feed is tried again, for feeds not polled because it is down.
+        self.host_down = {}
+        # Subscriptions of the feeds disabled since the last reload, their users are told at the next reload.
+        self.disabled = []
+        # Seconds the first polls are spread over.
+        self.warmup = settings.load()['startup']['warmup']
+
+        # Start looking for updates as soon as the bot is ready.
+        self.look_for_updates_rss.change_interval(seconds=scheduler_settings['reload_interval'])
         self.look_for_updates_rss.start(self.bot)
+        self.poll_due_feeds.start()
+
+    """
+    Stops looking for updates when the cog is unloaded and closes it.
+    """
+    def cog_unload(self):
+        self.look_for_updates_rss.cancel()
+        self.poll_due_feeds.cancel()
+        for task in self.polls:
+            task.cancel()
+        # Keep the changes in case there is no time left to save them to the database.
+        snapshot.save(self.snapshot_path, self.buffers)
+        self.bot.loop.create_task(self.close())
+
+    """
+    Saves all buffered changes, gives up the feeds and lets go of the shared HTTP session, dispatcher and database
+    pool.
+    """
+    async def close(self):
+        try:
+            await self.flush()
+            if not any(buffer.pending for buffer in self.buffers.values()):
+                snapshot.discard(self.snapshot_path)
+            # Let another process take over the feeds right away.
+            await self.cluster.release(self.psql, self.subscriptions)
+        finally:
+            await self.http_client.release()
+            await self.parser.release()
+            await self.dispatcher.release()
+            await self.psql.release()
+
+    """
+    Writes the changes buffered during a polling cycle to the database.
+    """
+    async def flush(self):
+        try:
+            await self.latest_updates.flush()
+            await self.validator_updates.flush()
+            await self.fetch_stats.flush()
+            await self.schedule_updates.flush()
+            await self.health_updates.flush()
+        except Exception as error:
+            print(f"Failed to save RSS updates to database: {error}")
+
+    """
+    Downloads an RSS feed using the shared HTTP session.
+    """
+    async def fetch_feed(self, rss_url, etag=None, last_modified=None, make_stream=None):
+        return await rss_parser.get_rss_feed(self.http_client.session, rss_url, etag, last_modified, make_stream)
+
+    """
+    Downloads the feed followed by a group of subscriptions, only if it has changed since it was last downloaded. The
+    feed is parsed while it is downloaded and only up to the updates every subscriber has already seen.
+    """
+    async def fetch_subscriptions(self, subscriptions):
+        feed = subscriptions[0]
+
+        def is_known(entry):
+            return all(feeds.has_seen(subscription, entry, 'title') for subscription in subscriptions)
+
+        start = time.monotonic()
+        resp = await self.fetch_feed(
+            feed['url'], etag=feed['etag'], last_modified=feed['last_modified'],
+            make_stream=lambda: parsing.FeedStream(is_known=is_known)
+        )
+        seconds = time.monotonic() - start
+        feeds.set_fetch_stats(self.fetch_stats, feed['feed_id'], resp['status'], seconds)
+        metrics.record_fetch(feeds.RSS, feed['feed_id'], resp['status'], seconds)
+        return resp
 
     """
     Save an RSS URL to parse.
 
-    Requires the RSS url. First tries to see if is a valid url. Then does a select against the database to see if there
-    is any prior data for this user's ID. Updates the table if a row is found and inserts into the database if nothing
-    is found.
+    Requires the RSS url. First tries to see if is a valid url. Then looks up the user's subscription with this name.
+    Updates the subscription if one is found and adds a new one if nothing is found.
     """
     @commands.command(aliases=['srss'])
     async def setrss(self, ctx, name=None, rss_url=None, *args):
@@ -46,8 +170,8 @@ class RSS(commands.Cog):
         # Database connection
         database = self.psql
 
-        # Check if valid URL
-        resp = await rss_parser.get_rss_feed(rss_url)
+        # Check if valid URL. Parsed the way the polls parse it, so the entries seen now are known to them.
+        resp = await self.fetch_feed(rss_url, make_stream=lambda: parsing.FeedStream())
         if resp['status'] != 200:
             if resp['status'] == -1:
                 await ctx.send(resp['data'])
@@ -57,140 +181,333 @@ class RSS(commands.Cog):
                 await ctx.send('Unhandled error. Check console for error message.')
                 return print(resp['error'])
 
-        # Get latest post and save it along with the other data.
+        # Get latest post and save it along with the other data, unless it was already parsed while downloading.
         try:
-            feed = feedparser.parse(resp['data'])
+            feed = resp['feed'] if resp['feed'] is not None else await self.parser.parse(resp['data'])
         except Exception as error:
             return await ctx.send(f"Failed to parse the RSS:\n{error}")
 
         try:
-            # Connect to the database and look user and RSS name.
-            select = database.select(
-                table = "rss_feeds",
-                columns = "*",
-                condition = f"WHERE user_id = {ctx.author.id} AND name = '{name}'"
-            )
+            # Look up the feed (added if new) and the user's subscription with this name.
+            feed_id = await feeds.get_feed_id(database, rss_url, resp['etag'], resp['last_modified'])
+            # The feed works again, do not let a failure from before overwrite that.
+            self.health_updates.pending.pop(feed_id, None)
+            subscription = await feeds.find_subscription(database, feeds.RSS, ctx.author.id, name)
 
-            if len(select) == 0:
+            if subscription is None:
                 # RSS was not found.
-                # Add URL, ID, latest post, channel ID (the request came from) and name to the database.
-                database.insert(
-                    table = "rss_feeds",
-                    columns = "user_id, url, latest, channel_id, name",
-                    values = f"{ctx.author.id}, '{rss_url}', '{feed['entries'][0]['title']}', {ctx.channel.id}, '{name}'"
+                # Add the subscription with latest post and channel ID (the request came from) to the database.
+                await feeds.add_subscription(
+                    database, feeds.RSS, ctx.author.id, ctx.channel.id, name, feed_id, feed['entries'][0]['title'],
+                    feed['entries']
                 )
                 await ctx.send("Url has been saved. All updates will be sent to this channel.")
             else:
                 # The RSS feed was found.
                 # Update the URL and the channel ID (the request came from).
-                database.update(
-                    table = "rss_feeds",
-                    values = f"url='{rss_url}', channel_id={ctx.channel.id}",
-                    condition = f"WHERE id = '{select[0][0]}'"
+                await feeds.update_subscription(
+                    database, subscription['subscription_id'], feed_id, ctx.channel.id, feed['entries'][0]['title'],
+                    feed['entries']
                 )
                 await ctx.send("URL has been updated. All updates will be sent to this channel.")
-        except psycopg2.OperationalError as error:
+        except (asyncpg.PostgresError, OSError) as error:
             # Something went wrong.
             await ctx.send(error)
 
+    """
+    Subscribes to every feed of an OPML file attached to the message, as exported by most feed readers. Updates are
+    sent to the channel the command came from.
 
-    @tasks.loop(hours=3)
-    async def look_for_updates_rss(self, bot, *args):
-        self.bot = bot
-        database = self.psql
-        table = 'rss_feeds'
+    Every feed is downloaded and parsed first, a few at a time, so only working feeds are added and nothing old is sent
+    for them. The progress is shown in a message which is edited as the feeds are checked. Feeds the user already
+    follows under the same name are updated like setrss would.
+    """
+    @commands.command(aliases=['iopml'])
+    async def importopml(self, ctx):
+        if not ctx.message.attachments:
+            return await ctx.send('The OPML file is missing. Attach it to the message `!importopml`.')
+        attachment = ctx.message.attachments[0]
+        opml_settings = settings.load()['opml']
+        if attachment.size > opml_settings['max_size'] * 2 ** 20:
+            return await ctx.send(f"The OPML file is too large (max {opml_settings['max_size']} MB).")
 
-        # Get all RSS feeds to check for updates.
         try:
-            select = database.select(table = table, columns = "*")
-        except Exception as error:
-            return print(f"Failed to connect to databse: {error}")
-
-        # No data (no user has it set up yet).
-        if len(select) == 0:
-            return print("No user set up yet. (RSS feed)")
-        else:
-            # Loop all users' feed.
-            for rss_feed in select:
-                # User's data.
-                db_id = rss_feed[0]
-                user_id = rss_feed[1]
-                rss_url = rss_feed[2]
-                latest = rss_feed[3]
-                channel = self.bot.get_channel(rss_feed[4])
-                rss_feed_name = rss_feed[5]
-
-                # Get rss data async
-                resp = await rss_parser.get_rss_feed(rss_url)
-                # Failed to get data
-                if resp['status'] != 200:
-                    if resp['status'] != -1:
-                        return await channel.send(f"Received error for <@{user_id}>: {resp['error']}")
-                    else:
-                        return await channel.send(f"Could not get updates for <@{user_id}>: {resp['error']}.")
+            outlines = opml.parse_opml(await attachment.read())
+        except opml.OPMLError as error:
+            return await ctx.send(f"Failed to read the OPML file: {error}")
+        except discord.HTTPException as error:
+            return await ctx.send(f"Failed to download the OPML file: {error}")
+        if not outlines:
+            return await ctx.send('The OPML file has no feeds.')
 
-                # Parse data
+        progress = await ctx.send(f"Checking {len(outlines)} feeds...")
+        checked = 0
+        last_progress = time.monotonic()
+        # Name -> (url, response, parsed feed) of the working feeds.
+        valid = {}
+        # (name, reason) of the feeds which could not be imported.
+        failed = []
+
+        async def fetch(outline):
+            return await self.fetch_feed(outline['url'], make_stream=lambda: parsing.FeedStream())
+
+        async def handle(outline, resp):
+            nonlocal checked, last_progress
+            try:
+                if resp['status'] != 200:
+                    failed.append((outline['name'], resp['data'] if resp['status'] == -1 else resp['error']))
+                    return
                 try:
-                    feed = feedparser.parse(resp['data'])
+                    feed = resp['feed'] if resp['feed'] is not None else await self.parser.parse(resp['data'])
                 except Exception as error:
-                    return await channel.send(f"Failed to parse the RSS:\n{error}")
-
-                if latest is None:
-                    # First time parsing this RSS feed.
-                    # Save latest update to database.
-                    database.update(
-                        table = table,
-                        values = f"latest = '{feed['entries'][0]['title']}'",
-                        condition = f"WHERE id = {db_id}"
+                    failed.append((outline['name'], f"Failed to parse the RSS: {error}"))
+                    return
+                valid[outline['name']] = (outline['url'], resp, feed)
+            finally:
+                checked += 1
+                if time.monotonic() - last_progress >= opml_settings['progress_interval']:
+                    last_progress = time.monotonic()
+                    try:
+                        await progress.edit(content=f"Checked {checked} of {len(outlines)} feeds...")
+                    except discord.HTTPException:
+                        pass
+
+        # A global limit of its own so a large import does not hold up polling, but the per host limits are shared with
+        # the polls so a host never gets more than per_host requests at a time.
+        importer = self.poller.sharing_hosts(opml_settings['concurrency'])
+        await importer.run([(outline['url'], outline) for outline in outlines], fetch, handle)
+        # Failures in the order of the file.
+        order = {outline['name']: index for index, outline in enumerate(outlines)}
+        failed.sort(key=lambda failure: order[failure[0]])
+
+        if valid:
+            try:
+                # Two statements for the whole file, however many feeds it has.
+                feed_ids = await feeds.get_feed_ids(self.psql, [
+                    (url, resp['etag'], resp['last_modified']) for url, resp, _ in valid.values()
+                ])
+                for feed_id in feed_ids.values():
+                    self.health_updates.pending.pop(feed_id, None)
+                await feeds.upsert_subscriptions(self.psql, feeds.RSS, ctx.author.id, ctx.channel.id, [
+                    (
+                        name, feed_ids[rss_parser.normalize_url(url)],
+                        feed['entries'][0]['title'] if feed['entries'] else None, feed['entries']
                     )
-                    await channel.send(f"Latest update has been saved and you will be informed of updates in the future. ({rss_feed_name})")
-
-                elif latest != feed['entries'][0]['title']:
-                    # Users has updates.
-                    stop_looking = False
-
-                    # Loop all chapters.
-                    for update in feed['entries']:
-                        if update['title'] == latest:
-                            # Current update is the latest. Stop looking for more.
-                            stop_looking = True
-                        else:
-                            # Message for removed embeds and phone notification text.
-                            message = f"*{rss_feed_name}* - {update['title']}"
-                            # Gather data for embed.
-                            embed_title        = update['title']
-                            embed_post_link    = update['link']
-                            embed_description  = BeautifulSoup(update['description'], features='html.parser').p.text
-                            embed_author_name  = feed['feed']['title_detail']['value']
-                            embed_author_link  = feed['feed']['link']
-                            try:
-                                embed_author_icon  = feed['feed']['image']['href']
-                            except KeyError:
-                                embed_author_icon = ''
-
-                            # Create embed.
-                            embed=discord.Embed(title=embed_title, url=embed_post_link, description=embed_description)
-                            embed.set_author(name=embed_author_name, url=embed_author_link, icon_url=embed_author_icon)
-
-                            # Send update to channel.
-                            await channel.send(embed=embed, content=message)
-                            # Add name of update.
-
-                        if stop_looking:
-                            # All updates found.
-                            # Update database with new latest update.
-                            database.update(
-                                table = "rss_feeds",
-                                values = f"latest='{feed['entries'][0]['title']}'",
-                                condition = f"WHERE id = {db_id}"
-                            )
-
-                            # Stop the loop.
-                            break
+                    for name, (url, _, feed) in valid.items()
+                ])
+            except (asyncpg.PostgresError, OSError) as error:
+                return await progress.edit(content=f"Failed to save the feeds: {error}")
+
+        summary = f"Imported {len(valid)} of {len(outlines)} feeds. All updates will be sent to this channel."
+        for name, reason in failed:
+            line = f"\n- {name}: {reason}"
+            # Discord messages are at most 2000 characters.
+            if len(summary) + len(line) > 1990:
+                summary += "\n..."
+                break
+            summary += line
+        try:
+            await progress.edit(content=summary)
+        except discord.HTTPException:
+            await ctx.send(summary)
+
+    """
+    Sends the user's RSS subscriptions as an OPML file, which can be imported by most feed readers or by importopml.
+    """
+    @commands.command(aliases=['eopml'])
+    async def exportopml(self, ctx):
+        try:
+            subscriptions = await feeds.user_subscriptions(self.psql, feeds.RSS, ctx.author.id)
+        except (asyncpg.PostgresError, OSError) as error:
+            return await ctx.send(error)
+        if not subscriptions:
+            return await ctx.send('You have no RSS subscriptions. Add one with `!setrss Name https://rss.url`.')
+
+        data = opml.build_opml(
+            f"RSS subscriptions of {ctx.author}",
+            [(subscription['name'], subscription['url']) for subscription in subscriptions]
+        )
+        await ctx.send(
+            f"Your {len(subscriptions)} RSS subscriptions.", file=discord.File(io.BytesIO(data), filename='feeds.opml')
+        )
+
+
+    """
+    Saves what has changed since the last run and reloads the subscriptions (every 5 minutes by default) so the
+    scheduler picks up new and removed feeds.
+    """
+    @tasks.loop(minutes=5)
+    async def look_for_updates_rss(self, bot, *args):
+        with metrics.RELOAD_SECONDS.time(kind=feeds.RSS):
+            self.bot = bot
+            database = self.psql
+
+            # Save the new state of every feed polled since the last run in one go.
+            await self.flush()
+            self.notify_disabled()
+
+            # Get all RSS subscriptions, grouped by feed so every feed is only downloaded and parsed once.
+            try:
+                subscriptions = await feeds.load_subscriptions(database, feeds.RSS, self.subscriptions)
+                # Only keep the feeds this process polls when the bot runs as several processes.
+                self.subscriptions = await self.cluster.claim(database, subscriptions)
+            except Exception as error:
+                return print(f"Failed to connect to databse: {error}")
+
+            # Feeds due when the bot starts are not all polled at once.
+            warmup = self.warmup if not self.scheduler.entries else 0
+            feeds.schedule_subscriptions(self.scheduler, self.subscriptions, warmup)
+
+    """
+    Tells every user which of their feeds have been disabled since the last reload, in a single message per channel.
+    """
+    def notify_disabled(self):
+        disabled, self.disabled = self.disabled, []
+        users = {}
+        for subscription in disabled:
+            users.setdefault((subscription['channel_id'], subscription['user_id']), []).append(subscription)
+        for (channel_id, user_id), subscriptions in users.items():
+            self.dispatcher.send(
+                channel_id, health.disabled_message(user_id, subscriptions, '`!setrss Name https://rss.url`')
+            )
+
+    """
+    Starts polling every feed as soon as it is due.
+    """
+    @tasks.loop(seconds=0)
+    async def poll_due_feeds(self):
+        for feed_id in await self.scheduler.wait_due():
+            task = self.bot.loop.create_task(self.poll_feed(feed_id))
+            self.polls.add(task)
+            task.add_done_callback(self.polls.discard)
+
+    """
+    Polls a single feed and schedules its next poll based on whether any of its subscribers got something new. A feed
+    which failed is polled again later the more often it failed in a row, and no more once it has been disabled.
+    """
+    async def poll_feed(self, feed_id):
+        start = time.monotonic()
+        changed = False
+        hint = None
+        subscriptions = self.subscriptions.get(feed_id)
+        try:
+            if subscriptions:
+                newest = [subscription['seen'].newest for subscription in subscriptions]
+                hint = await self.poller.poll(
+                    subscriptions[0]['url'], subscriptions, self.fetch_subscriptions, self.handle_feed
+                )
+                changed = newest != [subscription['seen'].newest for subscription in subscriptions]
+        except Exception as error:
+            print(f"Failed to poll feed: {error!r}")
+        finally:
+            if subscriptions and subscriptions[0]['disabled_at'] is not None:
+                self.disable_feed(feed_id, subscriptions)
+            else:
+                # A host that is down is not the feed's fault, it is polled again once the host is tried again.
+                delay = self.host_down.pop(feed_id, None)
+                if delay is None and subscriptions:
+                    delay = self.health.backoff(subscriptions[0])
+                if delay is None:
+                    entry = self.scheduler.reschedule(feed_id, changed, hint)
                 else:
-                    # No updates, nothing to do.
-                    # await channel.send("Nothing new yet.")
-                    pass
+                    entry = self.scheduler.postpone(feed_id, delay)
+                if entry is not None:
+                    feeds.set_schedule(self.schedule_updates, feed_id, entry)
+            metrics.POLL_SECONDS.observe(time.monotonic() - start, kind=feeds.RSS)
+
+    """
+    Stops polling a feed which failed too many times in a row. Its subscribers are told at the next reload.
+    """
+    def disable_feed(self, feed_id, subscriptions):
+        print(f"Disabled {subscriptions[0]['url']} after {subscriptions[0]['consecutive_failures']} failures.")
+        self.scheduler.remove(feed_id)
+        if self.subscriptions.get(feed_id) is subscriptions:
+            del self.subscriptions[feed_id]
+        self.disabled.extend(subscriptions)
+
+    """
+    Parses a downloaded feed once and passes it on to every user following it. Called by the poller with the
+    subscriptions of the feed and the downloaded feed. Returns how long the feed asks not to be polled again, if it
+    does (see scheduler.feed_hint).
+
+    Failures are only recorded (see health.FeedHealth), the users are not told about every single one. Feeds on a host
+    that is down (see health.HostBreaker) were not requested at all, that does not count as a failure.
+    """
+    async def handle_feed(self, subscriptions, resp):
+        # Nothing has changed since the last time.
+        if resp['status'] == 304:
+            self.health.success(self.health_updates, subscriptions)
+            return resp['max_age']
+
+        if resp['status'] == -1 and resp['error'] == 'host_down_error':
+            self.host_down[subscriptions[0]['feed_id']] = resp['retry_in']
+            return
+
+        # Failed to get data
+        if resp['status'] != 200:
+            self.health.failure(
+                self.health_updates, subscriptions, resp['error'] if resp['status'] == -1 else 'http_error'
+            )
+            return
+
+        # Parse data, unless it was already parsed while downloading.
+        try:
+            feed = resp['feed'] if resp['feed'] is not None else await self.parser.parse(resp['data'])
+        except Exception as error:
+            print(f"Failed to parse {subscriptions[0]['url']}: {error!r}")
+            self.health.failure(self.health_updates, subscriptions, 'parse_error')
+            return
+        self.health.success(self.health_updates, subscriptions)
+
+        for subscription in subscriptions:
+            # A failing user should not keep the others from getting their updates.
+            try:
+                await self.send_updates(subscription, feed)
+            except Exception as error:
+                print(f"Failed to send RSS updates to <@{subscription['user_id']}>: {error!r}")
+
+        # Save the validators so the next request only downloads the feed if it has changed.
+        feeds.set_validators(self.validator_updates, subscriptions, resp['etag'], resp['last_modified'])
+        return scheduler.feed_hint(feed, resp['max_age'])
+
+    """
+    Queues all new updates of a parsed feed for a user's channel and marks them as seen.
+    """
+    async def send_updates(self, subscription, feed):
+        # User's data.
+        channel_id = subscription['channel_id']
+        rss_feed_name = subscription['name']
+
+        if feeds.is_new(subscription):
+            # First time parsing this RSS feed.
+            # Save the updates to database.
+            feeds.mark_seen(self.latest_updates, subscription, feed['entries'], feed['entries'][0]['title'])
+            self.dispatcher.send(channel_id, f"Latest update has been saved and you will be informed of updates in the future. ({rss_feed_name})")
+            return
+
+        # Users has updates if any of the updates has not been seen yet.
+        updates = feeds.new_entries(subscription, feed['entries'], 'title')
+        await self.parser.describe(updates)
+        for update in updates:
+            # Message for removed embeds and phone notification text.
+            message = f"*{rss_feed_name}* - {update['title']}"
+            # Gather data for embed.
+            embed_title        = update['title']
+            embed_post_link    = update['link']
+            embed_description  = update['description']
+            embed_author_name  = feed['feed']['title']
+            embed_author_link  = feed['feed']['link']
+            embed_author_icon  = feed['feed']['image']
+
+            # Create embed.
+            embed=discord.Embed(title=embed_title, url=embed_post_link, description=embed_description)
+            embed.set_author(name=embed_author_name, url=embed_author_link, icon_url=embed_author_icon)
+
+            # Queue update for the channel, it may be sent together with other updates.
+            self.dispatcher.send(channel_id, embed=embed, content=message)
+
+        # Update database with the updates seen. Nothing is written if there was nothing new.
+        feeds.mark_seen(self.latest_updates, subscription, feed['entries'], feed['entries'][0]['title'])
 
     # Do not start looking before the bot has connected to Discord nad is ready.
     @look_for_updates_rss.before_loop
@@ -199,5 +516,9 @@ class RSS(commands.Cog):
         await self.bot.wait_until_ready()
         print("Ready start RSS functionality.")
 
+    @poll_due_feeds.before_loop
+    async def before_polling(self):
+        await self.bot.wait_until_ready()
+
 def setup(bot):
     bot.add_cog(RSS(bot))
\ No newline at end of file
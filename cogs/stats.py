@@ -0,0 +1,130 @@
+from discord.ext import commands, tasks
+from aiohttp import web
+import asyncio
+import time
+# Internal modules
+import cogs.modules.cluster as cluster
+import cogs.modules.feeds as feeds
+import cogs.modules.metrics as metrics
+import cogs.modules.settings as settings
+
+# Number of feeds listed by !stats as the slowest.
+SLOWEST_FEEDS = 5
+# Seconds the event loop lag is measured over.
+LOOP_LAG_INTERVAL = 1
+
+
+def _average(histogram, **labels):
+    count, total = histogram.summary(**labels)
+    return f"{total / count * 1000:.0f} ms" if count else "-"
+
+
+def _size(amount):
+    for unit in ('B', 'KB', 'MB'):
+        if amount < 1024:
+            return f"{amount:.0f} {unit}"
+        amount /= 1024
+    return f"{amount:.1f} GB"
+
+
+"""
+Keeps an eye on how the bot is doing: serves the metrics (see metrics) for Prometheus and sums them up with !stats.
+"""
+class Stats(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.started = time.monotonic()
+        self.runner = None
+
+        metrics_settings = settings.load()['metrics']
+        if metrics_settings['port'] is not None:
+            # Every process serves its own metrics on its own port.
+            port = metrics_settings['port'] + cluster.get_cluster(self.bot).process_index
+            self.bot.loop.create_task(self.serve(metrics_settings['host'], port))
+
+        self.measure_loop_lag.start()
+
+    """
+    Stops measuring and serving the metrics when the cog is unloaded.
+    """
+    def cog_unload(self):
+        self.measure_loop_lag.cancel()
+        if self.runner is not None:
+            self.bot.loop.create_task(self.runner.cleanup())
+
+    async def serve(self, host, port):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as error:
+            await runner.cleanup()
+            return print(f"Failed to serve the metrics on {host}:{port}: {error}")
+        self.runner = runner
+
+    async def handle_metrics(self, request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+    """
+    Measures how late the event loop wakes up a task that sleeps for LOOP_LAG_INTERVAL seconds, e.g. because something
+    is blocking it. The loop restarts as soon as an iteration is done as the sleep itself is the interval.
+    """
+    @tasks.loop(seconds=0)
+    async def measure_loop_lag(self):
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        metrics.LOOP_LAG_SECONDS.observe(max(time.perf_counter() - start - LOOP_LAG_INTERVAL, 0))
+
+    """
+    Returns the URL of a feed polled by one of the cogs, or its ID if it is not known.
+    """
+    def feed_name(self, feed_id):
+        for cog in self.bot.cogs.values():
+            subscriptions = getattr(cog, 'subscriptions', {}).get(int(feed_id))
+            if subscriptions:
+                return subscriptions[0]['url']
+        return f"feed {feed_id}"
+
+    @commands.command()
+    async def stats(self, ctx):
+        lines = [f"**Stats of the last {(time.monotonic() - self.started) / 3600:.1f} hours**"]
+
+        for kind in (feeds.RSS, feeds.MANGADEX):
+            fetches = metrics.FETCHES.total(kind=kind)
+            if not fetches:
+                continue
+            not_modified = metrics.FETCHES.total(kind=kind, status=304)
+            failed = metrics.FETCHES.total(kind=kind, status=-1)
+            lines.append(
+                f"{kind}: {fetches} fetches, {not_modified / fetches:.0%} not modified, {failed} failed, "
+                f"fetch {_average(metrics.FETCH_SECONDS, kind=kind)}, "
+                f"poll {_average(metrics.POLL_SECONDS, kind=kind)}, reload {_average(metrics.RELOAD_SECONDS, kind=kind)}"
+            )
+
+        lines.append(
+            f"Parse {_average(metrics.PARSE_SECONDS)}, database {_average(metrics.DB_SECONDS)}, "
+            f"send {_average(metrics.SEND_SECONDS)}, event loop lag {_average(metrics.LOOP_LAG_SECONDS)}"
+        )
+        lines.append(
+            f"{metrics.SENT_MESSAGES.total(result='sent')} messages sent, "
+            f"{metrics.SENT_MESSAGES.total(result='failed')} failed, {metrics.QUEUE_DEPTH.get() or 0} queued, "
+            f"{_size(metrics.DOWNLOADED_BYTES.total())} downloaded"
+        )
+        lines.append(f"{metrics.OPEN_CIRCUITS.get() or 0} hosts down, {metrics.DISABLED_FEEDS.total()} feeds disabled")
+
+        slowest = sorted(metrics.FEED_FETCH_SECONDS.values.items(), key=lambda item: item[1], reverse=True)
+        if slowest:
+            lines.append("Slowest feeds:")
+            for (kind, feed_id), seconds in slowest[:SLOWEST_FEEDS]:
+                lines.append(f"- {self.feed_name(feed_id)} ({kind}): {seconds:.1f} s")
+
+        await ctx.send('\n'.join(lines))
+
+    @measure_loop_lag.before_loop
+    async def before_measuring(self):
+        await self.bot.wait_until_ready()
+
+def setup(bot):
+    bot.add_cog(Stats(bot))
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+import asyncpg
+# Internal modules
+import cogs.modules.psql as psql
+import cogs.modules.rss_parser as rss_parser
+
+# Folder with the migrations, named <version>_<description>.sql.
+MIGRATIONS = 'migrations'
+
+
+"""
+Normalizes the URLs of the tables of the first version of the bot like the bot does (see rss_parser.normalize_url), so
+migration 3 turns URLs which only differ by case, default port or trailing slash into a single feed and the feeds match
+the URLs the bot looks them up by.
+"""
+async def normalize_old_urls(connection):
+    for table, column in (('rss_feeds', 'url'), ('mangadex', 'rss_feed')):
+        rows = await connection.fetch(f"SELECT DISTINCT {column} AS url FROM {table}")
+        changes = [
+            (row['url'], rss_parser.normalize_url(row['url'])) for row in rows
+            if rss_parser.normalize_url(row['url']) != row['url']
+        ]
+        if changes:
+            await connection.executemany(f"UPDATE {table} SET {column} = $2 WHERE {column} = $1", changes)
+
+
+# Version -> function run in the transaction of the migration, before its SQL, for what SQL cannot do.
+PREPARE = {
+    3: normalize_old_urls
+}
+
+
+"""
+Returns all migrations as (version, file name) sorted by version.
+"""
+def find_migrations():
+    migrations = []
+    for file in os.listdir(MIGRATIONS):
+        if file.endswith('.sql'):
+            migrations.append((int(file.split('_', 1)[0]), file))
+    return sorted(migrations)
+
+
+"""
+Creates or upgrades the database tables by running every migration not yet applied, up to and including target (all
+migrations if None). Each migration runs in its own transaction and is recorded in schema_version.
+"""
+async def migrate(target=None):
+    db_settings = psql.load_settings()
+    connection = await asyncpg.connect(
+        host = db_settings["host"],
+        user = db_settings["username"],
+        password = db_settings["password"],
+        port = db_settings["port"],
+        database = db_settings["database"]
+    )
+
+    try:
+        await connection.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version "
+            "(version INTEGER PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+        applied = {row['version'] for row in await connection.fetch("SELECT version FROM schema_version")}
+
+        for version, file in find_migrations():
+            if version in applied:
+                continue
+            if target is not None and version > target:
+                break
+
+            print(f"Applying {file}")
+            with open(os.path.join(MIGRATIONS, file), 'r') as migration_file:
+                statements = migration_file.read()
+            async with connection.transaction():
+                if version in PREPARE:
+                    await PREPARE[version](connection)
+                await connection.execute(statements)
+                await connection.execute("INSERT INTO schema_version (version) VALUES ($1)", version)
+
+        print("Database is up to date.")
+    finally:
+        await connection.close()
+
+
+if __name__ == '__main__':
+    # Optionally migrate up to a given version: python3 migrate.py 2
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    asyncio.get_event_loop().run_until_complete(migrate(target))
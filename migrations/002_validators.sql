@@ -0,0 +1,3 @@
+-- ETag and Last-Modified of the last response, used to make conditional requests.
+ALTER TABLE mangadex ADD COLUMN IF NOT EXISTS etag TEXT, ADD COLUMN IF NOT EXISTS last_modified TEXT;
+ALTER TABLE rss_feeds ADD COLUMN IF NOT EXISTS etag TEXT, ADD COLUMN IF NOT EXISTS last_modified TEXT;
@@ -0,0 +1,51 @@
+-- Every URL is stored once in feeds, users follow feeds through subscriptions.
+CREATE TABLE feeds (
+    id BIGSERIAL PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    etag TEXT,
+    last_modified TEXT,
+    last_fetched_at TIMESTAMPTZ,
+    last_status INTEGER,
+    last_fetch_ms INTEGER
+);
+
+-- kind is either 'rss' or 'mangadex'. MangaDex subscriptions are all named 'MangaDex', one per user.
+CREATE TABLE subscriptions (
+    id BIGSERIAL PRIMARY KEY,
+    feed_id BIGINT NOT NULL REFERENCES feeds (id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    user_id BIGINT NOT NULL,
+    channel_id BIGINT,
+    name TEXT NOT NULL,
+    latest TEXT,
+    UNIQUE (kind, user_id, name)
+);
+CREATE INDEX subscriptions_feed_id_idx ON subscriptions (feed_id);
+
+-- The old URLs have been normalized by migrate.py (see normalize_old_urls) so rows of the same feed are merged here.
+-- Validators are only kept if every old row of a URL had the same ones.
+INSERT INTO feeds (url, etag, last_modified)
+SELECT
+    url,
+    CASE WHEN count(*) = count(etag) AND count(DISTINCT etag) = 1 THEN min(etag) END,
+    CASE WHEN count(*) = count(last_modified) AND count(DISTINCT last_modified) = 1 THEN min(last_modified) END
+FROM (
+    SELECT url, etag, last_modified FROM rss_feeds
+    UNION ALL
+    SELECT rss_feed, etag, last_modified FROM mangadex
+) AS old_feeds
+GROUP BY url;
+
+-- rss_feeds did not enforce unique names, the newest row wins.
+INSERT INTO subscriptions (feed_id, kind, user_id, channel_id, name, latest)
+SELECT feeds.id, 'rss', rss_feeds.user_id, rss_feeds.channel_id, rss_feeds.name, rss_feeds.latest
+FROM rss_feeds JOIN feeds ON feeds.url = rss_feeds.url
+ORDER BY rss_feeds.id DESC
+ON CONFLICT DO NOTHING;
+
+INSERT INTO subscriptions (feed_id, kind, user_id, channel_id, name, latest)
+SELECT feeds.id, 'mangadex', mangadex.user_id, mangadex.channel_id, 'MangaDex', mangadex.chapter_id
+FROM mangadex JOIN feeds ON feeds.url = mangadex.rss_feed;
+
+DROP TABLE rss_feeds;
+DROP TABLE mangadex;
@@ -0,0 +1,6 @@
+-- State of the adaptive scheduler, see cogs/modules/scheduler.py.
+ALTER TABLE feeds
+    ADD COLUMN next_poll_at TIMESTAMPTZ,
+    ADD COLUMN poll_interval INTEGER,
+    ADD COLUMN update_gap INTEGER,
+    ADD COLUMN last_changed_at TIMESTAMPTZ;
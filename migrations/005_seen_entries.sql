@@ -0,0 +1,3 @@
+-- Fingerprints of the entries each subscription has seen, see cogs/modules/seen.py. Subscriptions saved before this
+-- keep finding new entries with latest until their first poll.
+ALTER TABLE subscriptions ADD COLUMN seen BYTEA;
@@ -0,0 +1,7 @@
+-- MangaDex API data of each manga, shared by every user, see cogs/modules/manga_cache.py.
+CREATE TABLE manga_metadata (
+    url TEXT PRIMARY KEY,
+    title TEXT,
+    cover_url TEXT,
+    fetched_at TIMESTAMPTZ NOT NULL
+);
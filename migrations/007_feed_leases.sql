@@ -0,0 +1,4 @@
+-- Which process polls a feed when the bot runs as several processes, see cogs/modules/cluster.py.
+ALTER TABLE feeds
+    ADD COLUMN lease_owner TEXT,
+    ADD COLUMN lease_until TIMESTAMPTZ;
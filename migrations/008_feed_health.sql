@@ -0,0 +1,6 @@
+-- Health of each feed, see cogs/modules/health.py. Disabled feeds are no longer polled.
+ALTER TABLE feeds
+    ADD COLUMN consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN last_success_at TIMESTAMPTZ,
+    ADD COLUMN last_error TEXT,
+    ADD COLUMN disabled_at TIMESTAMPTZ;
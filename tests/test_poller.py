@@ -0,0 +1,37 @@
+import asyncio
+import time
+import unittest
+# Internal modules
+from cogs.modules.poller import Poller
+
+
+class PollerTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Fetches waiting for a busy host must not keep the feeds of other hosts from being fetched.
+    """
+    async def test_busy_host_does_not_hold_global_slots(self):
+        poller = Poller(concurrency=4, per_host=2)
+        jobs = [(f"http://slow.test/{i}", 'slow') for i in range(8)]
+        jobs += [(f"http://fast.test/{i}", 'fast') for i in range(4)]
+        start = time.monotonic()
+        fast_done = []
+
+        async def fetch(item):
+            await asyncio.sleep(1 if item == 'slow' else 0.01)
+
+        async def handle(item, result):
+            if item == 'fast':
+                fast_done.append(time.monotonic() - start)
+
+        run = asyncio.ensure_future(poller.run(jobs, fetch, handle))
+        try:
+            await asyncio.sleep(0.5)
+            self.assertEqual(len(fast_done), 4)
+            self.assertLess(max(fast_done), 0.2)
+        finally:
+            run.cancel()
+            await asyncio.gather(run, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    unittest.main()